@@ -3,10 +3,14 @@ from tkinter.messagebox import askyesno
 import pandas as pd
 import h5py
 from PhotostimulatorTool import analyze_latency
+from UserInterfaceApps.RunFileWriter import RunFileWriter
 import matplotlib.pyplot as plt
 import numpy as np
 import pathlib
 
+# the recorded waveform starts PRETRIGGER_MS (1 sample per ms) before the trigger
+PRETRIGGER_MS = 2000
+
 def extract_latencies():
     filetypes = (
         ('HDF5 files', '*.hdf5'),
@@ -37,6 +41,7 @@ def extract_latencies():
             'Good Trial': [],
             'Comments': [],
             'Video File': [],
+            'Response Frame': [],
             'Plot File': []
         }
         filepath = pathlib.Path(filename)
@@ -48,13 +53,17 @@ def extract_latencies():
         data_file = h5py.File(filename,'r')
         for mouse,mouse_obj in data_file.items():
             for trial,trial_obj in mouse_obj.items():
+                frame_times = get_frame_times(trial_obj)
+                # frame times start with the recording, the waveform is launched wave_start_time (s) later
+                # trials saved without it are assumed to launch with the recording
+                wave_start_time = trial_obj.attrs.get('wave_start_time', default=0.0)
                 for name, trial_member in trial_obj.items():
                     if 'wave' in name:
                         mode = trial_member.attrs.get('mode',default=False)
                         mode = mode.decode('utf-8')
                         blue = trial_member[0]
                         red = trial_member[-1]
-                        latency = analyze_latency(red) - 2000
+                        latency = analyze_latency(red) - PRETRIGGER_MS
                         data['Mouse'].append(mouse)
                         data['Trial'].append(trial_obj.attrs['num'])
                         data['Datetime'].append(trial_obj.attrs['timestamp'].decode('utf-8'))
@@ -76,7 +85,7 @@ def extract_latencies():
                             data['Stimulus Length (ms)'].append(trial_member.attrs['blue_length'])
                             this_plot_path = plot2(trial_member, latency, plot_path, parent, mouse, trial_obj.attrs['num'])
                             if check_latency:
-                                t = np.arange(0,len(red)) - 2000
+                                t = np.arange(0,len(red)) - PRETRIGGER_MS
                                 title = '{m} Trial: {tr} Time: {t}'.format(m=mouse,tr=trial_obj.attrs['num'],t=trial_obj.attrs['timestamp'].decode('utf-8'))
                                 a = latency_plot(t, latency, blue, red, title)
                                 
@@ -93,6 +102,11 @@ def extract_latencies():
                             comment = ' '
                         data['Comments'].append(comment)
                         data['Latency (ms)'].append(latency)
+                        # video frame at the response, the waveform trace starts at its launch
+                        if frame_times is not None and not np.isnan(latency):
+                            data['Response Frame'].append(RunFileWriter.frame_at_time(frame_times, wave_start_time + (latency + PRETRIGGER_MS) / 1000.0))
+                        else:
+                            data['Response Frame'].append(np.nan)
                     elif 'substage_frame_times' in name:
                         videopath = trial_member.attrs.get('path',default=None)
                         if videopath:
@@ -104,6 +118,15 @@ def extract_latencies():
         out_filename = filename.split('.')[0] + '_latencies.csv'
         out = pd.DataFrame(data)
         out.to_csv(out_filename,index=False)
+
+
+# per-frame capture times (s) of a trial's substage video, None if not recorded
+def get_frame_times(trial_obj):
+    for name, trial_member in trial_obj.items():
+        if 'substage_frame_times' in name:
+            return np.asarray(trial_member[0])
+    return None
+
 def format_hyperlink(path):
     return '=HYPERLINK("{}","Video Link")'.format(path)
 
@@ -111,7 +134,7 @@ def plot2(data_list, latency, savepath, latency_filepath, mouse, trial):
     fig, ax = plt.subplots(2,1, sharex=True)
     ax[0].plot(data_list[0], c='b')
     ax[1].plot(data_list[1], c='r')
-    ax[1].axvline(latency + 2000, linestyle='--', c='k')
+    ax[1].axvline(latency + PRETRIGGER_MS, linestyle='--', c='k')
     ax[0].set_ylabel('Blue LED Voltage (V)')
     ax[1].set_ylabel('Red LED Voltage (V)')
     ax[1].set_xlabel('Time (ms)')
@@ -127,7 +150,7 @@ def plot3(data_list, latency, savepath, latency_filepath, mouse, trial):
     ax[0].plot(data_list[0], c='g')
     ax[1].plot(data_list[1], c='gray')
     ax[2].plot(data_list[2], c='r')
-    ax[2].axvline(latency + 2000, linestyle='--', c='k')
+    ax[2].axvline(latency + PRETRIGGER_MS, linestyle='--', c='k')
     ax[0].set_ylabel('Green LED Voltage (V)')
     ax[1].set_ylabel('IR Laser Voltage (V)')
     ax[2].set_ylabel('Red LED Voltage (V)')
@@ -0,0 +1,142 @@
+'''
+Benchmark closed-loop paw centering on the simulated camera, tracker and stage
+
+Runs MouseTrackingController.autodetect against UserInterfaceApps.Simulation:
+each trial puts the paw at a random offset from the target and waits until the
+paw is centred (or the detection limit). Reports per trial the time until the
+paw was centred, the time until it entered the tolerance, the overshoot past
+the target and the control loop timing (see ControlLoopStats).
+
+usage: python AutodetectBenchmark.py [-n 10] [--offset 40 120] [--inference-time 0.02] [--dropout-rate 0.1] [--csv results.csv]
+'''
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from Motors import Motors_TMC5072_eval
+from UserInterfaceApps.MouseTrackingController import MouseTrackingController
+from UserInterfaceApps.Simulation import SimulatedStage, SimulatedCamera, SimulatedTracker
+
+
+# largest error past the target, against the direction of the initial offset, of either axis (px)
+# offset: (x, y) initial paw position relative to the target
+def get_overshoot(tracking_data, offset):
+    if len(tracking_data) == 0:
+        return np.nan
+    overshoot = 0.0
+    for column, axis_offset in ((1, offset[0]), (3, offset[1])):
+        overshoot = max(overshoot, np.max(-np.sign(axis_offset) * tracking_data[:, column]))
+    return overshoot
+
+# run one trial from a paw position
+# return: {'centred', 'time', 'settle_time', 'overshoot', 'period_mean', 'period_max', 'missed_ticks', 'staleness_mean', 'staleness_p95',
+# 'latency_p50', 'latency_p99'} (frame to motor command, see LatencyStats)
+def run_trial(controller, camera, stage, paw_position, detection_limit, tracking_video):
+    stage.reset()
+    camera.place_paw(*paw_position)
+    controller.reset_data()
+
+    start_time = time.perf_counter()
+    autodetect_thread = threading.Thread(target=controller.autodetect, kwargs={'fn': tracking_video}, daemon=True)
+    autodetect_thread.start()
+    autodetect_thread.join(detection_limit)
+    centred = not autodetect_thread.is_alive()
+    duration = time.perf_counter() - start_time
+    if not centred:
+        controller.force_stop()
+        autodetect_thread.join()
+
+    stats = controller.get_control_stats()
+    latency = controller.get_latency_stats()['total']
+    return {
+        'centred': centred,
+        'time': duration if centred else np.nan,
+        'settle_time': duration - controller.get_time_in_tolerance() if centred else np.nan,
+        'overshoot': get_overshoot(controller.get_tracking_data(), (paw_position[0] - camera.target[0], paw_position[1] - camera.target[1])),
+        'period_mean': stats['period_mean'],
+        'period_max': stats['period_max'],
+        'missed_ticks': stats['missed_ticks'],
+        'staleness_mean': stats['staleness_mean'],
+        'staleness_p95': stats['staleness_p95'],
+        'latency_p50': latency['p50'],
+        'latency_p99': latency['p99']
+    }
+
+def run_benchmark(trials, centred_time, detection_limit, offset, inference_time, dropout_rate, command_time, paw_motion, seed=None):
+    random = np.random.default_rng(seed)
+    stage = SimulatedStage(command_time=command_time)
+    camera = SimulatedCamera(stage, paw_motion=paw_motion)
+    results = []
+    try:
+        motors = Motors_TMC5072_eval(2, interface=stage)
+        controller = MouseTrackingController(camera, motors, centred_time, camera.target, tracker_class=SimulatedTracker,
+            tracker_kwargs={'inference_time': inference_time, 'dropout_rate': dropout_rate, 'seed': seed})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for trial in range(trials):
+                distance = random.uniform(*offset)
+                angle = random.uniform(0, 2 * np.pi)
+                paw_position = (camera.target[0] + distance * np.cos(angle), camera.target[1] + distance * np.sin(angle))
+                result = run_trial(controller, camera, stage, paw_position, detection_limit, os.path.join(tmpdir, 'tracking.avi'))
+                result['offset'] = distance
+                results.append(result)
+                print_result(trial + 1, result)
+    finally:
+        camera.terminate()
+        stage.close()
+
+    return results
+
+def print_header():
+    print('{0:>6}{1:>12}{2:>10}{3:>12}{4:>16}{5:>16}{6:>14}{7:>16}{8:>14}{9:>20}'.format(
+        'Trial', 'Offset (px)', 'Time (s)', 'Settle (s)', 'Overshoot (px)', 'Period (ms)', 'Missed ticks', 'Input age (ms)', 'p95 (ms)', 'Latency p50/p99 (ms)'))
+
+def print_result(trial, result):
+    print('{0:>6}{1:>12.1f}{2:>10.2f}{3:>12.2f}{4:>16.1f}{5:>16}{6:>14}{7:>16.1f}{8:>14.1f}{9:>20}'.format(
+        trial, result['offset'], result['time'], result['settle_time'], result['overshoot'],
+        '{0:.1f} / {1:.1f}'.format(result['period_mean'] * 1000, result['period_max'] * 1000), result['missed_ticks'],
+        result['staleness_mean'] * 1000, result['staleness_p95'] * 1000,
+        '{0:.1f} / {1:.1f}'.format(result['latency_p50'] * 1000, result['latency_p99'] * 1000)))
+
+def print_summary(results):
+    centred = [result for result in results if result['centred']]
+    print('Centred: {0}/{1}'.format(len(centred), len(results)))
+    for key, label, scale in (('time', 'Time to centre (s)', 1), ('settle_time', 'Time into tolerance (s)', 1), ('overshoot', 'Overshoot (px)', 1),
+            ('staleness_mean', 'Input age (ms)', 1000), ('period_max', 'Max loop period (ms)', 1000)):
+        values = np.array([result[key] for result in results], dtype=float) * scale
+        values = values[~np.isnan(values)]
+        if len(values):
+            print('{0:<26} mean {1:8.2f}  median {2:8.2f}  max {3:8.2f}'.format(label, values.mean(), np.median(values), values.max()))
+
+def save_csv(results, filename):
+    keys = ['offset', 'centred', 'time', 'settle_time', 'overshoot', 'period_mean', 'period_max', 'missed_ticks', 'staleness_mean', 'staleness_p95', 'latency_p50', 'latency_p99']
+    with open(filename, 'w') as f:
+        f.write(','.join(keys) + '\n')
+        for result in results:
+            f.write(','.join(str(result[key]) for key in keys) + '\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark paw centering on the simulated camera, tracker and stage')
+    parser.add_argument('-n', '--trials', type=int, default=10)
+    parser.add_argument('--centred-time', type=float, default=1.0, help='time the paw must stay centred (s)')
+    parser.add_argument('--detection-limit', type=float, default=15.0, help='give up on a trial after (s)')
+    parser.add_argument('--offset', nargs=2, type=float, default=[40.0, 120.0], help='range of the initial paw distance from the target (px)')
+    parser.add_argument('--inference-time', type=float, default=0.02, help='simulated tracker inference time (s)')
+    parser.add_argument('--dropout-rate', type=float, default=0.0, help='fraction of frames the tracker misses the paw')
+    parser.add_argument('--command-time', type=float, default=SimulatedStage.COMMAND_TIME, help='simulated TMCL round trip (s)')
+    parser.add_argument('--paw-motion', nargs=2, type=float, default=[0.0, 0.0], help='amplitude (px) and frequency (Hz) of the paw\'s own motion')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--csv', help='also write the results to a CSV file')
+    args = parser.parse_args()
+
+    print_header()
+    results = run_benchmark(args.trials, args.centred_time, args.detection_limit, args.offset, args.inference_time,
+        args.dropout_rate, args.command_time, tuple(args.paw_motion), args.seed)
+    print_summary(results)
+    if args.csv:
+        save_csv(results, args.csv)
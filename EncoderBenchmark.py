@@ -0,0 +1,127 @@
+'''
+Benchmark the trial video encoders in VideoEncoders.REGISTRY
+
+Re-encodes a set of recorded trial videos with each encoder and reports encode
+speed, CPU time and file size per trial.
+
+usage: python EncoderBenchmark.py [-e MJPG FFV1 ...] [--csv results.csv] video [video ...]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from UserInterfaceApps.VideoEncoders import VideoEncoders
+
+
+# decode all frames of a video file
+# exceptions: failed to open the video file
+def load_frames(video_file):
+    video_capture = cv2.VideoCapture(video_file)
+    if not video_capture.isOpened():
+        raise Exception('Failed to open video file: ' + video_file)
+
+    fps = video_capture.get(cv2.CAP_PROP_FPS)
+    frames = []
+    while True:
+        ret, frame = video_capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    video_capture.release()
+
+    return frames, fps
+
+# encode frames with one encoder
+# return: (wall time in s, CPU time in s, file size in bytes)
+def encode_frames(encoder, frames, fps, tmpdir):
+    height, width = frames[0].shape[:2]
+    filename = os.path.join(tmpdir, 'benchmark' + VideoEncoders.get_extension(encoder))
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    writer = VideoEncoders.open_writer(encoder, filename, fps, (width, height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+    size = os.path.getsize(filename)
+    os.remove(filename)
+
+    return wall_time, cpu_time, size
+
+def run_benchmark(video_files, encoders):
+    # encoder: [(frames, wall time, CPU time, bytes) per trial]
+    results = {encoder: [] for encoder in encoders}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for video_file in video_files:
+            frames, fps = load_frames(video_file)
+            if not frames:
+                print('Skipping empty video: ' + video_file)
+                continue
+            print('{0}: {1} frames'.format(video_file, len(frames)))
+
+            for encoder in encoders:
+                wall_time, cpu_time, size = encode_frames(encoder, frames, fps or 30, tmpdir)
+                results[encoder].append((len(frames), wall_time, cpu_time, size))
+
+    return results
+
+def summarize(results):
+    rows = []
+    for encoder, trials in results.items():
+        if not trials:
+            continue
+        trials = np.array(trials, dtype=float)
+        frames = trials[:, 0].sum()
+        wall_time = trials[:, 1].sum()
+        rows.append({
+            'encoder': encoder,
+            'trials': len(trials),
+            'encode_fps': frames / wall_time,
+            'cpu_s_per_trial': trials[:, 2].mean(),
+            'wall_s_per_trial': trials[:, 1].mean(),
+            'bytes_per_trial': trials[:, 3].mean()
+        })
+    return rows
+
+def print_summary(rows):
+    print('{0:<8}{1:>8}{2:>14}{3:>16}{4:>16}{5:>18}'.format('Encoder', 'Trials', 'Encode FPS', 'CPU s/trial', 'Wall s/trial', 'MB/trial'))
+    for row in rows:
+        print('{0:<8}{1:>8}{2:>14.1f}{3:>16.2f}{4:>16.2f}{5:>18.2f}'.format(
+            row['encoder'], row['trials'], row['encode_fps'], row['cpu_s_per_trial'], row['wall_s_per_trial'], row['bytes_per_trial'] / 1e6))
+
+def save_csv(rows, filepath):
+    columns = ['encoder', 'trials', 'encode_fps', 'cpu_s_per_trial', 'wall_s_per_trial', 'bytes_per_trial']
+    with open(filepath, 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for row in rows:
+            f.write(','.join(str(row[column]) for column in columns) + '\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark trial video encoders')
+    parser.add_argument('videos', nargs='+', help='recorded trial video files to re-encode')
+    parser.add_argument('-e', '--encoders', nargs='+', default=VideoEncoders.names(), help='encoders to benchmark (default: all registered)')
+    parser.add_argument('--csv', help='also write the results to this .csv file')
+    args = parser.parse_args()
+
+    encoders = []
+    for encoder in args.encoders:
+        if VideoEncoders.is_available(encoder):
+            encoders.append(encoder)
+        else:
+            print('Encoder not available in this OpenCV build: ' + encoder)
+
+    rows = summarize(run_benchmark(args.videos, encoders))
+    print_summary(rows)
+
+    if args.csv:
+        save_csv(rows, args.csv)
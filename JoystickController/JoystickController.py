@@ -2,6 +2,7 @@ from DebugLog.DebugLog import *
 from pygame.locals import *
 from Motors import Motors_TMC5072_eval, Motors_TMC5130_eval
 
+import concurrent.futures
 import time
 
 class MotorController:
@@ -12,6 +13,18 @@ class MotorController:
     MOTOR_STEPS_PER_ROTATION = int(200 * 256)
     MOTOR_STEP_VELOCITY = 75000
 
+    # how long to wait for the boards to report their position status (s)
+    STATUS_TIMEOUT = 1.0
+
+    # wait for position_reached_async() futures of several boards, the boards are queried concurrently
+    # return: if all motors reached their target position, False if a board didn't answer within timeout
+    @staticmethod
+    def all_positions_reached(futures, timeout=STATUS_TIMEOUT):
+        done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+        return not not_done and all(future.result() for future in done)
+
 class PS3GamePad:
     # joysticks
     LEFTJOY_X_AXIS = 0
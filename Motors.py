@@ -16,16 +16,23 @@ class Motors_TMC5072_eval(TMC5072_eval):
     VELOCITY_LOW = 100000 * 2
 
     # def __init__(self, my_interface):
-    def __init__(self, num_motors, port_idx=0):
+    # interface: an open tmcl_interface to use instead of connecting to a board (e.g. Simulation.SimulatedStage)
+    def __init__(self, num_motors, port_idx=0, interface=None):
         # for multiple boards, specify index of port list to use
         # ex. for 2 connected boards at ['COM17', 'COM20'], port 0 = 'COM17' and port 1 = 'COM20'
         port = ""
         if port_idx > 0:
             port = "--port " + str(port_idx)
 
-        self.connectionManager = ConnectionManager(port) #added
-        self.my_interface = self.connectionManager.connect() #added
+        if interface:
+            self.connectionManager = None
+            self.my_interface = interface
+        else:
+            self.connectionManager = ConnectionManager(port) #added
+            self.my_interface = self.connectionManager.connect() #added
         super().__init__(self.my_interface)
+        # configuration registers are cached, field writes only read volatile registers from the board
+        self.enableShadowRegisters()
 
         self.__num_motors = num_motors
 
@@ -45,27 +52,36 @@ class Motors_TMC5072_eval(TMC5072_eval):
 
     def rest_registers(self):
 
+        # start from the board's registers and motion state, e.g. after a board reset
+        self.invalidateShadowRegisters()
+        self.forgetMotion()
+
+        # register writes are batched, one bus round trip per batch
         for DEFAULT_MOTOR in range(self.__num_motors):
-            self.writeRegister(self.registers.A1[DEFAULT_MOTOR], 1000)
-            self.writeRegister(self.registers.V1[DEFAULT_MOTOR], 50000)
-            self.writeRegister(self.registers.D1[DEFAULT_MOTOR], 500)
-            self.writeRegister(self.registers.DMAX[DEFAULT_MOTOR], 500)
-            self.writeRegister(self.registers.VSTART[DEFAULT_MOTOR], 0)
-            self.writeRegister(self.registers.VSTOP[DEFAULT_MOTOR], 10)
-            self.writeRegister(self.registers.AMAX[DEFAULT_MOTOR], 1000)
+            self.writeRegisters([
+                (self.registers.A1[DEFAULT_MOTOR], 1000),
+                (self.registers.V1[DEFAULT_MOTOR], 50000),
+                (self.registers.D1[DEFAULT_MOTOR], 500),
+                (self.registers.DMAX[DEFAULT_MOTOR], 500),
+                (self.registers.VSTART[DEFAULT_MOTOR], 0),
+                (self.registers.VSTOP[DEFAULT_MOTOR], 10),
+                (self.registers.AMAX[DEFAULT_MOTOR], 1000)
+            ])
             self.rotate(DEFAULT_MOTOR, 0)
             self.stop(DEFAULT_MOTOR)
 
-            self.writeRegisterField(self.fields.XACTUAL[DEFAULT_MOTOR], 0)
-            self.writeRegisterField(self.fields.VACTUAL[DEFAULT_MOTOR], 0)
+            self.writeRegisterFields([
+                (self.fields.XACTUAL[DEFAULT_MOTOR], 0),
+                (self.fields.VACTUAL[DEFAULT_MOTOR], 0),
 
-            ## Configure motors for stallguard homing
-            # Stall guard threshold
-            self.writeRegisterField(self.fields.SGT[DEFAULT_MOTOR], self.SG_THRESHOLD)
-            # Set stall guard minimum velocity
-            self.writeRegisterField(self.fields.VCOOLTHRS[DEFAULT_MOTOR], self.SG_VELOCITY)
-            # Enable Stall guard
-            self.writeRegisterField(self.fields.SG_STOP[DEFAULT_MOTOR], 1)
+                ## Configure motors for stallguard homing
+                # Stall guard threshold
+                (self.fields.SGT[DEFAULT_MOTOR], self.SG_THRESHOLD),
+                # Set stall guard minimum velocity
+                (self.fields.VCOOLTHRS[DEFAULT_MOTOR], self.SG_VELOCITY),
+                # Enable Stall guard
+                (self.fields.SG_STOP[DEFAULT_MOTOR], 1)
+            ])
 
             self.readRegisterField(self.fields.EVENT_STOP_SG[DEFAULT_MOTOR])
 
@@ -84,6 +100,16 @@ class Motors_TMC5072_eval(TMC5072_eval):
     def rotate_ccw(self, motor_ID, value):
         self.rotate(motor_ID, -value)
 
+    # return: if all motors of motor_IDs reached their target position
+    def position_reached(self, motor_IDs):
+        values = self.getAxisParameters([(ap, motor_ID) for motor_ID in motor_IDs for ap in (self.APs.ActualPosition, self.APs.TargetPosition)])
+        return all(values[i] == values[i + 1] for i in range(0, len(values), 2))
+
+    # position_reached() on the I/O thread of the board's connection
+    # return: concurrent.futures.Future of the result
+    def position_reached_async(self, motor_IDs):
+        return self.my_interface.submit(self.position_reached, motor_IDs)
+
     def read_stallguard(self):
         self.readRegisterField(self.fields.EVENT_STOP_SG[self.MOTOR_LEADING])
         self.readRegisterField(self.fields.EVENT_STOP_SG[self.MOTOR_FOLLOWING])
@@ -134,7 +160,8 @@ class Motors_TMC5072_eval(TMC5072_eval):
         time.sleep(1)
 
     def __delete__(self, instance):
-        self.connectionManager.disconnect()
+        if self.connectionManager:
+            self.connectionManager.disconnect()
 
 
 class Motors_TMC5130_eval(TMC5130_eval):
@@ -190,6 +217,15 @@ class Motors_TMC5130_eval(TMC5130_eval):
         # TMC5072.writeRegister(TMC5072.registers.AMAX[MOTOR_FOLLOWING], ACCELERATION)
         # TMC5072.writeRegister(TMC5072.registers.DMAX[MOTOR_FOLLOWING], ACCELERATION)
 
+    # return: if the motor reached its target position
+    def position_reached(self):
+        return self.readRegisterField(self.fields.POSITION_REACHED) == 1
+
+    # position_reached() on the I/O thread of the board's connection
+    # return: concurrent.futures.Future of the result
+    def position_reached_async(self):
+        return self.my_interface.submit(self.position_reached)
+
     def rotate_cw(self, motor_ID, value):
         self.rotate(motor_ID, value)
 
@@ -7,6 +7,11 @@ Created on 16.02.2018
 import struct
 
 _PACKAGE_STRUCTURE = ">BBBBIB"
+_PACKAGE_LENGTH    = 9
+
+# Precompiled package structure, and the first 8 bytes the checksum covers
+_PACKAGE_STRUCT    = struct.Struct(_PACKAGE_STRUCTURE)
+_PAYLOAD_STRUCT    = struct.Struct(_PACKAGE_STRUCTURE[:-1])
 
 class TMCL(object):
     @staticmethod
@@ -25,11 +30,7 @@ class TMCL(object):
 
     @staticmethod
     def calculate_checksum(data):
-        checksum = 0
-        for d in data:
-            checksum += d
-        checksum %= 256
-        return checksum
+        return sum(data) & 0xFF
 
 class TMCL_Command(object):
     ROR                         = 1
@@ -130,15 +131,15 @@ class TMCL_Request(TMCL):
 
     @staticmethod
     def from_buffer(data):
-        request_struct = struct.unpack(_PACKAGE_STRUCTURE, data)
-        return TMCL_Request(request_struct[0], request_struct[1], request_struct[2], request_struct[3], request_struct[4], request_struct[5])
+        return TMCL_Request(*_PACKAGE_STRUCT.unpack(data))
 
     def calculate_checksum(self):
-        self.checksum = TMCL.calculate_checksum(self.toBuffer()[:-1])
+        self.checksum = TMCL.calculate_checksum(_PAYLOAD_STRUCT.pack(self.moduleAddress, self.command,
+                                                                     self.commandType, self.motorBank, self.value))
 
     def toBuffer(self):
-        return struct.pack(_PACKAGE_STRUCTURE, self.moduleAddress, self.command,
-                           self.commandType, self.motorBank, self.value, self.checksum)
+        return _PACKAGE_STRUCT.pack(self.moduleAddress, self.command,
+                                    self.commandType, self.motorBank, self.value, self.checksum)
 
     def __str__(self):
         return "TMCL_Request: {0:02X},{1:02X},{2:02X},{3:02X},{4:08X},{5:02X}".format(
@@ -168,15 +169,15 @@ class TMCL_Reply(TMCL):
 
     @staticmethod
     def from_buffer(data):
-        reply_struct = struct.unpack(_PACKAGE_STRUCTURE, data)
-        return TMCL_Reply(reply_struct[0], reply_struct[1], reply_struct[2], reply_struct[3], reply_struct[4], reply_struct[5])
+        return TMCL_Reply(*_PACKAGE_STRUCT.unpack(data))
 
     def calculate_checksum(self):
-        self.checksum = TMCL.calculate_checksum(self.toBuffer()[:-1])
+        self.checksum = TMCL.calculate_checksum(_PAYLOAD_STRUCT.pack(self.reply_address, self.module_address,
+                                                                     self.status, self.command, self.value))
 
     def toBuffer(self):
-        return struct.pack(_PACKAGE_STRUCTURE, self.reply_address, self.module_address,
-                           self.status, self.command, self.value, self.checksum)
+        return _PACKAGE_STRUCT.pack(self.reply_address, self.module_address,
+                                    self.status, self.command, self.value, self.checksum)
 
     def __str__(self):
         return "TMCL_Reply:   {0:02X},{1:02X},{2:02X},{3:02X},{4:08X},{5:02X}".format(
@@ -200,3 +201,90 @@ class TMCL_Reply(TMCL):
     def versionString(self):
         byteString = struct.pack(">BBBIB", self.module_address, self.status, self.command, self.value, self.checksum)
         return str(byteString, "ascii")
+
+class TMCL_Codec(object):
+    """
+    Fast path for encoding TMCL requests and decoding TMCL replies, byte for
+    byte the same as TMCL_Request.toBuffer() and TMCL_Reply.from_buffer():
+    requests are packed with a precompiled struct into a preallocated
+    buffer, the checksum is computed once from the packed bytes, and replies
+    are unpacked in place from the receive buffer without TMCL_Reply objects.
+
+    The returned request views point into the codec's buffer and are only
+    valid until the next encode. An instance must not be shared between
+    threads (tmcl_interface uses one per bus, under its bus lock).
+    """
+    def __init__(self, count=1):
+        """
+        Parameters:
+            count:
+                Type: int, optional, default value: 1
+                Number of requests preallocated, the buffer grows for larger
+                batches.
+        """
+        self.__allocate(count)
+
+    def __allocate(self, count):
+        self.__buffer = bytearray(_PACKAGE_LENGTH * count)
+        self.__view   = memoryview(self.__buffer)
+        self.__count  = count
+
+    def encode(self, moduleAddress, command, commandType, motorBank, value, index=0):
+        """
+        Encode one request at position [index] of the buffer, returns a view
+        of its 9 bytes.
+        """
+        offset = _PACKAGE_LENGTH * index
+        _PAYLOAD_STRUCT.pack_into(self.__buffer, offset, moduleAddress & 0xFF, command & 0xFF,
+                                  commandType & 0xFF, motorBank & 0xFF, value & 0xFFFFFFFF)
+        self.__buffer[offset+8] = sum(self.__view[offset:offset+8]) & 0xFF
+        return self.__view[offset:offset+_PACKAGE_LENGTH]
+
+    def encode_batch(self, moduleAddress, commands):
+        """
+        Encode a list of (command, commandType, motorBank, value) requests
+        back to back, returns a view of all of them.
+        """
+        if len(commands) > self.__count:
+            self.__allocate(len(commands))
+
+        for index, (command, commandType, motorBank, value) in enumerate(commands):
+            self.encode(moduleAddress, command, commandType, motorBank, value, index)
+
+        return self.__view[:_PACKAGE_LENGTH * len(commands)]
+
+    @staticmethod
+    def decode(data, offset=0):
+        """
+        Unpack the reply at [offset] of [data] (any bytes-like object).
+
+        Returns (reply address, module address, status, command, value) or
+        raises ValueError if the checksum is wrong.
+        """
+        replyAddress, moduleAddress, status, command, value, checksum = _PACKAGE_STRUCT.unpack_from(data, offset)
+        if checksum != sum(memoryview(data)[offset:offset+8]) & 0xFF:
+            raise ValueError("Incorrect TMCL reply checksum")
+        return replyAddress, moduleAddress, status, command, value
+
+    @staticmethod
+    def decode_into(data, count, values, statuses=None, commands=None, index=0):
+        """
+        Unpack [count] back to back replies of [data] into preallocated
+        sequences (e.g. lists or array.array), without creating objects per
+        reply: values[index+i] gets the value of reply i, statuses[index+i]
+        its status.
+
+        If [commands] is given, reply i must echo commands[index+i].
+        Raises ValueError on a wrong checksum or command.
+        """
+        view = memoryview(data)
+        for i in range(count):
+            offset = _PACKAGE_LENGTH * i
+            replyAddress, moduleAddress, status, command, value, checksum = _PACKAGE_STRUCT.unpack_from(view, offset)
+            if checksum != sum(view[offset:offset+8]) & 0xFF:
+                raise ValueError("Incorrect checksum of TMCL reply {0}".format(i))
+            if commands is not None and command != commands[index+i]:
+                raise ValueError("TMCL reply {0} is for command {1}, expected {2}".format(i, command, commands[index+i]))
+            values[index+i] = value
+            if statuses is not None:
+                statuses[index+i] = status
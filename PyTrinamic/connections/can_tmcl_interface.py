@@ -0,0 +1,31 @@
+'''
+Created on 18.10.2026
+'''
+
+from PyTrinamic.connections.tmcl_interface import tmcl_interface
+
+class can_tmcl_interface(tmcl_interface):
+    """
+    Base class for TMCL connections over a CAN adapter.
+
+    A CAN adapter queues outgoing messages and buffers the incoming ones, so
+    a batch of TMCL commands is sent back to back before reading the
+    replies. Subclasses implement _send() and _recv() for their adapter.
+    """
+
+    def _send_batch(self, hostID, moduleID, data):
+        """
+            Send the TMCL commands in the bytearray [data] as back to back CAN
+            messages, then read the replies in order.
+
+            This overrides the round trip per command of the tmcl_interface
+            class.
+        """
+        for i in range(0, len(data), 9):
+            self._send(hostID, moduleID, data[i:i+9])
+
+        replies = bytearray()
+        for i in range(0, len(data), 9):
+            replies += self._recv(hostID, moduleID)
+
+        return replies
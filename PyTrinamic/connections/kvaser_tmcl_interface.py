@@ -7,14 +7,14 @@ Created on 03.01.2020
 
 '''
 import can
-from PyTrinamic.connections.tmcl_interface import tmcl_interface
+from PyTrinamic.connections.can_tmcl_interface import can_tmcl_interface
 from can import CanError
 
 _CHANNELS = [
      "0",  "1",  "2",
      ]
 
-class kvaser_tmcl_interface(tmcl_interface):
+class kvaser_tmcl_interface(can_tmcl_interface):
     """
     This class implements a TMCL connection for Kvaser adapter using CANLIB.
     Try 0 as default channel.
@@ -27,7 +27,7 @@ class kvaser_tmcl_interface(tmcl_interface):
         if not port in _CHANNELS:
             raise ValueError("Invalid port")
 
-        tmcl_interface.__init__(self, hostID, moduleID, debug)
+        can_tmcl_interface.__init__(self, hostID, moduleID, debug)
 
         self.__debug    = debug
         self.__channel  = port
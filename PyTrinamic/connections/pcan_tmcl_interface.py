@@ -6,7 +6,7 @@ Created on 31.05.2019
 
 import can
 
-from PyTrinamic.connections.tmcl_interface import tmcl_interface
+from PyTrinamic.connections.can_tmcl_interface import can_tmcl_interface
 from can.interfaces.pcan.pcan import PcanError
 from can import CanError
 
@@ -34,7 +34,7 @@ _CHANNELS = [
     "PCAN_LANBUS13", "PCAN_LANBUS14", "PCAN_LANBUS15", "PCAN_LANBUS16"
     ]
 
-class pcan_tmcl_interface(tmcl_interface):
+class pcan_tmcl_interface(can_tmcl_interface):
     """
     This class implements a TMCL connection over a PCAN adapter.
     """
@@ -46,7 +46,7 @@ class pcan_tmcl_interface(tmcl_interface):
         if not port in _CHANNELS:
             raise ValueError("Invalid port")
 
-        tmcl_interface.__init__(self, hostID, moduleID, debug)
+        can_tmcl_interface.__init__(self, hostID, moduleID, debug)
 
         self._debug    = debug
         self.__channel  = port
@@ -68,6 +68,20 @@ class serial_tmcl_interface(tmcl_interface):
 
         return self._serial.read(9)
 
+    def _send_batch(self, hostID, moduleID, data):
+        """
+            Write all TMCL commands in the bytearray [data] at once and read
+            all replies at once. The module handles the commands in order, so
+            the replies arrive in order.
+
+            This overrides the round trip per command of the tmcl_interface
+            class.
+        """
+        del hostID, moduleID
+
+        self._serial.write(data)
+        return self._serial.read(len(data))
+
     def printInfo(self):
         print("Connection: type=serial_tmcl_interface com=" + self._serial.portstr + " baud=" + str(self._baudrate))
 
@@ -7,11 +7,11 @@ Created on 03.01.2020
 
 '''
 import can
-from PyTrinamic.connections.tmcl_interface import tmcl_interface
+from PyTrinamic.connections.can_tmcl_interface import can_tmcl_interface
 from can import CanError
 from serial.tools.list_ports import comports
 
-class slcan_tmcl_interface(tmcl_interface):
+class slcan_tmcl_interface(can_tmcl_interface):
     """
     This class implements a TMCL connection for CAN over Serial / SLCAN. Comatible with CANable running slcan firmware and similar.
     Set underlying serial device as channel. (e.g. /dev/ttyUSB0, COM8, …)
@@ -22,7 +22,7 @@ class slcan_tmcl_interface(tmcl_interface):
         if type(comPort) != str:
             raise TypeError
 
-        tmcl_interface.__init__(self, hostID, moduleID, debug)
+        can_tmcl_interface.__init__(self, hostID, moduleID, debug)
 
         self.__debug    = debug
         self.__bitrate  = datarate
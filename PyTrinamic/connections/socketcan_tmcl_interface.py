@@ -10,14 +10,14 @@ sudo ip link set can0 down type can bitrate 1000000
 
 import can
 
-from PyTrinamic.connections.tmcl_interface import tmcl_interface
+from PyTrinamic.connections.can_tmcl_interface import can_tmcl_interface
 from can import CanError
 
 _CHANNELS = [
     "can0",  "can1",  "can2",  "can3",  "can4",  "can5",  "can6",  "can7"
     ]
 
-class socketcan_tmcl_interface(tmcl_interface):
+class socketcan_tmcl_interface(can_tmcl_interface):
     """
     This class implements a TMCL connection over a SocketCAN adapter.
     """
@@ -29,7 +29,7 @@ class socketcan_tmcl_interface(tmcl_interface):
         if not port in _CHANNELS:
             raise ValueError("Invalid port")
 
-        tmcl_interface.__init__(self, hostID, moduleID, debug)
+        can_tmcl_interface.__init__(self, hostID, moduleID, debug)
 
         self.__debug    = debug
         self.__channel  = port
@@ -4,7 +4,10 @@ Created on 27.05.2019
 @author: LH
 '''
 
-from PyTrinamic.TMCL import TMCL, TMCL_Request, TMCL_Command, TMCL_Reply
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, RLock
+
+from PyTrinamic.TMCL import TMCL, TMCL_Request, TMCL_Command, TMCL_Reply, TMCL_Codec
 
 from PyTrinamic.helpers import TMC_helpers
 
@@ -24,12 +27,25 @@ class tmcl_interface():
         _send(self, hostID, moduleID, data)
         _recv(self, hostID, moduleID)
 
+    A subclass may override the following function to send a batch of TMCL
+    commands without waiting for each reply (see send_batch()):
+        _send_batch(self, hostID, moduleID, data)
+
     A subclass may use the boolean _debug attribute to toggle printing further
     debug output.
 
+    All requests of one instance (i.e. one bus) are serialized, so several
+    threads may share a connection without mixing up replies. submit(),
+    send_async() and send_batch_async() run requests on a dedicated I/O thread
+    of the bus and return a concurrent.futures.Future instead of blocking.
+
     A subclass may read the _HOST_ID and _MODULE_ID parameters.
     """
 
+    # Maximum number of TMCL commands in flight at once in send_batch(). Larger
+    # batches are split, so a module's receive buffer can't overflow.
+    BATCH_SIZE = 16
+
     def __init__(self, hostID=2, defaultModuleID=1, debug=False):
         """
         Parameters:
@@ -62,11 +78,22 @@ class tmcl_interface():
         self._MODULE_ID  = defaultModuleID
         self._debug      = debug
 
+        # Held for each request/reply exchange, reentrant so a function
+        # running on the I/O thread may send requests itself
+        self._bus_lock   = RLock()
+        # Encodes requests for send() and send_batch(), used under the lock
+        self._codec      = TMCL_Codec(self.BATCH_SIZE)
+        # I/O thread, started by the first submit()
+        self.__executor      = None
+        self.__executor_lock = Lock()
+
     def _send(self, hostID, moduleID, data):
         """
         Send the bytearray [data] representing a TMCL command. The length of
         [data] is 9. The hostID and moduleID parameters may be used for extended
         addressing options available on the implemented communication interface.
+        [data] may be a memoryview into a reused buffer (see TMCL_Codec), it
+        is only valid during the call.
         """
         raise NotImplementedError("The TMCL interface requires an implementation of the send() function")
 
@@ -79,6 +106,22 @@ class tmcl_interface():
         """
         raise NotImplementedError("The TMCL interface requires an implementation of the receive() function")
 
+    def _send_batch(self, hostID, moduleID, data):
+        """
+        Send the bytearray [data] holding several TMCL commands of 9 bytes each
+        and return the replies, in order, as one bytearray of the same length.
+
+        This default implementation does one round trip per command. Subclasses
+        whose bus buffers several commands override it to send them all before
+        reading the replies.
+        """
+        replies = bytearray()
+        for i in range(0, len(data), 9):
+            self._send(hostID, moduleID, data[i:i+9])
+            replies += self._recv(hostID, moduleID)
+
+        return replies
+
     def enableDebug(self, enable):
         """
         Set the debug mode, which dumps all TMCL datagrams written and read.
@@ -100,8 +143,9 @@ class tmcl_interface():
         if self._debug:
             request.dump()
 
-        self._send(self._HOST_ID, moduleID, request.toBuffer())
-        reply = TMCL_Reply.from_buffer(self._recv(self._HOST_ID, moduleID))
+        with self._bus_lock:
+            self._send(self._HOST_ID, moduleID, request.toBuffer())
+            reply = TMCL_Reply.from_buffer(self._recv(self._HOST_ID, moduleID))
 
         if self._debug:
             reply.dump()
@@ -121,19 +165,124 @@ class tmcl_interface():
         if not moduleID:
             moduleID = self._MODULE_ID
 
-        request = TMCL_Request(moduleID, opcode, opType, motor, value)
-
         if self._debug:
-            request.dump()
+            TMCL_Request(moduleID, opcode, opType, motor, value).dump()
 
-        self._send(self._HOST_ID, moduleID, request.toBuffer())
-        reply = TMCL_Reply.from_buffer(self._recv(self._HOST_ID, moduleID))
+        with self._bus_lock:
+            self._send(self._HOST_ID, moduleID, self._codec.encode(moduleID, opcode, opType, motor, value))
+            reply = TMCL_Reply.from_buffer(self._recv(self._HOST_ID, moduleID))
 
         if self._debug:
             reply.dump()
 
         return reply
 
+    def send_batch(self, commands, moduleID=None):
+        """
+        Send several TMCL datagrams and read back their replies. The commands
+        are pipelined (see _send_batch()), at most BATCH_SIZE at a time, so a
+        batch costs about one bus round trip instead of one per command.
+
+        Parameters:
+            commands:
+                Type: list of (opcode, opType, motor, value) tuples
+            moduleID:
+                Type: int, optional, the module all commands are sent to
+
+        Returns a list of TMCL_Reply, one per command in the same order. The
+        replies are built from the status and value of each reply, their
+        addresses are the host and module ID of the batch.
+        Raises ConnectionError if a reply is corrupted or doesn't belong to
+        its command (e.g. a reply went missing).
+        """
+
+        # If no module ID is given, use the default one
+        if not moduleID:
+            moduleID = self._MODULE_ID
+
+        values = [0] * len(commands)
+        statuses = [0] * len(commands)
+        self.send_batch_into(commands, values, moduleID, statuses)
+
+        return [TMCL_Reply(self._HOST_ID, moduleID, status, opcode, value)
+                for (opcode, opType, motor, _), status, value in zip(commands, statuses, values)]
+
+    def send_batch_into(self, commands, values, moduleID=None, statuses=None):
+        """
+        Like send_batch(), but only the reply values are kept: they are
+        unpacked straight into the preallocated sequence [values] (e.g. a list
+        or array.array of at least len(commands) items) without creating a
+        TMCL_Reply per reply. For batched reads on a control loop. The reply
+        statuses are unpacked into [statuses] if given.
+
+        Returns [values].
+        Raises ConnectionError if a reply is corrupted or doesn't belong to
+        its command (e.g. a reply went missing).
+        """
+
+        # If no module ID is given, use the default one
+        if not moduleID:
+            moduleID = self._MODULE_ID
+
+        for opcode, opType, motor, value in commands:
+            if not(type(opcode) == type(opType) == type(motor) == type(value) == int):
+                raise TypeError("Expected integer values")
+
+        opcodes = [opcode & 0xFF for opcode, opType, motor, value in commands]
+        for start in range(0, len(commands), self.BATCH_SIZE):
+            batch = commands[start:start+self.BATCH_SIZE]
+
+            if self._debug:
+                for opcode, opType, motor, value in batch:
+                    TMCL_Request(moduleID, opcode, opType, motor, value).dump()
+
+            with self._bus_lock:
+                data = self._send_batch(self._HOST_ID, moduleID, self._codec.encode_batch(moduleID, batch))
+            if len(data) != 9 * len(batch):
+                raise ConnectionError("Expected {0} TMCL replies, received {1} bytes".format(len(batch), len(data)))
+
+            if self._debug:
+                for i in range(len(batch)):
+                    TMCL_Reply.from_buffer(data[9*i:9*i+9]).dump()
+
+            # Replies echo the command, a mismatch means the replies are out
+            # of step with the requests
+            try:
+                TMCL_Codec.decode_into(data, len(batch), values, statuses, opcodes, start)
+            except ValueError as e:
+                raise ConnectionError("Corrupted TMCL reply in the batch: {0}".format(e)) from e
+
+        return values
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs) on the I/O thread of this bus, e.g. a
+        board function reading several registers. Functions run one after
+        the other in submission order.
+
+        Returns a concurrent.futures.Future of the result: wait with
+        result(timeout), or cancel() it while it hasn't started. A request
+        already on the bus is not interrupted.
+        """
+        with self.__executor_lock:
+            if not self.__executor:
+                self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tmcl_io")
+
+        return self.__executor.submit(function, *args, **kwargs)
+
+    def send_async(self, opcode, opType, motor, value, moduleID=None):
+        """
+        Non-blocking send(), returns a Future of the TMCL_Reply (see submit()).
+        """
+        return self.submit(self.send, opcode, opType, motor, value, moduleID)
+
+    def send_batch_async(self, commands, moduleID=None):
+        """
+        Non-blocking send_batch(), returns a Future of the list of TMCL_Reply
+        (see submit()).
+        """
+        return self.submit(self.send_batch, commands, moduleID)
+
     def sendBoot(self, moduleID=None):
         """
         Send the command for entering bootloader mode. This TMCL command does
@@ -149,7 +298,8 @@ class tmcl_interface():
             request.dump()
 
         # Send the request
-        self._send(self._HOST_ID, moduleID, request.toBuffer())
+        with self._bus_lock:
+            self._send(self._HOST_ID, moduleID, request.toBuffer())
 
     def getVersionString(self, moduleID=None):
         """
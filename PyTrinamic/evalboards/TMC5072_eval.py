@@ -5,6 +5,8 @@ Created on 20.09.2019
 '''
 
 from PyTrinamic.ic.TMC5072.TMC5072 import TMC5072
+from PyTrinamic.TMCL import TMCL_Command
+from PyTrinamic.helpers import TMC_helpers
 
 class TMC5072_eval(TMC5072):
     """
@@ -21,13 +23,90 @@ class TMC5072_eval(TMC5072):
         if channel != 0:
             raise ValueError
 
-        return self.__connection.writeMC(registerAddress, value)
+        reply = self.__connection.writeMC(registerAddress, value)
+        if self.shadow:
+            self.shadow.written(registerAddress, value)
+        self.__checkRampWrite(registerAddress)
+        return reply
 
     def readRegister(self, registerAddress, channel=0, signed=False):
         if channel != 0:
             raise ValueError
 
-        return self.__connection.readMC(registerAddress, signed=signed)
+        value = self.__connection.readMC(registerAddress, signed=signed)
+        if self.shadow:
+            self.shadow.read(registerAddress, value)
+        self.__checkStopEvents(registerAddress, value)
+        return value
+
+    # Batched register access, one bus round trip for all registers (see tmcl_interface.send_batch)
+    def writeRegisters(self, registers):
+        """
+        Write a list of (registerAddress, value) pairs.
+        """
+        self.__connection.send_batch([(TMCL_Command.WRITE_MC, registerAddress, 0, value) for registerAddress, value in registers])
+        for registerAddress, value in registers:
+            if self.shadow:
+                self.shadow.written(registerAddress, value)
+            self.__checkRampWrite(registerAddress)
+
+    def readRegisters(self, registerAddresses, signed=False):
+        """
+        Read a list of registers, returns their values in the same order.
+        """
+        values = self.__connection.send_batch_into([(TMCL_Command.READ_MC, registerAddress, 0, 0) for registerAddress in registerAddresses], [0] * len(registerAddresses))
+        for registerAddress, value in zip(registerAddresses, values):
+            if self.shadow:
+                self.shadow.read(registerAddress, value)
+            self.__checkStopEvents(registerAddress, value)
+        return [TMC_helpers.toSigned32(value) for value in values] if signed else values
+
+    def _registerValues(self, registerAddresses):
+        """
+        Values of a list of registers, the ones not in the shadow registers
+        are read in one batch.
+        """
+        values = {}
+        if self.shadow:
+            for registerAddress in registerAddresses:
+                value = self.shadow.get(registerAddress)
+                if value is not None:
+                    values[registerAddress] = value
+
+        missing = [registerAddress for registerAddress in registerAddresses if registerAddress not in values]
+        if missing:
+            values.update(zip(missing, self.readRegisters(missing)))
+
+        return [values[registerAddress] for registerAddress in registerAddresses]
+
+    def writeRegisterFields(self, fieldValues):
+        """
+        Write a list of (field, value) pairs: one batch reads the registers
+        (only those not in the shadow registers, and not for fields covering a
+        whole register), one batch writes them back with the fields set. Fields
+        of the same register are coalesced into one write.
+        """
+        registerAddresses = []
+        readAddresses = []
+        for field, value in fieldValues:
+            if field[0] not in registerAddresses:
+                registerAddresses.append(field[0])
+            if field[1] != 0xFFFFFFFF and field[0] not in readAddresses:
+                readAddresses.append(field[0])
+
+        values = dict.fromkeys(registerAddresses, 0)
+        values.update(zip(readAddresses, self._registerValues(readAddresses)))
+        for field, value in fieldValues:
+            values[field[0]] = TMC_helpers.field_set(values[field[0]], field[1], field[2], value)
+
+        self.writeRegisters([(registerAddress, values[registerAddress]) for registerAddress in registerAddresses])
+
+    def readRegisterFields(self, fields):
+        """
+        Read a list of register fields, returns their values in the same order.
+        """
+        values = self._registerValues([field[0] for field in fields])
+        return [TMC_helpers.field_get(value, field[1], field[2]) for value, field in zip(values, fields)]
 
     # Axis parameter access
     def getAxisParameter(self, apType, axis):
@@ -36,35 +115,98 @@ class TMC5072_eval(TMC5072):
 
         return self.__connection.axisParameter(apType, axis)
 
+    def getAxisParameters(self, parameters):
+        """
+        Read a list of (apType, axis) axis parameters in one batch, returns
+        their values in the same order.
+        """
+        for apType, axis in parameters:
+            if not(0 <= axis < self.MOTORS):
+                raise ValueError("Axis index out of range")
+
+        replies = self.__connection.send_batch([(TMCL_Command.GAP, apType, axis, 0) for apType, axis in parameters])
+        return [reply.value for reply in replies]
+
     def setAxisParameter(self, apType, axis, value):
         if not(0 <= axis < self.MOTORS):
             raise ValueError("Axis index out of range")
 
-        self.__connection.setAxisParameter(apType, axis, value)
+        with self._motion_lock:
+            self.__connection.setAxisParameter(apType, axis, value)
+            # The firmware maps axis parameters to any register
+            self.invalidateShadowRegisters()
+            self.forgetMotion()
 
     # Motion Control functions
+    # The firmware executes motion commands by writing the ramp registers
+    # A ROR/MST is only sent if it changes the last command to the motor
+    # Motion commands hold _motion_lock from the check until the command is
+    # recorded, the motor may be shared by several threads
     def rotate(self, motor, value):
         if not(0 <= motor < self.MOTORS):
             raise ValueError
 
-        self.__connection.rotate(motor, value)
+        with self._motion_lock:
+            if self._isMotionRedundant(motor, TMCL_Command.ROR, value):
+                return
+
+            self.__connection.rotate(motor, value)
+            self.__invalidateRampRegisters(motor)
+            self.forgetMotion(motor)
+            self._motionSent(motor, TMCL_Command.ROR, value)
 
     def stop(self, motor):
-        self.__connection.stop(motor)
+        with self._motion_lock:
+            if self._isMotionRedundant(motor, TMCL_Command.MST, 0):
+                return
+
+            self.__connection.stop(motor)
+            self.__invalidateRampRegisters(motor)
+            self.forgetMotion(motor)
+            self._motionSent(motor, TMCL_Command.MST, 0)
 
     def moveTo(self, motor, position, velocity=None):
-        if velocity and velocity != 0:
-            # Set maximum positioning velocity
-            self.setAxisParameter(self.APs.MaxVelocity, motor, velocity)
+        with self._motion_lock:
+            if velocity and velocity != 0:
+                # Set maximum positioning velocity
+                self.setAxisParameter(self.APs.MaxVelocity, motor, velocity)
 
-        self.__connection.move(0, motor, position)
+            self.__connection.move(0, motor, position)
+            self.__invalidateRampRegisters(motor)
+            self.forgetMotion(motor)
 
     def moveBy(self, motor, distance, velocity=None):
-        if velocity and velocity != 0:
-            # Set maximum positioning velocity
-            self.setAxisParameter(self.APs.MaxVelocity, motor, velocity)
+        with self._motion_lock:
+            if velocity and velocity != 0:
+                # Set maximum positioning velocity
+                self.setAxisParameter(self.APs.MaxVelocity, motor, velocity)
+
+            self.__connection.move(1, motor, distance)
+            self.__invalidateRampRegisters(motor)
+            self.forgetMotion(motor)
+
+    def __checkRampWrite(self, registerAddress):
+        """
+        Writing a ramp register directly changes what the last motion command
+        did, so the next one is sent in full.
+        """
+        for motor in range(self.MOTORS):
+            if registerAddress in (self.registers.RAMPMODE[motor], self.registers.VMAX[motor], self.registers.AMAX[motor], self.registers.XTARGET[motor]):
+                self.forgetMotion(motor)
+
+    def __checkStopEvents(self, registerAddress, value):
+        """
+        A motor stopped by an end switch or stallGuard event ignores a repeat
+        of its last command, so the next command is sent in full.
+        """
+        for motor in range(self.MOTORS):
+            if registerAddress == self.registers.RAMP_STAT[motor]:
+                for field in (self.fields.EVENT_STOP_L[motor], self.fields.EVENT_STOP_R[motor], self.fields.EVENT_STOP_SG[motor]):
+                    if TMC_helpers.field_get(value, field[1], field[2]):
+                        self.forgetMotion(motor)
 
-        self.__connection.move(1, motor, distance)
+    def __invalidateRampRegisters(self, motor):
+        self.invalidateShadowRegisters([self.registers.RAMPMODE[motor], self.registers.VMAX[motor], self.registers.AMAX[motor], self.registers.XTARGET[motor]])
 
 class _APs():
     TargetPosition                 = 0
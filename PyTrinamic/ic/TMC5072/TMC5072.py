@@ -7,7 +7,10 @@ Created on 20.09.2019
 from PyTrinamic.ic.TMC5072.TMC5072_register import TMC5072_register
 from PyTrinamic.ic.TMC5072.TMC5072_register_variant import TMC5072_register_variant
 from PyTrinamic.ic.TMC5072.TMC5072_fields import TMC5072_fields
+from PyTrinamic.ic.TMC5072.TMC5072_register_volatility import TMC5072_register_volatility
+from PyTrinamic.ic.shadow_registers import shadow_registers
 from PyTrinamic.helpers import TMC_helpers
+from threading import RLock
 
 class TMC5072():
     """
@@ -22,6 +25,17 @@ class TMC5072():
 
         self.MOTORS     = 2
 
+        # Shadow registers, None unless enabled with enableShadowRegisters()
+        self.shadow     = None
+
+        # Last motion command per motor ({command: value}), subclasses that
+        # run rotate/stop as one command skip repeats of it
+        self._motion    = [{} for motor in range(self.MOTORS)]
+        self._motion_stats = {"sent": 0, "suppressed": 0}
+        # Held from the redundancy check of a motion command until it is
+        # recorded, so commands of several threads can't record out of order
+        self._motion_lock = RLock()
+
     def showChipInfo(self):
         print("TMC5072 chip info: The TMC5072 is a dual high performance stepper motor controller and driver IC with serial communication interfaces. Voltage supply: 4,75 - 26V")
 
@@ -31,11 +45,77 @@ class TMC5072():
     def readRegister(self, registerAddress, channel):
         raise NotImplementedError
 
+    def enableShadowRegisters(self, enable=True):
+        """
+        Cache the write-only and configuration registers (see
+        shadow_registers), so field accesses only read volatile registers from
+        the IC. Only valid while all register writes go through this object.
+        Subclasses record register accesses in self.shadow.
+        """
+        self.shadow = shadow_registers.from_tables(TMC5072_register, TMC5072_register_volatility) if enable else None
+
+    def invalidateShadowRegisters(self, registerAddresses=None):
+        if self.shadow:
+            self.shadow.invalidate(registerAddresses)
+
     def writeRegisterField(self, field, value):
-        return self.writeRegister(field[0], TMC_helpers.field_set(self.readRegister(field[0], self.__channel), field[1], field[2], value), self.__channel)
+        return self.writeRegister(field[0], TMC_helpers.field_set(self._fieldRegisterValue(field), field[1], field[2], value), self.__channel)
 
     def readRegisterField(self, field):
-        return TMC_helpers.field_get(self.readRegister(field[0], self.__channel), field[1], field[2])
+        return TMC_helpers.field_get(self._registerValue(field[0]), field[1], field[2])
+
+    def _registerValue(self, registerAddress):
+        """
+        Value of a register, from the shadow registers if cached.
+        """
+        value = self.shadow.get(registerAddress) if self.shadow else None
+        if value is None:
+            value = self.readRegister(registerAddress, self.__channel)
+        return value
+
+    def _fieldRegisterValue(self, field):
+        """
+        Value of the register of a field before writing the field. A field
+        covering the whole register doesn't need it.
+        """
+        if field[1] == 0xFFFFFFFF:
+            return 0
+        return self._registerValue(field[0])
+
+    # Redundant motion command suppression
+    def getMotionStats(self):
+        """
+        Number of motion commands sent to and suppressed from the IC.
+        """
+        return dict(self._motion_stats)
+
+    def resetMotionStats(self):
+        self._motion_stats = {"sent": 0, "suppressed": 0}
+
+    def forgetMotion(self, motor=None):
+        """
+        Forget the last commanded motion values of a motor (all motors if
+        None), e.g. after it was stopped by something else. The next motion
+        command is sent in full.
+        """
+        with self._motion_lock:
+            for m in range(self.MOTORS) if motor is None else [motor]:
+                self._motion[m].clear()
+
+    def _isMotionRedundant(self, motor, key, value):
+        """
+        True if the motor was last commanded [value] for [key], the command
+        is counted as suppressed then. Call with _motion_lock held until the
+        command is sent and recorded with _motionSent().
+        """
+        if key in self._motion[motor] and self._motion[motor][key] == value:
+            self._motion_stats["suppressed"] += 1
+            return True
+        return False
+
+    def _motionSent(self, motor, key, value):
+        self._motion[motor][key] = value
+        self._motion_stats["sent"] += 1
 
     # Motion Control functions
     def rotate(self, motor, value):
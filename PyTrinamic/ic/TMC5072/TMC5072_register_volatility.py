@@ -0,0 +1,27 @@
+'''
+Volatility of the TMC5072 registers, see shadow_registers.
+'''
+
+class TMC5072_register_volatility:
+    """
+    Names of the TMC5072_register registers by volatility class. Registers
+    not listed are configuration registers (read/write, only changed by
+    writes).
+    """
+    # Changed by the IC: status, read-to-clear flags, counters, positions and
+    # velocities. XACTUAL is writable but counts while the motor moves.
+    VOLATILE = [
+        "GSTAT", "IFCNT", "INPUT___OUTPUT", "PWM_STATUS_M1", "PWM_STATUS_M2",
+        "XACTUAL", "VACTUAL", "RAMP_STAT", "XLATCH",
+        "X_ENC", "ENC_STATUS", "ENC_LATCH",
+        "MSCNT", "MSCURACT", "DRV_STATUS"
+    ]
+
+    # Write only: reading them doesn't return the written value
+    WRITE_ONLY = [
+        "SLAVECONF", "X_COMPARE", "PWMCONF_M1", "PWMCONF_M2",
+        "VSTART", "A1", "V1", "AMAX", "VMAX", "DMAX", "D1", "VSTOP", "TZEROWAIT",
+        "IHOLD_IRUN", "VCOOLTHRS", "VHIGH", "VDCMIN", "ENC_CONST",
+        "MSLUT__", "MSLUTSEL", "MSLUTSTART",
+        "COOLCONF", "DCCTRL"
+    ]
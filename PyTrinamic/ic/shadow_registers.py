@@ -0,0 +1,107 @@
+'''
+Shadow copies of IC registers, so read-modify-write field accesses don't
+have to read the register from the IC first.
+'''
+
+class shadow_registers():
+    """
+    Cache of the last value written to (or read from) each register of an IC.
+
+    Every register address has a volatility class:
+        VOLATILE:      changed by the IC itself (positions, velocities,
+                       status and read-to-clear flags), never cached
+        WRITE_ONLY:    reads don't return the register value, cached from
+                       writes only
+        CONFIGURATION: only changed by writes, cached from writes and reads
+
+    Addresses that aren't known are treated as volatile.
+
+    The cache only holds as long as nothing else writes the registers. Callers
+    invalidate registers that are changed behind their back (e.g. by TMCL
+    commands that the module firmware executes on the IC).
+    """
+    VOLATILE      = 0
+    WRITE_ONLY    = 1
+    CONFIGURATION = 2
+
+    def __init__(self, volatility):
+        """
+        Parameters:
+            volatility:
+                Type: dict, {register address: volatility class}
+        """
+        self.__volatility = volatility
+        self.__values     = {}
+
+        self.hits   = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_tables(register_table, volatility_table):
+        """
+        Build the volatility of every register address in a *_register table
+        (e.g. TMC5072_register) from a volatility table listing the register
+        names that are VOLATILE and WRITE_ONLY. All other registers of the
+        table are CONFIGURATION registers. Fields (*_fields tables) resolve
+        through their register address.
+        """
+        volatility = {}
+        for name, addresses in vars(register_table).items():
+            if name.startswith("_"):
+                continue
+            if type(addresses) == int:
+                addresses = [addresses]
+            elif not type(addresses) in (list, tuple):
+                continue
+
+            if name in volatility_table.VOLATILE:
+                register_volatility = shadow_registers.VOLATILE
+            elif name in volatility_table.WRITE_ONLY:
+                register_volatility = shadow_registers.WRITE_ONLY
+            else:
+                register_volatility = shadow_registers.CONFIGURATION
+
+            for address in addresses:
+                volatility[address] = register_volatility
+
+        return shadow_registers(volatility)
+
+    def volatility(self, registerAddress):
+        return self.__volatility.get(registerAddress, shadow_registers.VOLATILE)
+
+    def get(self, registerAddress):
+        """
+        Return the cached value of a register, None if it has to be read from
+        the IC.
+        """
+        value = self.__values.get(registerAddress)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def written(self, registerAddress, value):
+        """
+        Record a value written to a register.
+        """
+        if self.volatility(registerAddress) != shadow_registers.VOLATILE:
+            self.__values[registerAddress] = value & 0xFFFFFFFF
+
+    def read(self, registerAddress, value):
+        """
+        Record a value read from a register.
+        """
+        if self.volatility(registerAddress) == shadow_registers.CONFIGURATION:
+            self.__values[registerAddress] = value & 0xFFFFFFFF
+
+    def invalidate(self, registerAddresses=None):
+        """
+        Drop the cached values of the given registers, of all registers if
+        None.
+        """
+        if registerAddresses is None:
+            self.__values.clear()
+        else:
+            for registerAddress in registerAddresses:
+                self.__values.pop(registerAddress, None)
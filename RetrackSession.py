@@ -0,0 +1,123 @@
+'''
+Re-track the trial videos of HDF5 sessions offline
+
+Each video is decoded and run through the tracker in batches
+(LiveTracker.get_keypoints_batch) in a pool of worker processes, one tracker
+per worker. The keypoints of every frame are written back to the session as
+trial[id]_[camera]_keypoints, an (N frames, keypoints, 3) dataset of
+[x, y, accuracy] in pixels of the video file.
+
+usage: python RetrackSession.py -t my_tracker:MyTracker [-c substage] [-b 32] [-w 4] session.hdf5 [session.hdf5 ...]
+'''
+
+import argparse
+import concurrent.futures
+import importlib
+import os
+
+import cv2
+import h5py
+import numpy as np
+
+from UserInterfaceApps.RunFileWriter import RunFileWriter
+
+
+# tracker of this worker process, see init_worker()
+tracker = None
+
+# tracker_spec: 'module:Class' of a LiveTracker implementation
+def load_tracker_class(tracker_spec):
+    module_name, class_name = tracker_spec.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+def init_worker(tracker_spec):
+    global tracker
+    tracker = load_tracker_class(tracker_spec)()
+
+# trial videos of one camera in a session
+# return: [(mouse group, trial group, keypoints dataset name, absolute video path)]
+def find_videos(hdf5_path, camera=RunFileWriter.SUBSTAGE_CAMERA):
+    # video paths are stored relative to the folder of the session
+    session_folder = os.path.dirname(os.path.abspath(hdf5_path))
+    videos = []
+
+    with h5py.File(hdf5_path, 'r') as hdf5:
+        for mouse, mouse_obj in hdf5.items():
+            for trial, trial_obj in mouse_obj.items():
+                dataset_names = RunFileWriter.format_datafilename('', '', trial_obj.attrs['num'], RunFileWriter.HDF5_EXTENSION, camera)
+                # the substage path is kept on its frame times, other cameras' on their frame info
+                for dataset_name in (dataset_names['frametimes_dataset'], dataset_names['frameinfo_dataset']):
+                    if dataset_name in trial_obj and 'path' in trial_obj[dataset_name].attrs:
+                        videopath = trial_obj[dataset_name].attrs['path'].decode('utf-8')
+                        videos.append((mouse, trial, dataset_names['keypoints_dataset'], os.path.join(session_folder, videopath)))
+                        break
+
+    return videos
+
+# run the worker's tracker over every frame of a video
+# return: (N frames, keypoints, 3) array
+# exceptions: failed to open the video file
+def retrack_video(video_path, batch_size):
+    video_capture = cv2.VideoCapture(video_path)
+    if not video_capture.isOpened():
+        raise Exception('Failed to open video file: ' + video_path)
+
+    keypoints = []
+    batch = []
+    initialized = False
+    while True:
+        ret, frame = video_capture.read()
+        if ret:
+            if not initialized:
+                tracker.initialize(frame)
+                initialized = True
+            batch.append(frame)
+        if batch and (len(batch) == batch_size or not ret):
+            keypoints.append(tracker.get_keypoints_batch(np.stack(batch)))
+            batch = []
+        if not ret:
+            break
+    video_capture.release()
+
+    if not keypoints:
+        return np.empty((0, 0, 3))
+    return np.concatenate(keypoints)
+
+def save_keypoints(hdf5_path, mouse, trial, dataset_name, keypoints, tracker_spec):
+    with h5py.File(hdf5_path, 'a') as hdf5:
+        trial_group = hdf5[mouse][trial]
+        if dataset_name in trial_group:
+            del trial_group[dataset_name]
+        keypoints_dataset = trial_group.create_dataset(dataset_name, keypoints.shape, dtype='f4')
+        keypoints_dataset[:] = keypoints
+        keypoints_dataset.attrs.create('tracker', tracker_spec, dtype=str('a' + str(len(tracker_spec))))
+
+def retrack_sessions(hdf5_paths, tracker_spec, camera=RunFileWriter.SUBSTAGE_CAMERA, batch_size=32, workers=None):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(tracker_spec,)) as executor:
+        futures = {}
+        for hdf5_path in hdf5_paths:
+            for mouse, trial, dataset_name, video_path in find_videos(hdf5_path, camera):
+                future = executor.submit(retrack_video, video_path, batch_size)
+                futures[future] = (hdf5_path, mouse, trial, dataset_name, video_path)
+
+        # results are written by this process only, HDF5 files are not shared between workers
+        for future in concurrent.futures.as_completed(futures):
+            hdf5_path, mouse, trial, dataset_name, video_path = futures[future]
+            try:
+                keypoints = future.result()
+            except Exception as err:
+                print('Failed: ' + video_path + ': ' + str(err))
+                continue
+            save_keypoints(hdf5_path, mouse, trial, dataset_name, keypoints, tracker_spec)
+            print('{0} {1}/{2}: {3} frames'.format(os.path.basename(hdf5_path), mouse, trial, len(keypoints)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-track the trial videos of HDF5 sessions')
+    parser.add_argument('sessions', nargs='+', help='HDF5 session files')
+    parser.add_argument('-t', '--tracker', required=True, help='LiveTracker implementation as module:Class')
+    parser.add_argument('-c', '--camera', default=RunFileWriter.SUBSTAGE_CAMERA, help='camera whose videos to re-track (default: substage)')
+    parser.add_argument('-b', '--batch-size', type=int, default=32, help='frames per get_keypoints_batch call')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    retrack_sessions(args.sessions, args.tracker, args.camera, args.batch_size, args.workers)
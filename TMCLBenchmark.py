@@ -0,0 +1,123 @@
+'''
+Micro-benchmark of the TMCL encode/decode path
+
+Measures TMCL requests encoded and replies decoded per second, with the
+object API (TMCL_Request.toBuffer, TMCL_Reply.from_buffer) and with
+TMCL_Codec, and full tmcl_interface.send()/send_batch()/send_batch_into()
+exchanges on an in-memory loopback connection (no bus time, only the Python
+overhead of every motor command).
+
+usage: python TMCLBenchmark.py [-n 200000] [--repeat 3] [--batch 16]
+'''
+
+import argparse
+import array
+import time
+
+from PyTrinamic.TMCL import TMCL_Command, TMCL_Request, TMCL_Reply, TMCL_Codec, TMCL_Status
+from PyTrinamic.connections.tmcl_interface import tmcl_interface
+
+
+# answers every request with a SUCCESS reply echoing its command and value
+class LoopbackInterface(tmcl_interface):
+    def __init__(self):
+        tmcl_interface.__init__(self)
+        self.__codec = TMCL_Codec(self.BATCH_SIZE)
+        self.__reply = b''
+
+    def _send(self, hostID, moduleID, data):
+        address, command, command_type, motor, value = TMCL_Codec.decode(data)
+        self.__reply = bytes(self.__codec.encode(hostID, moduleID, TMCL_Status.SUCCESS, command, value))
+
+    def _recv(self, hostID, moduleID):
+        return self.__reply
+
+    def _send_batch(self, hostID, moduleID, data):
+        replies = bytearray()
+        for i in range(0, len(data), 9):
+            self._send(hostID, moduleID, data[i:i+9])
+            replies += self.__reply
+        return replies
+
+
+# best rate of repeat runs of fn(iterations)
+# return: operations per second
+def measure(fn, iterations, repeat, operations_per_iteration=1):
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn(iterations)
+        best = min(best, time.perf_counter() - start_time)
+    return iterations * operations_per_iteration / best
+
+def encode_objects(iterations):
+    for i in range(iterations):
+        TMCL_Request(1, TMCL_Command.ROR, 0, 0, i).toBuffer()
+
+def encode_codec(iterations):
+    codec = TMCL_Codec()
+    for i in range(iterations):
+        codec.encode(1, TMCL_Command.ROR, 0, 0, i)
+
+def decode_objects(iterations):
+    reply = TMCL_Reply(2, 1, TMCL_Status.SUCCESS, TMCL_Command.READ_MC, 123456).toBuffer()
+    for _ in range(iterations):
+        TMCL_Reply.from_buffer(reply).value
+
+def decode_codec(iterations):
+    reply = TMCL_Reply(2, 1, TMCL_Status.SUCCESS, TMCL_Command.READ_MC, 123456).toBuffer()
+    for _ in range(iterations):
+        TMCL_Codec.decode(reply)[4]
+
+def get_decode_into(batch):
+    def decode_into(iterations):
+        replies = b''.join(TMCL_Reply(2, 1, TMCL_Status.SUCCESS, TMCL_Command.READ_MC, i).toBuffer() for i in range(batch))
+        values = array.array('L', [0] * batch)
+        statuses = array.array('B', [0] * batch)
+        for _ in range(iterations):
+            TMCL_Codec.decode_into(replies, batch, values, statuses)
+    return decode_into
+
+def get_send(interface):
+    def send(iterations):
+        for i in range(iterations):
+            interface.send(TMCL_Command.ROR, 0, 0, i)
+    return send
+
+def get_send_batch(interface, batch):
+    def send_batch(iterations):
+        commands = [(TMCL_Command.READ_MC, 0x22, 0, 0)] * batch
+        for _ in range(iterations):
+            interface.send_batch(commands)
+    return send_batch
+
+def get_send_batch_into(interface, batch):
+    def send_batch_into(iterations):
+        commands = [(TMCL_Command.READ_MC, 0x22, 0, 0)] * batch
+        values = array.array('L', [0] * batch)
+        for _ in range(iterations):
+            interface.send_batch_into(commands, values)
+    return send_batch_into
+
+def run_benchmark(iterations, repeat, batch):
+    interface = LoopbackInterface()
+    return [
+        ('Encode, TMCL_Request', measure(encode_objects, iterations, repeat)),
+        ('Encode, TMCL_Codec', measure(encode_codec, iterations, repeat)),
+        ('Decode, TMCL_Reply (no checksum check)', measure(decode_objects, iterations, repeat)),
+        ('Decode, TMCL_Codec (checksum checked)', measure(decode_codec, iterations, repeat)),
+        ('Decode, TMCL_Codec.decode_into ({0})'.format(batch), measure(get_decode_into(batch), iterations // batch, repeat, batch)),
+        ('send() round trip', measure(get_send(interface), iterations // 4, repeat)),
+        ('send_batch() ({0}) per command'.format(batch), measure(get_send_batch(interface, batch), iterations // (4 * batch), repeat, batch)),
+        ('send_batch_into() ({0}) per command'.format(batch), measure(get_send_batch_into(interface, batch), iterations // (4 * batch), repeat, batch))
+    ]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark TMCL encoding and decoding')
+    parser.add_argument('-n', '--iterations', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best is reported')
+    parser.add_argument('--batch', type=int, default=16, help='commands per batch')
+    args = parser.parse_args()
+
+    for label, rate in run_benchmark(args.iterations, args.repeat, args.batch):
+        print('{0:<44}{1:>12,.0f} /s{2:>10.2f} us'.format(label, rate, 1e6 / rate))
@@ -0,0 +1,147 @@
+'''
+Tune the paw centering controller offline on recorded tracking data
+
+For every recorded approach (trial[id]_tracking: time, x error, VX, y error, VY)
+a per-axis stage model is fitted, d(error)/dt = gain * VACTUAL + paw motion,
+and the approach is replayed with each candidate controller: the controller
+drives the model at the control rate, sees the error a tracking latency late,
+and the recorded paw motion is added back. Reports the time until the paw was
+centred for centred_time and the RMS error, per controller.
+
+usage: python TuneController.py [--kp 500 1000 2000] [--ki 0 200] [--kd 0] session.hdf5 [session.hdf5 ...]
+'''
+
+import argparse
+import itertools
+
+import h5py
+import numpy as np
+
+from UserInterfaceApps.MouseTrackingController import MouseTrackingController
+from UserInterfaceApps.VelocityController import VelocityController, PIDController
+
+
+# finest time step the fit needs to resolve (s)
+TIME_RESOLUTION = 0.1 / MouseTrackingController.CONTROL_RATE
+
+# VX/VY hold the raw VACTUAL register field, a 24 bit two's complement value
+VACTUAL_BITS = 24
+
+# sign-extend raw VACTUAL values, values that are already negative are kept
+def to_signed_velocity(velocities):
+    velocities = np.asarray(velocities, dtype=np.float64)
+    return np.where(velocities >= 1 << (VACTUAL_BITS - 1), velocities - (1 << VACTUAL_BITS), velocities)
+
+# recorded approaches of all trials
+# legacy sessions stored the tracking data, absolute timestamps included, as float32. Trials whose
+# timestamps can't resolve TIME_RESOLUTION are skipped with a message instead of being fitted on rounded times
+# return: [(trial name, (N, columns) array [time, x error, VX, y error, VY, ...])], see RunFileWriter.TRACKING_COLUMNS
+# VX and VY are sign-extended (see to_signed_velocity)
+def load_tracking_data(hdf5_paths):
+    tracking_data = []
+    for hdf5_path in hdf5_paths:
+        with h5py.File(hdf5_path, 'r') as hdf5:
+            for mouse, mouse_obj in hdf5.items():
+                for trial, trial_obj in mouse_obj.items():
+                    for name, trial_member in trial_obj.items():
+                        if name.endswith('_tracking') and len(trial_member) > 2:
+                            data = np.asarray(trial_member, dtype=np.float64)
+                            resolution = np.spacing(np.abs(trial_member[:, 0]).max())
+                            if resolution > TIME_RESOLUTION:
+                                print('Skipping {0}/{1}: {2} timestamps only resolve {3:.3g} s (legacy tracking data)'.format(
+                                    mouse, trial, trial_member.dtype, resolution))
+                                continue
+                            data[:, 2] = to_signed_velocity(data[:, 2])
+                            data[:, 4] = to_signed_velocity(data[:, 4])
+                            tracking_data.append((mouse + '/' + trial, data))
+    return tracking_data
+
+# fit d(error)/dt = gain * velocity + disturbance by least squares
+# return: (gain in px per velocity unit per s, disturbance (paw motion) in px/s between samples)
+def fit_axis(times, errors, velocities):
+    dt = np.diff(times)
+    valid = dt > 0
+    rates = np.diff(errors)[valid] / dt[valid]
+    velocities = velocities[:-1][valid]
+
+    gain = np.dot(velocities, rates) / np.dot(velocities, velocities) if np.any(velocities) else 0.0
+    disturbance = np.zeros(len(times))
+    disturbance[:-1][valid] = rates - gain * velocities
+    return gain, disturbance
+
+# replay one axis with a controller
+# the motor velocity follows the command as rotate() does: VACTUAL = -velocity (positive velocity rotates ccw)
+# return: (time until centred for centred_time in s, NaN if never, RMS error in px)
+def simulate_axis(controller, times, errors, gain, disturbance, control_rate=MouseTrackingController.CONTROL_RATE,
+        latency=0.05, centred_time=1.0, threshold=MouseTrackingController.ERROR_THRESHOLD):
+    controller.reset()
+    period = 1.0 / control_rate
+    steps = int((times[-1] - times[0]) / period)
+    sim_times = times[0] + np.arange(steps) * period
+
+    error = errors[0]
+    history = np.empty(steps)
+    velocity = 0.0
+    centred_since = None
+    time_to_centre = np.nan
+    for step, t in enumerate(sim_times):
+        history[step] = error
+
+        # the controller sees the error measured latency ago
+        delayed = history[max(0, step - int(round(latency / period)))]
+        velocity = controller.update(delayed, t)
+
+        paw_motion = disturbance[min(np.searchsorted(times, t, side='right') - 1, len(disturbance) - 1)]
+        error += (gain * -velocity + paw_motion) * period
+
+        if abs(error) < threshold:
+            if centred_since is None:
+                centred_since = t
+            if np.isnan(time_to_centre) and t - centred_since >= centred_time:
+                time_to_centre = t - times[0]
+        else:
+            centred_since = None
+
+    return time_to_centre, np.sqrt(np.mean(history ** 2))
+
+def tune(tracking_data, controllers, latency=0.05, centred_time=1.0):
+    # controller: [(time to centre, RMS error) per axis and trial]
+    results = {str(controller): [] for controller in controllers}
+
+    for name, data in tracking_data:
+        times = data[:, 0]
+        for error_column, velocity_column in ((1, 2), (3, 4)):
+            gain, disturbance = fit_axis(times, data[:, error_column], data[:, velocity_column])
+            for controller in controllers:
+                results[str(controller)].append(simulate_axis(controller, times, data[:, error_column], gain, disturbance,
+                    latency=latency, centred_time=centred_time))
+
+    return results
+
+def print_summary(results):
+    print('{0:<48}{1:>10}{2:>20}{3:>14}'.format('Controller', 'Centred', 'Mean time (s)', 'RMS (px)'))
+    for controller, trials in results.items():
+        trials = np.array(trials, dtype=float)
+        centred = ~np.isnan(trials[:, 0])
+        mean_time = trials[centred, 0].mean() if np.any(centred) else np.nan
+        print('{0:<48}{1:>10}{2:>20.2f}{3:>14.1f}'.format(controller, '{0}/{1}'.format(centred.sum(), len(trials)), mean_time, trials[:, 1].mean()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded tracking data to tune the paw centering controller')
+    parser.add_argument('sessions', nargs='+', help='HDF5 session files with tracking data')
+    parser.add_argument('--kp', nargs='+', type=float, default=[MouseTrackingController.CONTROLLER.kp], help='proportional gains (velocity per px)')
+    parser.add_argument('--ki', nargs='+', type=float, default=[0.0], help='integral gains')
+    parser.add_argument('--kd', nargs='+', type=float, default=[0.0], help='derivative gains')
+    parser.add_argument('--max-velocity', type=float, default=MouseTrackingController.VELOCITY)
+    parser.add_argument('--latency', type=float, default=0.05, help='camera to motor latency (s)')
+    parser.add_argument('--centred-time', type=float, default=1.0, help='time the paw must stay centred (s)')
+    args = parser.parse_args()
+
+    # the original bang-bang control as the baseline
+    controllers = [VelocityController(MouseTrackingController.VELOCITY, MouseTrackingController.ERROR_THRESHOLD)]
+    for kp, ki, kd in itertools.product(args.kp, args.ki, args.kd):
+        controllers.append(PIDController(kp, ki, kd, args.max_velocity, MouseTrackingController.ERROR_THRESHOLD))
+
+    tracking_data = load_tracking_data(args.sessions)
+    print('{0} recorded approaches'.format(len(tracking_data)))
+    print_summary(tune(tracking_data, controllers, args.latency, args.centred_time))
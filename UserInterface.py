@@ -12,7 +12,6 @@ import multiprocessing as mp
 import time
 import h5py
 from datetime import datetime
-import copy
 
 from DebugLog.DebugLog import *
 from PhotostimulatorTool import PhotostimulatorTool
@@ -21,7 +20,10 @@ from UserInterfaceApps.RunFileWriter import RunFileWriter
 from UserInterfaceApps.ChooseBuildDialog import ChooseBuildDialog
 from UserInterfaceApps.ChooseBuildDialog import BuildProgressWindow
 from UserInterfaceApps.ConnectionManagerWindow import ConnectionManagerWindow
-from UserInterfaceApps.VideoCameraController import VideoCameraController, FrameManipulator
+from UserInterfaceApps.VideoCameraController import VideoCameraController
+from UserInterfaceApps.CaptureManager import CaptureManager
+from UserInterfaceApps.FrameROI import FrameROI
+from UserInterfaceApps.PreviewRenderer import PreviewRenderer
 from UserInterfaceApps.JoystickControllerView import JoystickControllerView
 from UserInterfaceApps.PositionControllerView import PositionControllerView
 from UserInterfaceApps.MouseTrackingController import MouseTrackingController
@@ -32,6 +34,15 @@ from Motors import Motors_TMC5072_eval, Motors_TMC5130_eval
 from AnalysisTools import *
 
 class UserInterface():
+    # cameras recorded with each trial, camera name: video source
+    # the substage camera (CaptureManager.PRIMARY) is used for the live feed and mouse tracking
+    CAMERA_SOURCES = CaptureManager.SOURCES
+
+    # region of the substage camera the tracker sees and that is recorded, None for the whole frame
+    # e.g. FrameROI((320, 240), decimation=2) tracks a 160x120 stream around the target
+    TRACKING_ROI = None
+    RECORDING_ROI = None
+
     def __init__(self, master):
         self.__master = master
         self.__master.withdraw()
@@ -108,12 +119,15 @@ class UserInterface():
         self.__camera_label = tk.Label(camera_frame)
         self.__camera_label.grid(row=0, column=0)
 
+        self.__capturemanager = None
         self.__videocapture = None
+        self.__previewrenderer = None
         self.__frame_delay = 1.0 / VideoCameraController.FPS
 
         try:
             # exceptions: on connection error
-            self.__videocapture = VideoCameraController()
+            self.__capturemanager = CaptureManager(UserInterface.CAMERA_SOURCES, tracking_roi=UserInterface.TRACKING_ROI, recording_roi=UserInterface.RECORDING_ROI)
+            self.__videocapture = self.__capturemanager.get_camera(CaptureManager.PRIMARY)
             self.initialize_camera()
 
         except Exception as err:
@@ -208,20 +222,26 @@ class UserInterface():
 
 
     def initialize_camera(self):
-        self.update_video_display()
+        # the display loop is already running if a camera was initialized before, it picks up the new renderer
+        start_display = self.__previewrenderer is None
+        # stop rendering the previous camera before rendering the new one
+        if self.__previewrenderer:
+            self.__previewrenderer.stop()
+
+        # overlays and RGB conversion are done off the Tk thread
+        self.__previewrenderer = PreviewRenderer(self.__videocapture, self.__videocapture.target)
+        self.__preview_seq = -1
+        if start_display:
+            self.update_video_display()
 
     def update_video_display(self):
-        frame = self.__videocapture.get_last_frame()
-        frame = copy.deepcopy(frame) #WATCH OUT: MouseTracking can read from the same queue and manipulations to the frame here can affect tracking. Instead of locking, just creating a copy here so that the other process doesn't need to wait for a new frame if this one tried reading it first
-        frame = FrameManipulator.draw_timestamp(frame, datetime.now())
-        frame = FrameManipulator.draw_crosshair(frame, self.__videocapture.target)
-
-        # frame must be RGB to display
-        im = FrameManipulator.convert_BGR2RGB(frame)
-        im = PIL.ImageTk.PhotoImage(image=PIL.Image.fromarray(im))
-        self.__camera_label.config(image=im)
-        self.__camera_label.image = im
-        self.__master.update_idletasks()
+        # only swap the displayed image when a new frame was rendered
+        seq, image = self.__previewrenderer.get_image(self.__preview_seq)
+        if image is not None:
+            self.__preview_seq = seq
+            im = PIL.ImageTk.PhotoImage(image=image)
+            self.__camera_label.config(image=im)
+            self.__camera_label.image = im
         self.__camera_label.after(50, self.update_video_display)
         
     def update_infolabel(self):
@@ -468,11 +488,13 @@ class UserInterface():
         DebugLog.debugprint(self, message)
 
         trial_datetime = datetime.now()
-        self.__videocapture.start_video_recording()
+        self.__capturemanager.start_video_recording(selected_folder, filename, mouse_id, trial_id)
         time.sleep(start_delay)
         # launch waveform
         # TODO: adjust waveform lengths using start/stop delays?
         # TODO: drawing plots causes program crash, bypass for now
+        # launch time on the clock of the frame times (relative to the start of the recording)
+        wave_start_time = time.perf_counter() - self.__capturemanager.get_recording_start_time()
         self.__photostimulator.launch_waveform(plot=False,hsv_params = hsv_params)
         wave_settings = self.__photostimulator.get_launch_settings()
 
@@ -482,15 +504,24 @@ class UserInterface():
 
         time.sleep(stop_delay)
         # stop recording video
-        videopath = self.__videocapture.stop_video_recording(selected_folder, filename, mouse_id, trial_id)
+        videopath = self.__capturemanager.stop_video_recording()[CaptureManager.PRIMARY]
 
         self.__run_progress.finished()
         good_trial, comment = self.ask_good_trial()
         #self.__run_progress.saving()
 
+        # blocks until all videos are written
+        frame_info = self.__capturemanager.get_frame_info()
+        frame_groups = self.__capturemanager.match_frame_groups(frame_info) if len(frame_info) > 1 else None
+        substage_frame_info = frame_info.pop(CaptureManager.PRIMARY)
+
         if hsv_params:
-            hsv_window = HighSpeedFilenameWindow(selected_folder, filename, mouse_id, trial_id, master = self.__master)
-            hsv_params['filename'] = hsv_window.get_filename()
+            # a high speed camera run by the capture manager is recorded with the trial, no filename to copy
+            if CaptureManager.HIGHSPEED in frame_info:
+                hsv_params['filename'] = frame_info[CaptureManager.HIGHSPEED]['path']
+            else:
+                hsv_window = HighSpeedFilenameWindow(selected_folder, filename, mouse_id, trial_id, master = self.__master)
+                hsv_params['filename'] = hsv_window.get_filename()
 
         # save trial
         try:
@@ -503,11 +534,15 @@ class UserInterface():
                     trial_datetime,
                     wave_settings,
                     wave_data,
-                    substage_frame_times=self.__videocapture.get_frame_times(),
+                    substage_frame_times=substage_frame_info['times'],
+                    substage_frame_info=substage_frame_info,
                     good_trial=good_trial,
                     comment=comment,
                     videopath=videopath,
-                    hsv_params = hsv_params
+                    hsv_params = hsv_params,
+                    camera_frame_info=frame_info,
+                    frame_groups=frame_groups,
+                    wave_start_time=wave_start_time
                     )
             if is_CSV:
                 RunFileWriter.save_csv(selected_folder, filename, mouse_id, trial_id, wave_config, wave_data)
@@ -529,12 +564,8 @@ class UserInterface():
         if not self.__run_queue.empty():
             self.__run_progress.running()
 
+            # next trial starts its own video recording
             next_thread = self.__run_queue.get()
-
-            # start recording video
-            #self.start_video_recording()
-            self.__videocapture.start_video_recording()
-
             next_thread.start()
 
         else:
@@ -633,6 +664,11 @@ class UserInterface():
 
         elif trigger == 'autodetect':
             retry = True
+            # tracking data goes into the trial's HDF5 file while the paw is detected
+            if is_HDF5:
+                self.__mousetrackingcontroller.set_tracking_file(selected_folder, filename, mouse_id, trial_id)
+            else:
+                self.__mousetrackingcontroller.set_tracking_file()
             self.__mousetrackingcontroller.reset_data()
 
             while retry:
@@ -641,7 +677,11 @@ class UserInterface():
                 autodetect_thread.start()
 
                 # block until paw is centred, or detection time limit reached
-                autodetect_thread.join(detection_limit)
+                deadline = time.perf_counter() + detection_limit
+                while autodetect_thread.is_alive() and time.perf_counter() < deadline:
+                    autodetect_thread.join(min(RunProgressWindow.UPDATE_INTERVAL, max(0, deadline - time.perf_counter())))
+                    self.__run_progress.centring(self.__mousetrackingcontroller.get_time_in_tolerance(), self.__mousetrackingcontroller.get_centred_time())
+                    self.__run_progress.latency(self.__mousetrackingcontroller.get_latency_stats())
 
                 if not autodetect_thread.is_alive():
                     retry = False
@@ -687,12 +727,13 @@ class UserInterface():
         trial_datetime = datetime.now()
 
         # start recording video
-        #self.start_video_recording()
-        self.__videocapture.start_video_recording()
-        time.sleep(1) #TODO Add adjustable video recording length for automatic callback
+        # the video includes VideoCameraController.PREROLL_TIME seconds from before this call, so no lead-in delay is needed
+        self.__capturemanager.start_video_recording(selected_folder, filename, mouse_id, trial_id)
 
         # launch waveform
         # TODO: drawing plots causes program crash, bypass for now
+        # launch time on the clock of the frame times (relative to the start of the recording)
+        wave_start_time = time.perf_counter() - self.__capturemanager.get_recording_start_time()
         self.__photostimulator.launch_waveform(plot=False)
         wave_settings = self.__photostimulator.get_launch_settings()
         wave_data = self.__photostimulator.get_waveform_data()
@@ -701,7 +742,12 @@ class UserInterface():
         # stop recording video
         #self.__videocapture.stop_video_recording(selected_folder, filename, mouse_id, trial_id)
         time.sleep(20) #TODO Along with previous point on video recording length
-        videopath = self.__videocapture.stop_video_recording(selected_folder, filename, mouse_id, trial_id)
+        videopath = self.__capturemanager.stop_video_recording()[CaptureManager.PRIMARY]
+
+        # blocks until all videos are written
+        frame_info = self.__capturemanager.get_frame_info()
+        frame_groups = self.__capturemanager.match_frame_groups(frame_info) if len(frame_info) > 1 else None
+        substage_frame_info = frame_info.pop(CaptureManager.PRIMARY)
 
         # check between steps if pause requested
         if self.do_terminate_run('Saving data recorded at position ' + mouse_id):
@@ -710,11 +756,13 @@ class UserInterface():
         self.__run_progress.saving()
 
         # save trial
-        tracking_data = []
+        # with HDF5 the tracking data is already in the file, it is only loaded for the CSV file
+        tracking_data = None
+        live_keypoints = None
         if trigger == 'autodetect':
-            tracking_data = self.__mousetrackingcontroller.get_tracking_data()
-            if type(tracking_data) is list:
-                tracking_data = np.asarray(tracking_data)
+            if is_CSV:
+                tracking_data = self.__mousetrackingcontroller.get_tracking_data()
+            live_keypoints = self.__mousetrackingcontroller.get_keypoint_log()
         try:
             if is_HDF5:
                 #RunFileWriter.save_HDF5(selected_folder, filename, mouse_id, trial_id, trial_datetime, wave_settings, wave_data, tracking_data=tracking_data, substage_frame_times=self.__videocapture.get_last_frame_times())
@@ -726,10 +774,16 @@ class UserInterface():
                     trial_datetime,
                     wave_settings,
                     wave_data,
-                    substage_frame_times=self.__videocapture.get_frame_times(),
+                    substage_frame_times=substage_frame_info['times'],
+                    substage_frame_info=substage_frame_info,
+                    tracking_data=None,
                     good_trial = 1, #Assuming good trial because it's auto
                     comment = 'Automatic Detection',
-                    videopath = videopath
+                    videopath = videopath,
+                    camera_frame_info=frame_info,
+                    frame_groups=frame_groups,
+                    live_keypoints=live_keypoints,
+                    wave_start_time=wave_start_time
                     )
             if is_CSV:
                 RunFileWriter.save_csv(selected_folder, filename, mouse_id, trial_id, wave_config, wave_data, tracking_data=tracking_data)
@@ -778,7 +832,6 @@ class UserInterface():
         DebugLog.debugprint(self, message)
 
     # TODO: make tab closeable
-    # TODO: show timestamps in video player
     # create new read-only tab
     # exceptions: invalid video and/or waveform files
     def open_newtab(self, video_file, waveform_data_file):
@@ -803,23 +856,49 @@ class UserInterface():
         camera_label = tk.Label(camera_frame)
         camera_label.grid(row=0, column=0, columnspan=2)
 
-        videoplayer = VideoPlayer(camera_label)
+        # scrub bar and time follow the shown frame
+        # note: ttk.Scale.set() invokes the command, so moving the scrub bar to the shown frame must not seek again
+        time_label = ttk.Label(camera_frame, text='0.000 s')
+        scrub_scale = ttk.Scale(camera_frame, orient='horizontal', from_=0, to=0)
+        updating_scale = False
+
+        def on_position(index, t):
+            nonlocal updating_scale
+            updating_scale = True
+            try:
+                scrub_scale.set(index)
+            finally:
+                updating_scale = False
+            time_label.config(text='{0:.3f} s'.format(t))
+
+        def on_scrub(value):
+            if not updating_scale:
+                videoplayer.seek_frame(round(float(value)))
+
+        videoplayer = VideoPlayer(camera_label, on_position)
+        scrub_scale.config(command=on_scrub)
+
+        # stop the decoder thread and release the video file with the tab
+        frame.bind('<Destroy>', lambda event: videoplayer.close() if event.widget is frame else None)
 
         play_button = ttk.Button(camera_frame, text='Play', command=videoplayer.play)
         play_button.grid(row=1, column=0, sticky='e')
-        # TODO: implement
-        pause_button = ttk.Button(camera_frame, text='Pause', command=videoplayer.pause, state='disabled')
+        pause_button = ttk.Button(camera_frame, text='Pause', command=videoplayer.pause)
         pause_button.grid(row=1, column=1, sticky='w')
+        scrub_scale.grid(row=2, column=0, columnspan=2, sticky='ew')
+        time_label.grid(row=3, column=0, columnspan=2)
 
         try:
             # note: need to close file for video player to establish its own connection
             name = video_file.name
             video_file.close()
             videoplayer.load(name)
+            scrub_scale.config(to=max(videoplayer.get_frame_count() - 1, 0))
 
         except Exception as err:
             # delete tab on error
             self.__notebook.forget(frame)
+            frame.destroy()
             raise Exception('Unable to read video file: ' + name + '. ' + str(err))
 
         # ================================== waveform data viewer ==================================
@@ -843,6 +922,7 @@ class UserInterface():
         except Exception as err:
             # delete tab on error
             self.__notebook.forget(frame)
+            frame.destroy()
             raise Exception('Unable to read waveform data file: ' + waveform_data_file.name + '. ' + str(err))
 
     # TODO: mp4 not supported yet
@@ -919,9 +999,10 @@ class UserInterface():
                 self.__joystickcontrollerview = JoystickControllerView(self.fine_motors_buttons_frame, self.__fine_motors, self.__coarse_motor, True)
 
     def on_closing(self):
-        if self.__videocapture:
-            self.__videocapture.terminate()
-            self.__videocapture.proc.kill()
+        if self.__previewrenderer:
+            self.__previewrenderer.stop()
+        if self.__capturemanager:
+            self.__capturemanager.terminate()
         if self.__mousetrackingcontroller:
             del self.__mousetrackingcontroller
 
@@ -932,6 +1013,7 @@ class UserInterface():
 
         # disconnect video feed
         del self.__videocapture
+        del self.__capturemanager
 
         # disconnect motors
         del self.__fine_motors
@@ -945,10 +1027,13 @@ class UserInterface():
 
 
 class RunProgressWindow(tk.Toplevel):
+    # how often progress is updated while waiting for the paw to be centred (s)
+    UPDATE_INTERVAL = 0.1
+
     def __init__(self, master=None):
         super().__init__(master=master)
         self.title('Running...')
-        self.geometry("220x80")
+        self.geometry("220x100")
 
         frame = ttk.Frame(self)
         frame.grid(row=0, column=0, padx=10, pady=10)
@@ -959,6 +1044,10 @@ class RunProgressWindow(tk.Toplevel):
         self.__progressbar = ttk.Progressbar(frame, orient='horizontal', mode='indeterminate', length=200)
         self.__progressbar.grid(row=1, column=0)
 
+        # frame to motor command latency while centring
+        self.__latency_label = ttk.Label(frame, text='')
+        self.__latency_label.grid(row=2, column=0)
+
         self.__pause_requested = False
 
         # disable close window
@@ -1003,8 +1092,20 @@ class RunProgressWindow(tk.Toplevel):
 
     def saving(self):
         self.__loading_label.config(text='Saving...')
+        self.__latency_label.config(text='')
+
+    # time_in_tolerance: how long the paw has been centred so far, of centred_time
+    def centring(self, time_in_tolerance, centred_time):
+        self.__loading_label.config(text='Centring paw: {0:.1f} / {1:.1f} s'.format(min(time_in_tolerance, centred_time), centred_time))
+
+    # latency_stats: see LatencyStats.summary()
+    def latency(self, latency_stats):
+        total = latency_stats['total']
+        if total['count']:
+            self.__latency_label.config(text='Latency p50/p95/p99: {0:.0f}/{1:.0f}/{2:.0f} ms'.format(total['p50'] * 1000, total['p95'] * 1000, total['p99'] * 1000))
 
     def finished(self):
+        self.__latency_label.config(text='')
         self.__progressbar.stop()
         self.unbind_all('<space>')
         # release focus
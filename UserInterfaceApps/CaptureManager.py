@@ -0,0 +1,160 @@
+'''
+Capture from several cameras at once
+
+Each camera runs in its own VideoCameraController capture process and stamps
+its frames with time.perf_counter(), which is system-wide, so all cameras share
+one clock. Recordings of all cameras start with the same start time, and frames
+of different cameras captured within a tolerance of each other form a
+synchronized frame group.
+'''
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from UserInterfaceApps.RunFileWriter import RunFileWriter
+from UserInterfaceApps.SharedFrameBuffer import SharedFrameBuffer
+from UserInterfaceApps.VideoCameraController import VideoCameraController
+from UserInterfaceApps.VideoEncoders import VideoEncoders
+
+
+class CaptureManager:
+    # camera used for the live feed and mouse tracking
+    PRIMARY = RunFileWriter.SUBSTAGE_CAMERA
+
+    # name of a high speed camera, if one is captured here its video replaces the manual high speed filename
+    HIGHSPEED = 'highspeed'
+
+    # camera name: video source
+    SOURCES = OrderedDict([(PRIMARY, 0)])
+
+    # frames further apart than this are not in the same group (s), default: half a frame period
+    TOLERANCE = 0.5 / VideoCameraController.FPS
+
+    # sources: {camera name: video source}, must include PRIMARY
+    # tracking_roi, recording_roi: FrameROIs of the PRIMARY camera, see VideoCameraController
+    # exceptions: on connection error of any camera (cameras opened so far are terminated)
+    def __init__(self, sources=SOURCES, tolerance=TOLERANCE, preroll_time=VideoCameraController.PREROLL_TIME, encoder=VideoEncoders.DEFAULT, tracking_roi=None, recording_roi=None):
+        if CaptureManager.PRIMARY not in sources:
+            raise Exception('No ' + CaptureManager.PRIMARY + ' camera given.')
+
+        self.__tolerance = tolerance
+        self.__cameras = OrderedDict()
+        self.__video_filepaths = {}
+        self.__recording_start_time = None
+
+        try:
+            for camera, video_source in sources.items():
+                if camera == CaptureManager.PRIMARY:
+                    self.__cameras[camera] = VideoCameraController(video_source, preroll_time, encoder, camera, tracking_roi, recording_roi)
+                else:
+                    self.__cameras[camera] = VideoCameraController(video_source, preroll_time, encoder, camera)
+        except Exception as err:
+            self.terminate()
+            raise Exception(camera + ' camera: ' + str(err))
+
+    def get_names(self):
+        return list(self.__cameras.keys())
+
+    def get_camera(self, camera=PRIMARY):
+        return self.__cameras[camera]
+
+    def get_tolerance(self):
+        return self.__tolerance
+
+    # newest synchronized frame group
+    # the newest frame of the camera that is furthest behind sets the group time, every other camera
+    # contributes the frame in its ring buffer closest to it
+    # return: (group time, {camera name: (sequence number, timestamp, frame view)}),
+    # (None, None) if a camera has no frame within the tolerance
+    # note: frames are views into shared memory, see SharedFrameBuffer.read_latest()
+    def get_frame_group(self):
+        latest = {camera: controller.frame_buffer.read_latest() for camera, controller in self.__cameras.items()}
+        if any(seq < 0 for seq, timestamp, frame in latest.values()):
+            return None, None
+
+        group_time = min(timestamp for seq, timestamp, frame in latest.values())
+        group = {}
+        for camera, controller in self.__cameras.items():
+            seq, timestamp, frame = controller.frame_buffer.read_nearest(group_time)
+            if seq < 0 or abs(timestamp - group_time) > self.__tolerance:
+                return None, None
+            group[camera] = (seq, timestamp, frame)
+
+        return group_time, group
+
+    # block until a frame group newer than last_time is available
+    # return: same as get_frame_group(), (None, None) on timeout
+    def wait_for_frame_group(self, last_time=None, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            group_time, group = self.get_frame_group()
+            if group is not None and (last_time is None or group_time > last_time):
+                return group_time, group
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None, None
+            time.sleep(SharedFrameBuffer.POLL_INTERVAL)
+
+    # start recording all cameras on one clock, see VideoCameraController.start_video_recording()
+    # return: {camera name: video file path relative to selected_folder}
+    def start_video_recording(self, selected_folder, filename, mouse_id, trial_id):
+        start_time = time.perf_counter()
+        self.__recording_start_time = start_time
+        self.__video_filepaths = {}
+        for camera, controller in self.__cameras.items():
+            self.__video_filepaths[camera] = controller.start_video_recording(selected_folder, filename, mouse_id, trial_id, start_time)
+        return self.__video_filepaths
+
+    # time.perf_counter() the frame times of the current (or last) recording are relative to
+    def get_recording_start_time(self):
+        return self.__recording_start_time
+
+    # return: {camera name: video file path relative to selected_folder, None if discarded}
+    def stop_video_recording(self, write_to_file=True):
+        return {camera: controller.stop_video_recording(write_to_file) for camera, controller in self.__cameras.items()}
+
+    # get the per-frame record of the last recording of every camera, see VideoCameraController.get_frame_info()
+    # blocks until all videos have been written. Only call once per recording that was not discarded
+    # return: {camera name: frame info, with 'path': video file path relative to selected_folder}
+    def get_frame_info(self):
+        frame_info = {}
+        for camera, controller in self.__cameras.items():
+            frame_info[camera] = dict(controller.get_frame_info(), path=self.__video_filepaths.get(camera))
+        return frame_info
+
+    # match the recorded frames of all cameras into synchronized frame groups
+    # frame_info: as returned by get_frame_info()
+    # return: {'cameras': camera names, 'groups': (N, cameras) frame numbers in each video file,
+    # -1 if the camera has no frame within tolerance, 'tolerance'}, see RunFileWriter.save_HDF5
+    def match_frame_groups(self, frame_info):
+        cameras = [camera for camera in self.__cameras.keys() if camera in frame_info]
+        groups = CaptureManager.match_frame_times([frame_info[camera]['times'] for camera in cameras], self.__tolerance)
+        return {'cameras': cameras, 'groups': groups, 'tolerance': self.__tolerance}
+
+    # the first list of frame times is the reference, each of its frames starts a group
+    # every other camera contributes its frame closest in time, if within tolerance
+    # return: (N reference frames, cameras) array of frame numbers, -1 where no frame matched
+    @staticmethod
+    def match_frame_times(frame_times, tolerance):
+        reference = np.asarray(frame_times[0], dtype=float)
+        groups = np.full((len(reference), len(frame_times)), -1, dtype=np.int64)
+        groups[:, 0] = np.arange(len(reference))
+
+        for column, times in enumerate(frame_times[1:], start=1):
+            times = np.asarray(times, dtype=float)
+            if not len(times):
+                continue
+            # nearest neighbour: compare the frames either side of each reference time
+            right = np.clip(np.searchsorted(times, reference), 0, len(times) - 1)
+            left = np.clip(right - 1, 0, len(times) - 1)
+            nearest = np.where(np.abs(times[left] - reference) <= np.abs(times[right] - reference), left, right)
+            matched = np.abs(times[nearest] - reference) <= tolerance
+            groups[matched, column] = nearest[matched]
+
+        return groups
+
+    def terminate(self):
+        for controller in self.__cameras.values():
+            controller.terminate()
+            controller.proc.kill()
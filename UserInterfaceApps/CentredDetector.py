@@ -0,0 +1,38 @@
+# detects when the paw has stayed within threshold of the target for centred_time, O(1) per sample
+class CentredDetector:
+    def __init__(self, centred_time, threshold):
+        self.__centred_time = centred_time
+        self.__threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.__last_time = None
+        # time of the first sample of the current run of samples within threshold
+        self.__in_tolerance_since = None
+
+    # add the errors measured in a frame captured at time t (s)
+    # return: True if the paw is centred, see is_centred()
+    def add(self, t, x_error, y_error):
+        error = max(abs(x_error), abs(y_error))
+
+        self.__last_time = t
+
+        if error > self.__threshold:
+            self.__in_tolerance_since = None
+        elif self.__in_tolerance_since is None:
+            self.__in_tolerance_since = t
+
+        return self.is_centred()
+
+    # centred: every sample of the last centred_time was within threshold
+    def is_centred(self):
+        return self.__in_tolerance_since is not None and self.get_time_in_tolerance() >= self.__centred_time
+
+    # how long the paw has been within threshold so far (s)
+    def get_time_in_tolerance(self):
+        if self.__in_tolerance_since is None:
+            return 0.0
+        return self.__last_time - self.__in_tolerance_since
+
+    def get_centred_time(self):
+        return self.__centred_time
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+# timing record of a fixed-rate control loop
+# period: time between consecutive loop iterations, staleness: age of the input a command was computed from
+class ControlLoopStats:
+    def __init__(self, period):
+        self.__period = period
+        self.__last_tick = None
+        self.__periods = []
+        self.__staleness = []
+        self.__missed_ticks = 0
+
+    # call at the start of every iteration
+    # missed: deadlines skipped because the last iteration overran
+    def tick(self, tick_time, missed=0):
+        if self.__last_tick is not None:
+            self.__periods.append(tick_time - self.__last_tick)
+        self.__last_tick = tick_time
+        self.__missed_ticks += missed
+
+    # call when a command is sent, with the capture time of the input it was computed from
+    def command(self, command_time, input_time):
+        self.__staleness.append(command_time - input_time)
+
+    # return: {'period', 'iterations', 'missed_ticks', 'commands',
+    # 'period_mean', 'period_max', 'staleness_mean', 'staleness_p95', 'staleness_max'} (times in s)
+    def summary(self):
+        periods = np.asarray(self.__periods)
+        staleness = np.asarray(self.__staleness)
+        return {
+            'period': self.__period,
+            'iterations': len(periods) + (self.__last_tick is not None),
+            'missed_ticks': self.__missed_ticks,
+            'commands': len(staleness),
+            'period_mean': periods.mean() if len(periods) else np.nan,
+            'period_max': periods.max() if len(periods) else np.nan,
+            'staleness_mean': staleness.mean() if len(staleness) else np.nan,
+            'staleness_p95': np.percentile(staleness, 95) if len(staleness) else np.nan,
+            'staleness_max': staleness.max() if len(staleness) else np.nan
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        return '{0} iterations at {1:.1f} ms (mean {2:.1f} ms, max {3:.1f} ms, {4} missed), {5} commands, input age mean {6:.1f} ms, p95 {7:.1f} ms, max {8:.1f} ms'.format(
+            summary['iterations'], summary['period'] * 1000, summary['period_mean'] * 1000, summary['period_max'] * 1000, summary['missed_ticks'],
+            summary['commands'], summary['staleness_mean'] * 1000, summary['staleness_p95'] * 1000, summary['staleness_max'] * 1000)
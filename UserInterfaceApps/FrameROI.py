@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+
+
+# region of interest of the camera frame, optionally decimated
+# used by VideoCameraController to publish a smaller stream to the tracker and to record only the ROI
+class FrameROI:
+    # centre as a fraction of the frame x,y dimensions, same as VideoCameraController.TARGET
+    CENTER = (0.5, 0.5)
+
+    # size: (width, height) of the crop in camera pixels, None for the whole frame
+    # decimation: integer factor the crop is downscaled by
+    def __init__(self, size=None, decimation=1, center=CENTER):
+        if decimation < 1:
+            raise Exception('ROI decimation must be at least 1.')
+
+        self.__size = size
+        self.__decimation = int(decimation)
+        self.__center = center
+
+        # (x0, y0, x1, y1) in camera pixels, set by set_frame_shape()
+        self.__box = None
+
+    # place the ROI in a frame of the given shape, shifted to stay inside the frame
+    def set_frame_shape(self, frame_shape):
+        height, width = frame_shape[:2]
+        roi_width, roi_height = self.__size if self.__size else (width, height)
+        roi_width = min(roi_width, width)
+        roi_height = min(roi_height, height)
+
+        x0 = min(max(int(round(self.__center[0] * width - roi_width / 2)), 0), width - roi_width)
+        y0 = min(max(int(round(self.__center[1] * height - roi_height / 2)), 0), height - roi_height)
+        self.__box = (x0, y0, x0 + roi_width, y0 + roi_height)
+
+    def get_box(self):
+        return self.__box
+
+    def get_decimation(self):
+        return self.__decimation
+
+    # (width, height) of the frames returned by apply()
+    def get_dims(self):
+        x0, y0, x1, y1 = self.__box
+        return (x1 - x0) // self.__decimation, (y1 - y0) // self.__decimation
+
+    # shape of the frames returned by apply() for frames of frame_shape
+    def get_shape(self, frame_shape):
+        width, height = self.get_dims()
+        return (height, width) + tuple(frame_shape[2:])
+
+    # crop (a view, no copy) and decimate a camera frame
+    def apply(self, frame):
+        x0, y0, x1, y1 = self.__box
+        roi = frame[y0:y1, x0:x1]
+        if self.__decimation > 1:
+            roi = cv2.resize(roi, self.get_dims(), interpolation=cv2.INTER_AREA)
+        return roi
+
+    # map points in ROI pixels back to camera frame pixels
+    # points: array [..., x, y(, ...)], columns after x, y (e.g. keypoint accuracy) are kept
+    def to_frame(self, points):
+        x0, y0, x1, y1 = self.__box
+        width, height = self.get_dims()
+        points = np.array(points, dtype=float)
+        points[..., 0] = points[..., 0] * (x1 - x0) / width + x0
+        points[..., 1] = points[..., 1] * (y1 - y0) / height + y0
+        return points
+
+    # map a point in camera frame pixels into ROI pixels
+    def to_roi(self, point):
+        x0, y0, x1, y1 = self.__box
+        width, height = self.get_dims()
+        return (point[0] - x0) * width / (x1 - x0), (point[1] - y0) * height / (y1 - y0)
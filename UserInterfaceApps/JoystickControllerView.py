@@ -208,13 +208,9 @@ class JoystickControllerView:
     # check if motors are moving
     def is_stopped(self):
         if self.__fine_motors and self.__coarse_motor:
-            return self.__fine_motors.getAxisParameter(self.__fine_motors.APs.ActualPosition,
-                                                       MotorController.MOTOR_X_ID) == self.__fine_motors.getAxisParameter(
-                self.__fine_motors.APs.TargetPosition, MotorController.MOTOR_X_ID) and self.__fine_motors.getAxisParameter(
-                self.__fine_motors.APs.ActualPosition, MotorController.MOTOR_Y_ID) == self.__fine_motors.getAxisParameter(
-                self.__fine_motors.APs.TargetPosition,
-                MotorController.MOTOR_Y_ID) and self.__coarse_motor.readRegisterField(
-                self.__coarse_motor.fields.POSITION_REACHED) == 1
+            return MotorController.all_positions_reached([
+                self.__fine_motors.position_reached_async([MotorController.MOTOR_X_ID, MotorController.MOTOR_Y_ID]),
+                self.__coarse_motor.position_reached_async()])
         return True
 
     def return_to_home(self):
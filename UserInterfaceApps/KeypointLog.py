@@ -0,0 +1,49 @@
+import numpy as np
+
+
+# all keypoints of every estimate autodetect acted on, in whole frame px
+# kept in preallocated float32 arrays that double when full, so a run can be replayed with any TargetPolicy afterwards
+class KeypointLog:
+    # estimates (rows) preallocated
+    BUFFER_SIZE = 1024
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.__buffer_size = buffer_size
+        self.clear()
+
+    def clear(self):
+        # allocated on the first add(), the number of keypoints depends on the tracker
+        self.__keypoints = None
+        self.__frames = np.empty(self.__buffer_size, dtype=np.int64)
+        self.__times = np.empty(self.__buffer_size, dtype=np.float64)
+        self.__count = 0
+
+    # frame_seq: SharedFrameBuffer sequence number of the frame
+    # capture_time: capture time of the frame (perf_counter() s)
+    # keypoints: (keypoints, 3) array of [x, y, accuracy]
+    def add(self, frame_seq, capture_time, keypoints):
+        if self.__keypoints is None:
+            self.__keypoints = np.empty((self.__buffer_size,) + np.shape(keypoints), dtype=np.float32)
+        elif self.__count == len(self.__keypoints):
+            self.__keypoints = np.resize(self.__keypoints, (2 * len(self.__keypoints),) + self.__keypoints.shape[1:])
+            self.__frames = np.resize(self.__frames, 2 * len(self.__frames))
+            self.__times = np.resize(self.__times, 2 * len(self.__times))
+
+        self.__keypoints[self.__count] = keypoints
+        self.__frames[self.__count] = frame_seq
+        self.__times[self.__count] = capture_time
+        self.__count += 1
+
+    def __len__(self):
+        return self.__count
+
+    # return: {'keypoints': (N, keypoints, 3) float32 array, 'frames': (N,) frame sequence numbers, 'times': (N,) capture times},
+    # None if empty
+    def get_data(self):
+        if self.__count == 0:
+            return None
+        return {
+            'keypoints': self.__keypoints[:self.__count].copy(),
+            'frames': self.__frames[:self.__count].copy(),
+            'times': self.__times[:self.__count].copy()
+        }
@@ -0,0 +1,82 @@
+from threading import Lock
+
+import numpy as np
+
+
+# latency histograms of the stages between a camera frame and the motor command computed from it
+# queue: frame captured (VideoCameraController) -> picked up by the tracker (TrackerWorker)
+# inference: LiveTracker.get_keypoints()
+# handoff: keypoints published -> error posted by MouseTrackingController.autodetect
+# control: error posted -> motor command started by motor_follow (control tick, VACTUAL reads)
+# command: TMCL send of the commands of both axes
+# total: frame captured -> commands sent
+class LatencyStats:
+    STAGES = ('queue', 'inference', 'handoff', 'control', 'command', 'total')
+    PERCENTILES = (50, 95, 99)
+
+    # histogram bins (s): BIN_WIDTH wide up to MAX_LATENCY, the last bin takes everything above
+    BIN_WIDTH = 0.0005
+    MAX_LATENCY = 1.0
+
+    def __init__(self, bin_width=BIN_WIDTH, max_latency=MAX_LATENCY):
+        self.__bin_width = bin_width
+        self.__bins = int(np.ceil(max_latency / bin_width)) + 1
+        self.__lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.__counts = np.zeros((len(LatencyStats.STAGES), self.__bins), dtype=np.int64)
+            self.__max = np.zeros(len(LatencyStats.STAGES))
+
+    # timestamps: (capture, inference start, publish, post, command start, command end), perf_counter() s
+    # return: latency of each stage (s), in STAGES order
+    @staticmethod
+    def get_latencies(timestamps):
+        capture_time, inference_time, publish_time, post_time, command_time, sent_time = timestamps
+        return (inference_time - capture_time, publish_time - inference_time, post_time - publish_time,
+            command_time - post_time, sent_time - command_time, sent_time - capture_time)
+
+    # latencies: latency of each stage (s), in STAGES order
+    def add(self, latencies):
+        latencies = np.maximum(np.asarray(latencies, dtype=float), 0)
+        bins = np.minimum((latencies / self.__bin_width).astype(int), self.__bins - 1)
+        with self.__lock:
+            self.__counts[np.arange(len(LatencyStats.STAGES)), bins] += 1
+            np.maximum(self.__max, latencies, out=self.__max)
+
+    # return: {stage: {'count', 'p50', 'p95', 'p99', 'max'}} (s), percentiles are the upper edge of their bin, NaN without samples
+    def summary(self):
+        with self.__lock:
+            counts = self.__counts.copy()
+            maxima = self.__max.copy()
+
+        result = {}
+        for stage, stage_counts, stage_max in zip(LatencyStats.STAGES, counts, maxima):
+            total = stage_counts.sum()
+            cumulative = np.cumsum(stage_counts)
+            stage_summary = {'count': int(total), 'max': stage_max if total else np.nan}
+            for percentile in LatencyStats.PERCENTILES:
+                if total:
+                    index = int(np.searchsorted(cumulative, percentile / 100 * total))
+                    stage_summary['p' + str(percentile)] = min((index + 1) * self.__bin_width, stage_max)
+                else:
+                    stage_summary['p' + str(percentile)] = np.nan
+            result[stage] = stage_summary
+        return result
+
+    # return: {'[stage]_[p50|p95|p99|max]': latency in s}, e.g. to save as dataset attributes
+    def get_attributes(self):
+        attributes = {}
+        for stage, stage_summary in self.summary().items():
+            for key in ['p' + str(percentile) for percentile in LatencyStats.PERCENTILES] + ['max']:
+                attributes[stage + '_' + key] = stage_summary[key]
+        return attributes
+
+    # one line per stage
+    def __str__(self):
+        lines = []
+        for stage, stage_summary in self.summary().items():
+            lines.append('{0}: p50 {1:.1f} ms, p95 {2:.1f} ms, p99 {3:.1f} ms, max {4:.1f} ms ({5} samples)'.format(
+                stage, stage_summary['p50'] * 1000, stage_summary['p95'] * 1000, stage_summary['p99'] * 1000, stage_summary['max'] * 1000, stage_summary['count']))
+        return '\n'.join(lines)
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class LiveTracker:
     def __init__(self):
         raise NotImplementedError('You must implement your own live tracker.')
@@ -7,6 +10,12 @@ class LiveTracker:
     
     def get_keypoints(self, frame):
         raise NotImplementedError('You must implement your own live tracker.')
+
+    # frames: (N, height, width, channels) array
+    # return: (N, keypoints, 3) array of [x, y, accuracy]
+    # override to run the frames through the model as one batch, this default calls get_keypoints() per frame
+    def get_keypoints_batch(self, frames):
+        return np.stack([np.asarray(self.get_keypoints(frame), dtype=float) for frame in frames])
     
     def terminate(self):
         raise NotImplementedError('You must implement your own live tracker.')
\ No newline at end of file
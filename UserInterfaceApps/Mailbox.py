@@ -0,0 +1,35 @@
+import threading
+
+
+# holds only the newest value posted to it
+# consumers always act on the latest estimate instead of working through a FIFO backlog of old ones
+class Mailbox:
+    NO_VALUE = -1
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__seq = Mailbox.NO_VALUE
+        self.__value = None
+
+    # replace the value, wakes up waiting consumers
+    # return: sequence number of the value
+    def post(self, value):
+        with self.__condition:
+            self.__seq += 1
+            self.__value = value
+            self.__condition.notify_all()
+            return self.__seq
+
+    # return: (sequence number, value), (NO_VALUE, None) if nothing was posted yet
+    def read(self):
+        with self.__condition:
+            return self.__seq, self.__value
+
+    # block until a value newer than last_seq is posted
+    # return: same as read(), (NO_VALUE, None) on timeout
+    def wait(self, last_seq=NO_VALUE, timeout=None):
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__seq > last_seq, timeout):
+                return Mailbox.NO_VALUE, None
+            return self.__seq, self.__value
+
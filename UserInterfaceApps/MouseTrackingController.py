@@ -1,11 +1,19 @@
+import copy
 import os
 import threading
-import queue
 import time
-from threading import Lock
 
 from .LiveTracker import LiveTracker
-import numpy as np
+from .Mailbox import Mailbox
+from .ControlLoopStats import ControlLoopStats
+from .LatencyStats import LatencyStats
+from .VelocityController import PController
+from .CentredDetector import CentredDetector
+from .PawFilter import PawFilter
+from .TargetPolicy import KeypointTarget
+from .KeypointLog import KeypointLog
+from .TrackingTelemetry import TrackingTelemetry
+from .TrackerWorker import TrackerWorker, KeypointMailbox
 
 from JoystickController.JoystickController import MotorController
 from UserInterfaceApps.VideoCameraController import VideoCameraController
@@ -18,22 +26,59 @@ class MouseTrackingController:
     TARGETPAW_IDX = 4
     ACCURACY_THRESHOLD = 0.7
 
+    # default target: the target paw, see TargetPolicy for other keypoints, combinations or the most confident paw
+    TARGET_POLICY = KeypointTarget(TARGETPAW_IDX, ACCURACY_THRESHOLD)
+
     ERROR_THRESHOLD = 10
     VELOCITY = 50000
 
-    def __init__(self, videocapture, fine_motors, centred_time, target):
-        self.__live_tracker = LiveTracker()
+    # default controller: proportional, saturates at VELOCITY beyond 5 * ERROR_THRESHOLD px
+    # tune with TuneController.py on recorded tracking data
+    CONTROLLER = PController(VELOCITY / (5 * ERROR_THRESHOLD), max_velocity=VELOCITY, deadband=ERROR_THRESHOLD)
+
+    # fine motor control loop rate (Hz)
+    CONTROL_RATE = 100
+
+    # how long the paw may go undetected before the motors stop (s), its position is predicted meanwhile
+    DROPOUT_TIME = 0.2
+
+    # tracker_class: LiveTracker implementation, run in a TrackerWorker process
+    # tracker_kwargs: keyword arguments of tracker_class
+    # controller: VelocityController mapping pixel error to velocity, copied for each axis
+    # exceptions: the tracker failed to load or to initialize
+    # dropout_time: see DROPOUT_TIME
+    # target_policy: TargetPolicy choosing the point to centre from the keypoints
+    def __init__(self, videocapture, fine_motors, centred_time, target, tracker_class=LiveTracker, controller=CONTROLLER, dropout_time=DROPOUT_TIME, tracker_kwargs=None, target_policy=TARGET_POLICY):
+        self.__tracker_class = tracker_class
+        self.__tracker_kwargs = tracker_kwargs
+        self.__dropout_time = dropout_time
+        self.__target_policy = target_policy
+        # filtered paw position and velocity, predicts through short dropouts
+        self.__paw_filter = PawFilter()
+        self.__x_controller = copy.deepcopy(controller)
+        self.__y_controller = copy.deepcopy(controller)
+        self.__tracker_worker = None
 
         self.__videocapture = videocapture
-        self.__frame_width, self.__frame_height = videocapture.get_frame_dims()
+        self.__tracking_buffer = videocapture.get_tracking_buffer()
+        # the tracker sees the tracking ROI stream if the camera has one, keypoints are mapped back to the whole frame
+        self.__roi = videocapture.get_tracking_roi()
+        self.__frame_width, self.__frame_height = videocapture.get_tracking_frame_dims()
 
         self.__fine_motors = fine_motors
         self.__centred_time = centred_time
 
-        self.__error_queue = queue.Queue()
-        self.__tracking_data = []
-        self.__centred_data = []
-        self.__data_lock = Lock()
+        # latest (x error, y error, capture time, (capture, inference start, publish, post) times),
+        # motor_follow acts on the newest estimate only
+        self.__errors = Mailbox()
+        self.__control_stats = None
+        # frame to motor command latency per stage
+        self.__latency_stats = LatencyStats()
+        # (time, x error, VX, y error, VY, stage latencies) of every command, streamed to the HDF5 file if set_tracking_file() was called
+        self.__telemetry = TrackingTelemetry()
+        # all keypoints of every estimate, see get_keypoint_log()
+        self.__keypoint_log = KeypointLog()
+        self.__centred_detector = CentredDetector(centred_time, MouseTrackingController.ERROR_THRESHOLD)
         self.__done = False
         self.__force_stop = False
 
@@ -41,153 +86,221 @@ class MouseTrackingController:
 
         self.initialize()
 
-    # initialize the tracking object
-    # exceptions: couldn't grab a valid frame within the limited retries
+    # start the tracker in its own process, it initializes on the newest frame
+    # exceptions: the tracker failed to load or couldn't grab a valid frame to initialize
     def initialize(self):
         self.reset_data()
 
-        retry = 5
-
-        ret = None
-        frame = None
-        while retry > 0:
-            ret, frame = self.__videocapture.get_frame()
-            if ret:
-                retry = 0
-            else:
-                retry -= 1
-
-        if not ret:
-            raise Exception('Unable to grab frame to initialize.')
+        # the worker of an earlier initialize would keep running on its own process and shared memory
+        if self.__tracker_worker:
+            self.__tracker_worker.terminate()
+            self.__tracker_worker = None
 
-        self.__live_tracker.initialize(frame)
+        self.__tracker_worker = TrackerWorker(self.__tracking_buffer, self.__tracker_class, self.__tracker_kwargs)
 
     # clear data for next run
     def reset_data(self):
-        if self.__error_queue:
-            del self.__error_queue
-            self.__error_queue = queue.Queue()
+        self.__errors = Mailbox()
 
-        if self.__tracking_data:
-            self.__tracking_data.clear()
+        self.__telemetry.clear()
+        self.__keypoint_log.clear()
 
-        if self.__centred_data:
-            self.__centred_data.clear()
+        self.__centred_detector.reset()
+        self.__paw_filter.reset()
+        self.__latency_stats.reset()
 
         self.__done = False
         self.__force_stop = False
 
+    # get the timing of the last motor_follow control loop, see ControlLoopStats.summary()
+    def get_control_stats(self):
+        return self.__control_stats.summary() if self.__control_stats else None
+
+    # get the frame to motor command latency of the current run, see LatencyStats.summary()
+    def get_latency_stats(self):
+        return self.__latency_stats.summary()
+
+    # estimated paw velocity in frame px/s, None if the paw is not tracked
+    def get_paw_velocity(self):
+        return self.__paw_filter.get_velocity()
+
+    # how long the paw has been centred so far (s), see CentredDetector
+    def get_time_in_tolerance(self):
+        return self.__centred_detector.get_time_in_tolerance()
+
+    def get_centred_time(self):
+        return self.__centred_time
+
+    # stream the tracking data of the next runs to the trial's HDF5 file (see TrackingTelemetry), None to keep it in memory
+    def set_tracking_file(self, selected_folder=None, filename=None, mouse_id=None, trial_id=None):
+        self.__telemetry.set_file(selected_folder, filename, mouse_id, trial_id)
+
     # get the latest tracking data
+    # return: (N, len(RunFileWriter.TRACKING_COLUMNS)) array, see RunFileWriter.TRACKING_COLUMNS
     def get_tracking_data(self):
-        with self.__data_lock:
-            return self.__tracking_data
+        return self.__telemetry.get_data()
+
+    # switch the target for the next runs, see TargetPolicy
+    def set_target_policy(self, target_policy):
+        self.__target_policy = target_policy
+
+    def get_target_policy(self):
+        return self.__target_policy
+
+    # get all keypoints of the latest run
+    # return: see KeypointLog.get_data(), with 'target_policy' (str of the TargetPolicy), None if no estimates
+    def get_keypoint_log(self):
+        data = self.__keypoint_log.get_data()
+        if data is not None:
+            data['target_policy'] = str(self.__target_policy)
+        return data
 
     # detect when mouse paw is centred in frame
     def autodetect(self, fn=None):
         if self.__fine_motors:
             print(fn)
             tracking_video = cv2.VideoWriter(fn, cv2.VideoWriter_fourcc(*'DIVX'), 10, (self.__frame_width, self.__frame_height))
+            self.__telemetry.start()
             follow_thread = threading.Thread(target=self.motor_follow, daemon=True)
             follow_thread.start()
 
+            last_seq = KeypointMailbox.NO_KEYPOINTS
+            # estimates of frames from before this call may show another position of the stage
+            autodetect_start = time.perf_counter()
             while not self.__force_stop:
-                ret, frame = self.__videocapture.get_frame()
-                if ret:
+                # only the latest estimate, estimates published while the last one was handled are skipped
+                seq, frame_seq, capture_time, inference_time, publish_time, xy = self.__tracker_worker.wait_for_keypoints(last_seq, timeout=1.0)
+                if seq >= 0:
+                    last_seq = seq
+                    if capture_time < autodetect_start:
+                        continue
+                    # frame the keypoints were found in if it is still in the ring, else the newest frame
+                    # copy out of shared memory: the frame is drawn on below
+                    frame_seq, frame_time, frame = self.__tracking_buffer.copy(frame_seq)
+                    if frame is None:
+                        frame_seq, frame_time, frame = self.__tracking_buffer.copy_latest()
                     # Returns[[x position label1, y position label1, accuracy label1],[x position label2, y position label2, accuracy label2], ...for each labelled body part]
-                    # target paw: xy[1]
-                    # target paw x pos: xy[1][0]
-                    # target paw y pos: xy[1][1]
-                    # target paw accuracy: xy[1][2]
-                    xy = self.__live_tracker.get_keypoints(frame)
-                    
-
-                    if xy[MouseTrackingController.TARGETPAW_IDX][2] > MouseTrackingController.ACCURACY_THRESHOLD:
-                        x_pos = xy[MouseTrackingController.TARGETPAW_IDX][0]
-                        y_pos = xy[MouseTrackingController.TARGETPAW_IDX][1]
+                    # tracking video shows the frames the tracker saw, errors are in whole frame pixels
+                    xy_frame = self.__roi.to_frame(xy) if self.__roi else xy
+                    self.__keypoint_log.add(frame_seq, capture_time, xy_frame)
+                    # target: [x, y, accuracy] in whole frame pixels, None if no keypoint of the policy is accurate enough
+                    target = self.__target_policy.select(xy_frame)
+
+                    if target is not None:
+                        x_pos, y_pos = self.__paw_filter.update(capture_time, target[0], target[1])
                         x_error = x_pos - self.__x_target
                         y_error = y_pos - self.__y_target
-                        self.__error_queue.put((x_error, y_error))
-                        tracking_video.write(cv2.circle(frame,(int(x_pos),int(y_pos)), 8, (255, 0, 0), 2))
-
-                        # check if paw is centred for the given time limit
-                        self.__centred_data.append((time.time(), x_error, y_error))
-                        start_time = self.__centred_data[0][0]
-                        current_time = self.__centred_data[-1][0]
-                        if current_time - start_time >= self.__centred_time:
-                            print(np.array(self.__centred_data)[:,1:3])
+                        self.__errors.post((x_error, y_error, capture_time, (capture_time, inference_time, publish_time, time.perf_counter())))
+                        target_xy = self.__roi.to_roi(target) if self.__roi else target
+                        tracking_video.write(cv2.circle(frame,(int(target_xy[0]),int(target_xy[1])), 8, (255, 0, 0), 2))
+
+                        # check if paw is centred for the given time limit (by capture time of the frames)
+                        if self.__centred_detector.add(capture_time, x_error, y_error):
                             # mouse paw is centred, break loop
-                            if np.allclose([0], np.array(self.__centred_data)[:,1:3], atol=MouseTrackingController.ERROR_THRESHOLD): #Chaned: index just the errors rather than time as well
-                                self.__force_stop = True
+                            self.__force_stop = True
+
+                    # paw not detected: keep following the predicted position for a short dropout
+                    elif self.__paw_filter.is_tracking() and self.__paw_filter.get_dropout_time(capture_time) <= self.__dropout_time:
+                        x_pos, y_pos = self.__paw_filter.predict(capture_time)
+                        self.__errors.post((x_pos - self.__x_target, y_pos - self.__y_target, capture_time, (capture_time, inference_time, publish_time, time.perf_counter())))
+                        tracking_video.write(frame)
 
-                            self.__centred_data.pop(0)
                     else:
-                        self.__error_queue.put((1000,1000)) #1000, 10000 will tell motors to stop when paw not detected.
+                        self.__paw_filter.reset()
+                        self.__errors.post((1000,1000,capture_time,None)) #1000, 10000 will tell motors to stop when paw not detected.
                         tracking_video.write(frame)
                             
             # stop motor follow thread
             tracking_video.release()
             self.__done = True
             follow_thread.join()
+            self.__telemetry.set_attributes(self.__latency_stats.get_attributes())
+            self.__telemetry.stop()
+            DebugLog.debugprint(self, 'Frame to motor command latency:\n' + str(self.__latency_stats))
         
         else:
             self.__done = True
 
     # use fine motors to move the mouse paw into centre of frame
+    # runs at CONTROL_RATE on absolute deadlines and acts on the latest error only, so a slow motor bus
+    # makes the loop skip ticks instead of falling behind the camera
     def motor_follow(self):
         if self.__fine_motors:
+            period = 1.0 / MouseTrackingController.CONTROL_RATE
+            self.__control_stats = ControlLoopStats(period)
+            self.__x_controller.reset()
+            self.__y_controller.reset()
+            self.__fine_motors.resetMotionStats()
+            last_seq = Mailbox.NO_VALUE
+            start_time = time.perf_counter()
+            tick = 0
             while not self.__done:
-                # check if motor stalled (flag is cleared on read)
-                x_stalled = self.is_motor_stalled(self.__fine_motors, MotorController.MOTOR_X_ID)
-                y_stalled = self.is_motor_stalled(self.__fine_motors, MotorController.MOTOR_Y_ID)
+                delay = start_time + tick * period - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                tick_time = time.perf_counter()
+
+                # next deadline, deadlines that already passed are skipped
+                next_tick = max(tick + 1, int((tick_time - start_time) / period) + 1)
+                self.__control_stats.tick(tick_time, next_tick - tick - 1)
+                tick = next_tick
+
+                # check if motor stalled (flag is cleared on read), and read the motor velocities, in one bus round trip
+                fields = self.__fine_motors.fields
+                x_stalled, y_stalled, VX, VY = self.__fine_motors.readRegisterFields([
+                    fields.EVENT_STOP_SG[MotorController.MOTOR_X_ID], fields.EVENT_STOP_SG[MotorController.MOTOR_Y_ID],
+                    fields.VACTUAL[MotorController.MOTOR_X_ID], fields.VACTUAL[MotorController.MOTOR_Y_ID]])
 
                 if x_stalled or y_stalled:
                     DebugLog.debugprint(self, 'Fine motor(s) stalled: X: ' + str(x_stalled) + ' Y: ' + str(y_stalled))
 
-                # determine fine motor adjustments
-                if not self.__error_queue.empty():
-                    VX = self.__fine_motors.readRegisterField(self.__fine_motors.fields.VACTUAL[MotorController.MOTOR_X_ID])
-                    VY = self.__fine_motors.readRegisterField(self.__fine_motors.fields.VACTUAL[MotorController.MOTOR_Y_ID])
+                # determine fine motor adjustments from the latest error, once per error
+                seq, errors = self.__errors.read()
+                if seq > last_seq:
+                    last_seq = seq
 
                     # grab errors
-                    x_error, y_error = self.__error_queue.get()
+                    x_error, y_error, capture_time, timestamps = errors
+                    self.__control_stats.command(time.perf_counter(), capture_time)
                     
                     if (x_error == 1000) & (y_error == 1000): #Use (1000, 1000) in the queue as a signal that a paw wasn't detected in the frame and to stop motor
                         self.__fine_motors.stop(MotorController.MOTOR_X_ID)
                         self.__fine_motors.stop(MotorController.MOTOR_Y_ID)
+                        self.__x_controller.reset()
+                        self.__y_controller.reset()
                         continue
 
-                    # ensure x motors are stopped
-                    if abs(x_error) < MouseTrackingController.ERROR_THRESHOLD:
-                        if VX != 0:
-                            self.__fine_motors.stop(MotorController.MOTOR_X_ID)
-                    # move x motors
-                    else:
-                        value = int(MouseTrackingController.VELOCITY)
-                        if x_error < 0:
-                            self.__fine_motors.rotate_cw(MotorController.MOTOR_X_ID, value)
-                        else:
-                            self.__fine_motors.rotate_ccw(MotorController.MOTOR_X_ID, value)
-
-                    # ensure y motors are stopped
-                    if abs(y_error) < MouseTrackingController.ERROR_THRESHOLD:
-                        if VY != 0:
-                            self.__fine_motors.stop(MotorController.MOTOR_Y_ID)
-                    # move y motors
-                    else:
-                        value = int(MouseTrackingController.VELOCITY)
-                        if y_error > 0:
-                            self.__fine_motors.rotate_ccw(MotorController.MOTOR_Y_ID, value)
-                        else:
-                            self.__fine_motors.rotate_cw(MotorController.MOTOR_Y_ID, value)
+                    command_time = time.perf_counter()
+                    self.drive_motor(MotorController.MOTOR_X_ID, self.__x_controller.update(x_error, capture_time), VX)
+                    self.drive_motor(MotorController.MOTOR_Y_ID, self.__y_controller.update(y_error, capture_time), VY)
+                    latencies = LatencyStats.get_latencies(timestamps + (command_time, time.perf_counter()))
+                    self.__latency_stats.add(latencies)
 
-                    # log tracking data
-                    with self.__data_lock:
-                        self.__tracking_data.append((time.time(), x_error, VX, y_error, VY))
+                    # log tracking data, with the latency of each stage (the total is their sum and not stored)
+                    queue_latency, inference_latency, handoff_latency, control_latency, command_latency, total_latency = latencies
+                    self.__telemetry.append(time.time(), x_error, VX, y_error, VY,
+                        (queue_latency, inference_latency, handoff_latency, control_latency, command_latency))
 
             # ensure x motors are stopped
             self.__fine_motors.stop(MotorController.MOTOR_X_ID)
             self.__fine_motors.stop(MotorController.MOTOR_Y_ID)
 
+            DebugLog.debugprint(self, 'Control loop: ' + str(self.__control_stats))
+            motion_stats = self.__fine_motors.getMotionStats()
+            DebugLog.debugprint(self, 'Motor commands: {0} sent, {1} redundant suppressed'.format(motion_stats['sent'], motion_stats['suppressed']))
+
+    # velocity: from VelocityController.update(), positive rotates ccw, 0 stops
+    # vactual: current velocity of the motor, a stopped motor is not stopped again
+    def drive_motor(self, motor_ID, velocity, vactual):
+        value = int(abs(velocity))
+        if value == 0:
+            if vactual != 0:
+                self.__fine_motors.stop(motor_ID)
+        elif velocity > 0:
+            self.__fine_motors.rotate_ccw(motor_ID, value)
+        else:
+            self.__fine_motors.rotate_cw(motor_ID, value)
+
     # check if motor is stalled
     def is_motor_stalled(self, motors, motor_ID):
         return motors.readRegisterField(motors.fields.EVENT_STOP_SG[motor_ID])
@@ -197,4 +310,5 @@ class MouseTrackingController:
         self.__force_stop = True
 
     def __del__(self):
-        self.__live_tracker.terminate()
+        if self.__tracker_worker:
+            self.__tracker_worker.terminate()
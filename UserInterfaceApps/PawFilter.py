@@ -0,0 +1,79 @@
+import numpy as np
+
+
+# constant-velocity Kalman filter of the paw position in frame pixels
+# state: [x, y, x velocity, y velocity], measurements: [x, y]
+# bridges frames where the tracker is not confident by predicting from the estimated velocity
+class PawFilter:
+    # std of the paw's acceleration, px/s^2 (how quickly the paw can change direction)
+    ACCELERATION_NOISE = 2000.0
+    # std of the tracker's keypoint position, px
+    MEASUREMENT_NOISE = 3.0
+    # initial velocity uncertainty, px/s
+    VELOCITY_NOISE = 500.0
+
+    H = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+
+    def __init__(self, acceleration_noise=ACCELERATION_NOISE, measurement_noise=MEASUREMENT_NOISE):
+        self.__acceleration_noise = acceleration_noise
+        self.__R = np.eye(2) * measurement_noise ** 2
+        self.reset()
+
+    # forget the paw, the next measurement starts a new track
+    def reset(self):
+        self.__state = None
+        self.__P = None
+        self.__time = None
+        self.__measurement_time = None
+
+    def is_tracking(self):
+        return self.__state is not None
+
+    # advance the estimate to time t (s)
+    # return: predicted (x, y), None if not tracking
+    def predict(self, t):
+        if self.__state is None:
+            return None
+
+        dt = t - self.__time
+        if dt > 0:
+            F = np.eye(4)
+            F[0, 2] = F[1, 3] = dt
+            # white acceleration noise, per axis [[dt^4/4, dt^3/2], [dt^3/2, dt^2]]
+            q = np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]]) * self.__acceleration_noise ** 2
+            Q = np.kron(q, np.eye(2))
+
+            self.__state = F @ self.__state
+            self.__P = F @ self.__P @ F.T + Q
+            self.__time = t
+
+        return self.get_position()
+
+    # correct the estimate with a keypoint measured at time t (s)
+    # return: filtered (x, y)
+    def update(self, t, x, y):
+        z = np.array([x, y], dtype=float)
+        if self.__state is None:
+            self.__state = np.array([x, y, 0.0, 0.0], dtype=float)
+            self.__P = np.diag([self.__R[0, 0], self.__R[1, 1], PawFilter.VELOCITY_NOISE ** 2, PawFilter.VELOCITY_NOISE ** 2])
+            self.__time = t
+        else:
+            self.predict(t)
+            S = PawFilter.H @ self.__P @ PawFilter.H.T + self.__R
+            K = self.__P @ PawFilter.H.T @ np.linalg.inv(S)
+            self.__state = self.__state + K @ (z - PawFilter.H @ self.__state)
+            self.__P = (np.eye(4) - K @ PawFilter.H) @ self.__P
+
+        self.__measurement_time = t
+        return self.get_position()
+
+    def get_position(self):
+        return None if self.__state is None else (self.__state[0], self.__state[1])
+
+    # estimated paw velocity, px/s
+    def get_velocity(self):
+        return None if self.__state is None else (self.__state[2], self.__state[3])
+
+    # time since the last measurement (s), None if not tracking
+    def get_dropout_time(self, t):
+        return None if self.__measurement_time is None else t - self.__measurement_time
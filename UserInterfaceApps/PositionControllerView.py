@@ -137,17 +137,16 @@ class PositionControllerView():
                 pass
 
     def did_motors_stop(self, moved_coarse_x, moved_fine_x, moved_fine_y):
-        result = True
+        futures = []
 
         if self.__fine_motors and self.__coarse_motor:
             if moved_coarse_x:
-                result = result and self.__coarse_motor.readRegisterField(self.__coarse_motor.fields.POSITION_REACHED) == 1
-            if moved_fine_x:
-                result = result and self.__fine_motors.getAxisParameter(self.__fine_motors.APs.ActualPosition, MotorController.MOTOR_X_ID) == self.__fine_motors.getAxisParameter(self.__fine_motors.APs.TargetPosition, MotorController.MOTOR_X_ID)
-            if moved_fine_y:
-                result = result and self.__fine_motors.getAxisParameter(self.__fine_motors.APs.ActualPosition, MotorController.MOTOR_Y_ID) == self.__fine_motors.getAxisParameter(self.__fine_motors.APs.TargetPosition, MotorController.MOTOR_Y_ID)
+                futures.append(self.__coarse_motor.position_reached_async())
+            fine_motor_IDs = [motor_ID for motor_ID, moved in ((MotorController.MOTOR_X_ID, moved_fine_x), (MotorController.MOTOR_Y_ID, moved_fine_y)) if moved]
+            if fine_motor_IDs:
+                futures.append(self.__fine_motors.position_reached_async(fine_motor_IDs))
 
-        return result
+        return MotorController.all_positions_reached(futures)
 
     # move system to the left
     # return: if coarse and/or fine motors are moving
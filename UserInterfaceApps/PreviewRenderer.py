@@ -0,0 +1,74 @@
+import threading
+from datetime import datetime
+
+import cv2
+import PIL.Image
+
+from UserInterfaceApps.VideoCameraController import FrameManipulator
+
+
+class PreviewRenderer:
+    # scale of the preview relative to the camera frame
+    SCALE = 1.0
+
+    # how long the worker waits for a new frame before checking for stop
+    FRAME_TIMEOUT = 0.5
+
+    # prepares display-ready images of the live feed on a worker thread
+    # the Tk thread only has to wrap the newest image in a PhotoImage (see get_image)
+    def __init__(self, videocapture, target, scale=SCALE):
+        self.__videocapture = videocapture
+        self.__target = target
+        self.__scale = scale
+
+        self.__lock = threading.Lock()
+        self.__image = None
+        self.__seq = -1
+        self.__stop = False
+
+        self.__thread = threading.Thread(target=self.render_loop, daemon=True)
+        self.__thread.start()
+
+    def render_loop(self):
+        last_seq = -1
+        while not self.__stop:
+            seq, frame = self.__videocapture.wait_for_frame(last_seq, timeout=PreviewRenderer.FRAME_TIMEOUT)
+            if seq < 0:
+                continue
+            last_seq = seq
+
+            image = self.render(frame)
+
+            # render() read the frame in place, drop it if the capture process overwrote it meanwhile
+            if not self.__videocapture.frame_buffer.is_current(seq):
+                continue
+
+            with self.__lock:
+                self.__image = image
+                self.__seq = seq
+
+    # draw the overlays on a copy of the frame and convert it for display
+    def render(self, frame):
+        # the frame is a view into the camera's shared memory, which MouseTracking reads as well
+        # converting to RGB (needed to display) creates the only copy, so draw on the converted frame
+        im = FrameManipulator.convert_BGR2RGB(frame)
+        im = FrameManipulator.draw_timestamp(im, datetime.now())
+        im = FrameManipulator.draw_crosshair(im, self.__target, FrameManipulator.CROSSHAIR_COLOR[::-1])
+
+        if self.__scale != 1.0:
+            im = cv2.resize(im, None, fx=self.__scale, fy=self.__scale, interpolation=cv2.INTER_AREA)
+
+        return PIL.Image.fromarray(im)
+
+    # get the newest rendered image
+    # return: (sequence number, PIL image), image is None if nothing newer than last_seq was rendered
+    def get_image(self, last_seq=-1):
+        with self.__lock:
+            if self.__seq <= last_seq:
+                return last_seq, None
+            return self.__seq, self.__image
+
+    # stop the worker thread, waits for it up to timeout
+    def stop(self, timeout=FRAME_TIMEOUT * 2):
+        self.__stop = True
+        self.__thread.join(timeout)
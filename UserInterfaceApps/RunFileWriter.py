@@ -11,18 +11,37 @@ class RunFileWriter:
     AVI_EXTENSION = '.avi'
     #MP4_EXTENSION = '.mp4'
     HDF5_EXTENSION = '.hdf5'
+    FRAMETIMES_SUFFIX = '_frametimes.npy'
+
+    # camera whose files keep the original (single camera) names
+    SUBSTAGE_CAMERA = 'substage'
+
+    # per-frame timestamp sidecar of a video file
+    # index: frame index in the capture schedule, time: capture time relative to the recording start (s),
+    # backend_time: timestamp reported by the capture backend (s)
+    FRAMETIMES_DTYPE = np.dtype([('index', '<i8'), ('time', '<f8'), ('backend_time', '<f8')])
+
+    # tracking data columns, see MouseTrackingController.motor_follow() and TrackingTelemetry
+    # latencies (s) of the stages from the camera frame to the motor command, see LatencyStats
+    TRACKING_COLUMNS = ('Time', 'XError', 'XVelocity', 'YError', 'YVelocity',
+        'QueueLatency', 'InferenceLatency', 'HandoffLatency', 'ControlLatency', 'CommandLatency')
 
     OPENFILEDIALOG_FILETYPES = (('Test Files', ['*.avi', '*.csv']), ('HDF5 Files', ['*.hdf5']), ('All types', '*.*'))
 
     # output the data filename in the following format
+    # camera: name of the camera for video files/datasets (see CaptureManager)
     @staticmethod
-    def format_datafilename(filename, mouse_id, trial_id, file_ext):
+    def format_datafilename(filename, mouse_id, trial_id, file_ext, camera=SUBSTAGE_CAMERA):
         result = {}
 
         # AVI file:
         # [filename]_mouse[mouse_id]_trial[trial_id].avi
+        # [filename]_mouse[mouse_id]_trial[trial_id]_frametimes.npy
+        # other cameras than the substage camera: [filename]_mouse[mouse_id]_trial[trial_id]_[camera].avi
         if file_ext == RunFileWriter.AVI_EXTENSION:
-            result['video_file'] = filename + '_mouse' + str(mouse_id) + '_trial' + str(trial_id) + file_ext
+            camera_suffix = '' if camera == RunFileWriter.SUBSTAGE_CAMERA else '_' + camera
+            result['video_file'] = filename + '_mouse' + str(mouse_id) + '_trial' + str(trial_id) + camera_suffix + file_ext
+            result['frametimes_file'] = RunFileWriter.format_frametimes_filename(result['video_file'])
 
         # CSV file:
         # [filename]_mouse[mouse_id]_trial[trial_id]_wave.csv
@@ -34,21 +53,65 @@ class RunFileWriter:
         # HDF5 file:
         # trial[trial_id]_wave
         # trial[trial_id]_tracking
-        # trial[trial_id]_substage_frame_times
+        # trial[trial_id]_[camera]_frame_times
+        # trial[trial_id]_[camera]_frame_info
+        # trial[trial_id]_frame_groups
+        # trial[trial_id]_[camera]_keypoints (written by RetrackSession.py)
+        # trial[trial_id]_live_keypoints
+        # trial[trial_id]_live_keypoint_frames
         elif file_ext == RunFileWriter.HDF5_EXTENSION:
             result['waveform_dataset'] = 'trial' + str(trial_id) + '_wave'
             result['tracking_dataset'] = 'trial' + str(trial_id) + '_tracking'
-            result['frametimes_dataset'] = 'trial' + str(trial_id) + '_substage_frame_times'
+            result['frametimes_dataset'] = 'trial' + str(trial_id) + '_' + camera + '_frame_times'
+            result['frameinfo_dataset'] = 'trial' + str(trial_id) + '_' + camera + '_frame_info'
+            result['framegroups_dataset'] = 'trial' + str(trial_id) + '_frame_groups'
+            result['keypoints_dataset'] = 'trial' + str(trial_id) + '_' + camera + '_keypoints'
+            result['livekeypoints_dataset'] = 'trial' + str(trial_id) + '_live_keypoints'
+            result['livekeypointframes_dataset'] = 'trial' + str(trial_id) + '_live_keypoint_frames'
 
         return result
 
+    # sidecar filename for a video file
+    @staticmethod
+    def format_frametimes_filename(video_file):
+        return os.path.splitext(video_file)[0] + RunFileWriter.FRAMETIMES_SUFFIX
+
+    # save the per-frame timestamps of a video file (see VideoCameraController.get_frame_info()) next to it
+    @staticmethod
+    def save_frametimes(video_file, frame_info):
+        frame_times = np.empty(len(frame_info['times']), dtype=RunFileWriter.FRAMETIMES_DTYPE)
+        frame_times['index'] = frame_info['indices']
+        frame_times['time'] = frame_info['times']
+        frame_times['backend_time'] = frame_info['backend_times']
+        np.save(RunFileWriter.format_frametimes_filename(video_file), frame_times)
+
+    # load the per-frame timestamps of a video file
+    # return: structured array (FRAMETIMES_DTYPE), None if the video has no sidecar
+    @staticmethod
+    def load_frametimes(video_file):
+        filepath = RunFileWriter.format_frametimes_filename(video_file)
+        if not os.path.isfile(filepath):
+            return None
+        return np.load(filepath)
+
+    # index of the frame showing time t (s, same clock as frame_times['time'])
+    # i.e. the last frame captured at or before t, clamped to the video
+    @staticmethod
+    def frame_at_time(frame_times, t):
+        times = frame_times['time'] if frame_times.dtype.names else frame_times
+        index = int(np.searchsorted(times, t, side='right')) - 1
+        return min(max(index, 0), len(times) - 1)
+
     # save trial(s) as an HDF5 file
     # /
     # mouseF1
-    #     trial1 (metadata: datetime)
+    #     trial1 (metadata: datetime, waveform launch time on the frame times clock)
     #         trial1_wave (metadata: wave parameters)
     #         trial1_tracking
     #         trial1_frame_times
+    #         trial1_frame_info (metadata: dropped frames)
+    #         trial1_[camera]_frame_info (metadata: dropped frames, path), one per additional camera
+    #         trial1_frame_groups (metadata: camera names)
     #     trial2 (metadata: datetime)
     #         trial2_wave (metadata: wave parameters)
     #         trial2_tracking
@@ -58,7 +121,7 @@ class RunFileWriter:
     # ...
     # exceptions: wave_data is None
     @staticmethod
-    def save_HDF5(selected_folder, filename, mouse_id, trial_id, trial_datetime, wave_settings, wave_data, tracking_data=None, substage_frame_times=None, good_trial=1, comment='',videopath=None, hsv_params=None):
+    def save_HDF5(selected_folder, filename, mouse_id, trial_id, trial_datetime, wave_settings, wave_data, tracking_data=None, substage_frame_times=None, good_trial=1, comment='',videopath=None, hsv_params=None, substage_frame_info=None, camera_frame_info=None, frame_groups=None, live_keypoints=None, wave_start_time=None):
         filepath = selected_folder + '\\' + filename + RunFileWriter.HDF5_EXTENSION
 
         # create HDF5 file, r/w if exists
@@ -81,6 +144,9 @@ class RunFileWriter:
             # trial group metadata: datetime
             trial_datetime = trial_datetime.strftime("%Y-%m-%d %H:%M:%S")
             trial_group.attrs.create('timestamp', trial_datetime, dtype=str('a' + str(len(trial_datetime))))
+            # wave_start_time: waveform launch (s), on the clock of the frame times
+            if wave_start_time is not None:
+                trial_group.attrs.create('wave_start_time', wave_start_time, dtype='f8')
 
             # create datasets for each trial, overwrite if exists
             dataset_names = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.HDF5_EXTENSION)
@@ -94,6 +160,7 @@ class RunFileWriter:
             substage_frame_times_dataset = None
             frame_times_exists = False
             frame_times_datafilename = dataset_names['frametimes_dataset']
+            frame_info_datafilename = dataset_names['frameinfo_dataset']
 
             for key in trial_group.keys():
                 if key == waveform_datafilename:
@@ -167,17 +234,70 @@ class RunFileWriter:
 
                 substage_frame_times_dataset[:] = substage_frame_times
 
+            # per-frame capture record
+            # data[i] = [frame index, capture time, capture backend time]
+            if substage_frame_info:
+                frame_info = np.column_stack((substage_frame_info['indices'], substage_frame_info['times'], substage_frame_info['backend_times']))
+                if frame_info_datafilename in trial_group:
+                    del trial_group[frame_info_datafilename]
+                frame_info_dataset = trial_group.create_dataset(frame_info_datafilename, frame_info.shape, dtype='f8')
+                frame_info_dataset[:] = frame_info
+                frame_info_dataset.attrs.create('dropped_frames', substage_frame_info['dropped_frames'], dtype=int)
+
+            # per-frame capture record of the other cameras, same layout
+            # camera_frame_info: {camera name: frame info with 'path' (video file path)}
+            if camera_frame_info:
+                for camera, info in camera_frame_info.items():
+                    camera_datafilename = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.HDF5_EXTENSION, camera)['frameinfo_dataset']
+                    frame_info = np.column_stack((info['indices'], info['times'], info['backend_times']))
+                    if camera_datafilename in trial_group:
+                        del trial_group[camera_datafilename]
+                    frame_info_dataset = trial_group.create_dataset(camera_datafilename, frame_info.shape, dtype='f8')
+                    frame_info_dataset[:] = frame_info
+                    frame_info_dataset.attrs.create('dropped_frames', info['dropped_frames'], dtype=int)
+                    if info.get('path'):
+                        frame_info_dataset.attrs.create('path', info['path'], dtype=str('a' + str(len(info['path']))))
+
+            # synchronized frame groups (see CaptureManager.match_frame_times)
+            # data[i] = [frame of camera 0, frame of camera 1, ...], -1 if the camera has no frame in the group
+            if frame_groups:
+                framegroups_datafilename = dataset_names['framegroups_dataset']
+                if framegroups_datafilename in trial_group:
+                    del trial_group[framegroups_datafilename]
+                framegroups_dataset = trial_group.create_dataset(framegroups_datafilename, frame_groups['groups'].shape, dtype='i8')
+                framegroups_dataset[:] = frame_groups['groups']
+                cameras = ','.join(frame_groups['cameras'])
+                framegroups_dataset.attrs.create('cameras', cameras, dtype=str('a' + str(len(cameras))))
+                framegroups_dataset.attrs.create('tolerance', frame_groups['tolerance'], dtype='f8')
+
             # tracking data
-            # data[i] = [time, xerror, xvelocity, yerror, yvelocity]
+            # data[i] = [time, xerror, xvelocity, yerror, yvelocity, stage latencies...] (TRACKING_COLUMNS)
             if type(tracking_data) is np.ndarray:
                 if tracking_exists:
                     tracking_dataset = trial_group[tracking_datafilename]
                     tracking_dataset.resize(tracking_data.shape[0], axis=0)
                 else:
-                    tracking_dataset = trial_group.create_dataset(tracking_datafilename, tracking_data.shape, dtype='f', maxshape=(None, tracking_data.shape[1]))
+                    tracking_dataset = trial_group.create_dataset(tracking_datafilename, tracking_data.shape, dtype='f8', maxshape=(None, tracking_data.shape[1]))
 
                 tracking_dataset[:] = tracking_data
 
+            # keypoints of the estimates autodetect acted on (see MouseTrackingController.get_keypoint_log())
+            # keypoints: data[i] = (keypoints, 3) array of [x, y, accuracy] in frame px
+            # keypoint frames: data[i] = [frame sequence number, capture time]
+            if live_keypoints:
+                livekeypoints_datafilename = dataset_names['livekeypoints_dataset']
+                livekeypointframes_datafilename = dataset_names['livekeypointframes_dataset']
+                for datafilename in (livekeypoints_datafilename, livekeypointframes_datafilename):
+                    if datafilename in trial_group:
+                        del trial_group[datafilename]
+                livekeypoints_dataset = trial_group.create_dataset(livekeypoints_datafilename, live_keypoints['keypoints'].shape, dtype='f4')
+                livekeypoints_dataset[:] = live_keypoints['keypoints']
+                target_policy = live_keypoints['target_policy']
+                livekeypoints_dataset.attrs.create('target_policy', target_policy, dtype=str('a' + str(len(target_policy))))
+                keypoint_frames = np.column_stack((live_keypoints['frames'], live_keypoints['times']))
+                livekeypointframes_dataset = trial_group.create_dataset(livekeypointframes_datafilename, keypoint_frames.shape, dtype='f8')
+                livekeypointframes_dataset[:] = keypoint_frames
+
             '''
             frames = self.__videocapture.get_last_savedframes()
             dataset_shape = (len(frames), frames[0].shape[0], frames[0].shape[1], frames[0].shape[2])
@@ -186,6 +306,64 @@ class RunFileWriter:
             video_dataset[:] = frames
             '''
 
+    # create the (empty) tracking dataset of a trial to append to while the trial runs, overwrite if exists
+    # the trial group is tagged with its number so the file stays readable by get_hdf5_info() if the trial never gets saved
+    # chunk_size: rows per HDF5 chunk
+    @staticmethod
+    def create_tracking_dataset(selected_folder, filename, mouse_id, trial_id, chunk_size):
+        filepath = selected_folder + '\\' + filename + RunFileWriter.HDF5_EXTENSION
+        tracking_datafilename = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.HDF5_EXTENSION)['tracking_dataset']
+
+        with h5py.File(filepath, 'a') as hdf5:
+            trial_group = hdf5.require_group('mouse' + str(mouse_id)).require_group('trial' + str(trial_id))
+            if 'num' not in trial_group.attrs:
+                trial_group.attrs.create('num', trial_id, dtype=int)
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                trial_group.attrs.create('timestamp', timestamp, dtype=str('a' + str(len(timestamp))))
+
+            if tracking_datafilename in trial_group:
+                del trial_group[tracking_datafilename]
+            tracking_dataset = trial_group.create_dataset(tracking_datafilename, (0, len(RunFileWriter.TRACKING_COLUMNS)), dtype='f8',
+                maxshape=(None, len(RunFileWriter.TRACKING_COLUMNS)), chunks=(chunk_size, len(RunFileWriter.TRACKING_COLUMNS)))
+            columns = ','.join(RunFileWriter.TRACKING_COLUMNS)
+            tracking_dataset.attrs.create('columns', columns, dtype=str('a' + str(len(columns))))
+
+    # append rows ((N, len(TRACKING_COLUMNS)) array) to a tracking dataset created by create_tracking_dataset()
+    # the file is closed again, so everything appended so far survives a crash
+    @staticmethod
+    def append_tracking_data(selected_folder, filename, mouse_id, trial_id, tracking_data):
+        filepath = selected_folder + '\\' + filename + RunFileWriter.HDF5_EXTENSION
+        tracking_datafilename = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.HDF5_EXTENSION)['tracking_dataset']
+
+        with h5py.File(filepath, 'a') as hdf5:
+            tracking_dataset = hdf5['mouse' + str(mouse_id)]['trial' + str(trial_id)][tracking_datafilename]
+            size = tracking_dataset.shape[0]
+            tracking_dataset.resize(size + tracking_data.shape[0], axis=0)
+            tracking_dataset[size:] = tracking_data
+
+    # set metadata of a tracking dataset created by create_tracking_dataset(), e.g. LatencyStats.get_attributes()
+    @staticmethod
+    def set_tracking_attributes(selected_folder, filename, mouse_id, trial_id, attributes):
+        filepath = selected_folder + '\\' + filename + RunFileWriter.HDF5_EXTENSION
+        tracking_datafilename = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.HDF5_EXTENSION)['tracking_dataset']
+
+        with h5py.File(filepath, 'a') as hdf5:
+            tracking_dataset = hdf5['mouse' + str(mouse_id)]['trial' + str(trial_id)][tracking_datafilename]
+            for name, value in attributes.items():
+                tracking_dataset.attrs.create(name, value, dtype='f8')
+
+    # return: tracking dataset of a trial as an (N, len(TRACKING_COLUMNS)) array, None if it doesn't exist
+    @staticmethod
+    def load_tracking_data(selected_folder, filename, mouse_id, trial_id):
+        filepath = selected_folder + '\\' + filename + RunFileWriter.HDF5_EXTENSION
+        tracking_datafilename = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.HDF5_EXTENSION)['tracking_dataset']
+
+        try:
+            with h5py.File(filepath, 'r') as hdf5:
+                return hdf5['mouse' + str(mouse_id)]['trial' + str(trial_id)][tracking_datafilename][:]
+        except (KeyError, OSError):
+            return None
+
     # save one trial as a .csv file
     # exceptions: wave_data is None
     @staticmethod
@@ -208,30 +386,21 @@ class RunFileWriter:
                     receive_blue = wave_data['blue']
                     receive_red = wave_data['red']
 
-                    f.write('Blue,Red\n')
-                    for i in range(receive_blue.size):
-                        f.write(','.join([str(receive_blue[i]), str(receive_red[i])]) + '\n')
+                    np.savetxt(f, np.column_stack((receive_blue, receive_red)), fmt='%s', delimiter=',', header='Blue,Red', comments='')
 
                 elif wave_config == PhotostimulatorTool.REDGREENLASER_CONFIG_NAME:
                     receive_green = wave_data['green']
                     receive_laser = wave_data['laser']
                     receive_red = wave_data['red']
 
-                    f.write('Green,LASER,Red\n')
-                    for i in range(receive_green.size):
-                        f.write(','.join([str(receive_green[i]), str(receive_laser[i]), str(receive_red[i])]) + '\n')
+                    np.savetxt(f, np.column_stack((receive_green, receive_laser, receive_red)), fmt='%s', delimiter=',', header='Green,LASER,Red', comments='')
 
         # tracking data
         # Time,XError,XVelocity,YError,YVelocity
         if type(tracking_data) is np.ndarray:
             filepath = selected_folder + '\\' + tracking_filename
             with open(filepath, 'w') as f:
-                f.write('Time,XError,XVelocity,YError,YVelocity\n')
-                for i in range(tracking_data.shape[0]):
-                    row = []
-                    for j in range(tracking_data.shape[1]):
-                        row.append(str(tracking_data[i][j]))
-                    f.write(','.join(row) + '\n')
+                np.savetxt(f, tracking_data, fmt='%s', delimiter=',', header=','.join(RunFileWriter.TRACKING_COLUMNS), comments='')
 
     @staticmethod
     def get_hdf5_info(selected_folder, filename, mouse_id):
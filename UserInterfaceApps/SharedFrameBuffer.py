@@ -0,0 +1,179 @@
+'''
+Ring buffer of camera frames in shared memory
+
+The capture process writes each new frame into the next slot of the ring and
+stamps it with an increasing sequence number. Readers in other processes
+(GUI, mouse tracking, recorder) map the same block and read the newest frame
+as a numpy view, without pickling or copying the frame through a queue.
+'''
+
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedFrameBuffer:
+    # number of frame slots in the ring
+    # a view returned by read_latest() stays valid for about (SLOTS - 1) frame periods
+    SLOTS = 4
+
+    # header (int64): [latest sequence number, slot 0 sequence number, slot 1 sequence number, ...]
+    # followed by (float64): [slot 0 timestamp, slot 1 timestamp, ...]
+    # followed by the frame slots
+    NO_FRAME = -1
+    WRITING = -2
+
+    # poll interval while waiting for a new frame
+    POLL_INTERVAL = 0.001
+
+    def __init__(self, shape, dtype=np.uint8, slots=SLOTS, name=None):
+        self.__shape = tuple(shape)
+        self.__dtype = np.dtype(dtype)
+        self.__slots = slots
+
+        # only the process that created the block may unlink it
+        self.__owner = name is None
+        if self.__owner:
+            self.__shm = shared_memory.SharedMemory(create=True, size=SharedFrameBuffer.get_size(self.__shape, self.__dtype, slots))
+        else:
+            self.__shm = shared_memory.SharedMemory(name=name)
+
+        self.__map_arrays()
+
+        if self.__owner:
+            self.__header[:] = SharedFrameBuffer.NO_FRAME
+            self.__times[:] = 0
+
+    # size in bytes of the shared memory block
+    @staticmethod
+    def get_size(shape, dtype, slots):
+        frame_size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return 8 * (slots + 1) + 8 * slots + frame_size * slots
+
+    def __map_arrays(self):
+        buf = self.__shm.buf
+        header_size = 8 * (self.__slots + 1)
+        times_size = 8 * self.__slots
+
+        self.__header = np.ndarray((self.__slots + 1,), dtype=np.int64, buffer=buf)
+        self.__times = np.ndarray((self.__slots,), dtype=np.float64, buffer=buf, offset=header_size)
+        self.__frames = np.ndarray((self.__slots,) + self.__shape, dtype=self.__dtype, buffer=buf, offset=header_size + times_size)
+
+    # reattach to the same block when passed to another process
+    def __getstate__(self):
+        return {'name': self.__shm.name, 'shape': self.__shape, 'dtype': self.__dtype.str, 'slots': self.__slots}
+
+    def __setstate__(self, state):
+        self.__init__(state['shape'], dtype=state['dtype'], slots=state['slots'], name=state['name'])
+
+    def get_name(self):
+        return self.__shm.name
+
+    def get_shape(self):
+        return self.__shape
+
+    # copy a frame into the next slot (capture process only)
+    # return: sequence number of the written frame
+    def write(self, frame, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        seq = int(self.__header[0]) + 1
+        slot = seq % self.__slots
+
+        # mark the slot as being written so readers holding an old view can detect it
+        self.__header[slot + 1] = SharedFrameBuffer.WRITING
+        self.__frames[slot][...] = frame
+        self.__times[slot] = timestamp
+        self.__header[slot + 1] = seq
+
+        # publish
+        self.__header[0] = seq
+        return seq
+
+    # return: (sequence number, timestamp, frame view) of the newest frame, or (NO_FRAME, None, None)
+    # note: the frame is a view into shared memory, do not draw on it. Copy it to keep it longer than a few frames
+    def read_latest(self):
+        seq = int(self.__header[0])
+        if seq < 0:
+            return SharedFrameBuffer.NO_FRAME, None, None
+
+        slot = seq % self.__slots
+        return seq, float(self.__times[slot]), self.__frames[slot]
+
+    # return: (sequence number, timestamp, frame view) of frame seq, or (NO_FRAME, None, None) if it was overwritten
+    def read(self, seq):
+        if not self.is_current(seq):
+            return SharedFrameBuffer.NO_FRAME, None, None
+
+        slot = seq % self.__slots
+        return seq, float(self.__times[slot]), self.__frames[slot]
+
+    # return: (sequence number, timestamp, frame copy) of frame seq, or (NO_FRAME, None, None) if it was overwritten
+    # before or while it was copied
+    def copy(self, seq):
+        seq, timestamp, frame = self.read(seq)
+        if frame is None:
+            return SharedFrameBuffer.NO_FRAME, None, None
+
+        frame = frame.copy()
+        if not self.is_current(seq):
+            return SharedFrameBuffer.NO_FRAME, None, None
+        return seq, timestamp, frame
+
+    # return: (sequence number, timestamp, frame copy) of the newest frame, or (NO_FRAME, None, None)
+    # a frame overwritten while it was copied (the writer lapped the reader) is replaced by the next newest
+    def copy_latest(self):
+        while True:
+            seq, timestamp, frame = self.read_latest()
+            if frame is None:
+                return SharedFrameBuffer.NO_FRAME, None, None
+
+            seq, timestamp, frame = self.copy(seq)
+            if frame is not None:
+                return seq, timestamp, frame
+
+    # return: (sequence number, timestamp, frame view) of the frame in the ring captured closest to t,
+    # or (NO_FRAME, None, None) if no frame was captured yet
+    # note: same as read_latest(), the frame is a view into shared memory
+    def read_nearest(self, t):
+        best_seq, best_slot = SharedFrameBuffer.NO_FRAME, None
+        for slot in range(self.__slots):
+            seq = int(self.__header[slot + 1])
+            if seq < 0:
+                continue
+            if best_slot is None or abs(self.__times[slot] - t) < abs(self.__times[best_slot] - t):
+                best_seq, best_slot = seq, slot
+
+        if best_slot is None:
+            return SharedFrameBuffer.NO_FRAME, None, None
+        return best_seq, float(self.__times[best_slot]), self.__frames[best_slot]
+
+    # block until a frame newer than last_seq is available
+    # return: same as read_latest(), or (NO_FRAME, None, None) on timeout
+    def wait_for_frame(self, last_seq=NO_FRAME, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while int(self.__header[0]) <= last_seq:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return SharedFrameBuffer.NO_FRAME, None, None
+            time.sleep(SharedFrameBuffer.POLL_INTERVAL)
+
+        return self.read_latest()
+
+    # check that a view returned for seq has not been overwritten since
+    def is_current(self, seq):
+        return seq >= 0 and int(self.__header[seq % self.__slots + 1]) == seq
+
+    def get_latest_seq(self):
+        return int(self.__header[0])
+
+    def close(self):
+        # release the numpy views before closing the mapping
+        self.__header = None
+        self.__times = None
+        self.__frames = None
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+            self.__owner = False
@@ -0,0 +1,280 @@
+'''
+Simulated camera, paw tracker and fine motor stage
+
+Runs MouseTrackingController closed loop without a camera, DLC model or
+TMC5072 board (see AutodetectBenchmark.py):
+- SimulatedStage: TMCL interface (based on dummy_tmcl_interface) that decodes
+  the commands of a TMC5072 eval board and integrates the velocity commands of
+  both motors into stage positions, with the board's acceleration ramp
+- SimulatedCamera: renders a paw blob at the position the stage moved it to,
+  into a SharedFrameBuffer, like VideoCameraController
+- SimulatedTracker: LiveTracker that finds the blob, runs in the TrackerWorker
+'''
+
+import math
+import struct
+import threading
+import time
+from threading import Lock
+
+import cv2
+import numpy as np
+
+from PyTrinamic.TMCL import TMCL_Command, TMCL_Status, TMCL_Reply, _PACKAGE_STRUCTURE
+from PyTrinamic.connections.dummy_tmcl_interface import dummy_tmcl_interface
+from PyTrinamic.helpers import TMC_helpers
+from PyTrinamic.ic.TMC5072.TMC5072_register import TMC5072_register
+from PyTrinamic.evalboards.TMC5072_eval import _APs
+from .LiveTracker import LiveTracker
+from .SharedFrameBuffer import SharedFrameBuffer
+
+
+# two TMC5072 motors behind a TMCL connection
+# velocities are in TMC5072 units (VMAX/VACTUAL), positions in microsteps
+class SimulatedStage(dummy_tmcl_interface):
+    MOTORS = 2
+
+    # TMC5072 clock (Hz), converts register units to microsteps/s and microsteps/s^2
+    CLOCK = 16e6
+    VELOCITY_SCALE = CLOCK / 2 ** 24
+    # acceleration of the ROR ramp, AMAX = 1000 (see Motors_TMC5072_eval.rest_registers), in velocity units/s
+    ACCELERATION = 1000 * CLOCK / 2 ** 17
+
+    # bus round trip of one TMCL command (s), about a 9 byte request/reply at 115200 baud
+    COMMAND_TIME = 0.0016
+
+    def __init__(self, acceleration=ACCELERATION, command_time=COMMAND_TIME):
+        dummy_tmcl_interface.__init__(self, 'simulated')
+        self.enableDebug(False)
+
+        self.__acceleration = acceleration
+        self.__command_time = command_time
+        self.__lock = Lock()
+        self.__registers = {}
+        self.__reply = bytearray(9)
+        self.__commands = 0
+        self.reset()
+
+    # stop both motors and zero their positions
+    def reset(self):
+        with self.__lock:
+            self.__time = time.perf_counter()
+            self.__position = [0.0] * SimulatedStage.MOTORS
+            self.__velocity = [0.0] * SimulatedStage.MOTORS
+            self.__target_velocity = [0.0] * SimulatedStage.MOTORS
+
+    # return: position of a motor (microsteps) at time t (perf_counter(), default now)
+    def get_position(self, motor, t=None):
+        with self.__lock:
+            self.__advance(t if t is not None else time.perf_counter())
+            return self.__position[motor]
+
+    # return: number of TMCL commands handled
+    def get_command_count(self):
+        return self.__commands
+
+    # integrate the ramp of both motors up to time t
+    def __advance(self, t):
+        dt = t - self.__time
+        if dt <= 0:
+            return
+        self.__time = t
+
+        for motor in range(SimulatedStage.MOTORS):
+            v0 = self.__velocity[motor]
+            dv = self.__target_velocity[motor] - v0
+            ramp_time = min(dt, abs(dv) / self.__acceleration)
+            v1 = v0 + math.copysign(self.__acceleration * ramp_time, dv)
+            # accelerate for ramp_time, then hold the target velocity
+            self.__position[motor] += ((v0 + v1) / 2 * ramp_time + v1 * (dt - ramp_time)) * SimulatedStage.VELOCITY_SCALE
+            self.__velocity[motor] = v1
+
+    def __read_register(self, address):
+        for motor in range(SimulatedStage.MOTORS):
+            if address == TMC5072_register.VACTUAL[motor]:
+                return int(round(self.__velocity[motor])) & 0x00FFFFFF
+            if address == TMC5072_register.XACTUAL[motor]:
+                return int(round(self.__position[motor]))
+            # no stall events
+            if address == TMC5072_register.RAMP_STAT[motor]:
+                return 0
+        return self.__registers.get(address, 0)
+
+    def __write_register(self, address, value):
+        self.__registers[address] = value
+        for motor in range(SimulatedStage.MOTORS):
+            # velocity mode: 1 positive, 2 negative VMAX, position mode holds still
+            if address in (TMC5072_register.VMAX[motor], TMC5072_register.RAMPMODE[motor]):
+                ramp_mode = self.__registers.get(TMC5072_register.RAMPMODE[motor], 0)
+                vmax = self.__registers.get(TMC5072_register.VMAX[motor], 0)
+                self.__target_velocity[motor] = vmax if ramp_mode == 1 else -vmax if ramp_mode == 2 else 0.0
+            elif address == TMC5072_register.XACTUAL[motor]:
+                self.__position[motor] = float(TMC_helpers.toSigned32(value))
+
+    # handle one request, the reply is returned by _recv()
+    def _send(self, hostID, moduleID, data):
+        address, command, command_type, motor, value, checksum = struct.unpack(_PACKAGE_STRUCTURE, data)
+        value = TMC_helpers.toSigned32(value)
+
+        with self.__lock:
+            self.__advance(time.perf_counter())
+            self.__commands += 1
+
+            reply_value = 0
+            if command == TMCL_Command.ROR:
+                self.__target_velocity[motor] = float(value)
+            elif command == TMCL_Command.ROL:
+                self.__target_velocity[motor] = float(-value)
+            elif command == TMCL_Command.MST:
+                self.__target_velocity[motor] = 0.0
+            elif command == TMCL_Command.WRITE_MC:
+                self.__write_register(command_type, value)
+            elif command == TMCL_Command.READ_MC:
+                reply_value = self.__read_register(command_type)
+            elif command == TMCL_Command.GAP:
+                if command_type == _APs.ActualPosition:
+                    reply_value = int(round(self.__position[motor]))
+                elif command_type == _APs.ActualVelocity:
+                    reply_value = int(round(self.__velocity[motor]))
+                elif command_type == _APs.TargetVelocity:
+                    reply_value = int(round(self.__target_velocity[motor]))
+
+            self.__reply = TMCL_Reply(hostID, moduleID, TMCL_Status.SUCCESS, command, reply_value).toBuffer()
+
+    def _recv(self, hostID, moduleID):
+        if self.__command_time > 0:
+            time.sleep(self.__command_time)
+        return self.__reply
+
+    # pipelined commands (tmcl_interface.send_batch) cost one round trip for the whole batch
+    def _send_batch(self, hostID, moduleID, data):
+        replies = bytearray()
+        for i in range(0, len(data), 9):
+            self._send(hostID, moduleID, data[i:i+9])
+            replies += self.__reply
+        if self.__command_time > 0:
+            time.sleep(self.__command_time)
+        return replies
+
+    def printInfo(self):
+        print("Connection: type=SimulatedStage")
+
+
+# renders a white paw blob on a dark frame at FPS
+# the paw is fixed on the stage: moving a motor by one microstep moves it by PIXELS_PER_STEP px on the frame,
+# in the direction MouseTrackingController drives to reduce the error, plus an optional wobble of the paw itself
+class SimulatedCamera:
+    FPS = 30
+    WIDTH = 640
+    HEIGHT = 480
+    TARGET = (0.5, 0.5)
+
+    # 256 microsteps x 200 steps per 5 mm lead, at about 20 px/mm
+    PIXELS_PER_STEP = 20.0 / (200 * 256 / 5)
+    PAW_RADIUS = 12
+
+    # stage: SimulatedStage moving the paw
+    # paw_motion: (amplitude in px, frequency in Hz) of the paw's own motion
+    def __init__(self, stage, fps=FPS, width=WIDTH, height=HEIGHT, pixels_per_step=PIXELS_PER_STEP, paw_motion=(0.0, 0.0)):
+        self.__stage = stage
+        self.__fps = fps
+        self.__width = width
+        self.__height = height
+        self.__pixels_per_step = pixels_per_step
+        self.__paw_motion = paw_motion
+        self.target = (int(SimulatedCamera.TARGET[0] * width), int(SimulatedCamera.TARGET[1] * height))
+
+        self.frame_buffer = SharedFrameBuffer((height, width, 3), dtype=np.uint8)
+        self.__paw_lock = Lock()
+        self.__paw = (float(self.target[0]), float(self.target[1]))
+        self.__paw_time = time.perf_counter()
+
+        self.open = True
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    # put the paw at (x, y) px on the frame, wherever the stage is
+    def place_paw(self, x, y):
+        t = time.perf_counter()
+        with self.__paw_lock:
+            self.__paw = (x - self.__pixels_per_step * self.__stage.get_position(0, t), y - self.__pixels_per_step * self.__stage.get_position(1, t))
+            self.__paw_time = t
+
+    # return: (x, y) px of the paw on the frame at time t (perf_counter())
+    def get_paw_position(self, t):
+        with self.__paw_lock:
+            paw_x, paw_y = self.__paw
+            paw_time = self.__paw_time
+        amplitude, frequency = self.__paw_motion
+        wobble = amplitude * math.sin(2 * math.pi * frequency * (t - paw_time))
+        return (paw_x + self.__pixels_per_step * self.__stage.get_position(0, t) + wobble,
+            paw_y + self.__pixels_per_step * self.__stage.get_position(1, t) + wobble / 2)
+
+    # frames on an absolute schedule, as VideoCameraController.run()
+    def run(self):
+        frame_delay = 1.0 / self.__fps
+        background = np.full((self.__height, self.__width, 3), 40, dtype=np.uint8)
+        start_time = time.perf_counter()
+        frame_index = 0
+        while self.open:
+            delay = start_time + frame_index * frame_delay - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            frame_time = time.perf_counter()
+            frame_index = max(frame_index + 1, int((frame_time - start_time) / frame_delay) + 1)
+
+            x, y = self.get_paw_position(frame_time)
+            frame = background.copy()
+            cv2.circle(frame, (int(round(x)), int(round(y))), SimulatedCamera.PAW_RADIUS, (255, 255, 255), -1)
+            self.frame_buffer.write(frame, frame_time)
+
+    # VideoCameraController interface used by MouseTrackingController
+    def get_tracking_buffer(self):
+        return self.frame_buffer
+
+    def get_tracking_roi(self):
+        return None
+
+    def get_frame_dims(self):
+        return self.__width, self.__height
+
+    def get_tracking_frame_dims(self):
+        return self.get_frame_dims()
+
+    def terminate(self):
+        self.open = False
+        self.__thread.join()
+        self.frame_buffer.close()
+
+
+# finds the paw blob of SimulatedCamera frames by its centroid
+# every keypoint is the paw, accuracy 1 if found, 0 if not or on a simulated dropout
+class SimulatedTracker(LiveTracker):
+    KEYPOINTS = 5
+    THRESHOLD = 128
+
+    # inference_time: simulated model inference time (s)
+    # dropout_rate: fraction of frames the paw is reported with accuracy 0
+    def __init__(self, inference_time=0.0, dropout_rate=0.0, seed=None):
+        self.__inference_time = inference_time
+        self.__dropout_rate = dropout_rate
+        self.__random = np.random.default_rng(seed)
+
+    def initialize(self, frame):
+        self.get_keypoints(frame)
+
+    def get_keypoints(self, frame):
+        start_time = time.perf_counter()
+        keypoints = np.zeros((SimulatedTracker.KEYPOINTS, 3))
+
+        moments = cv2.moments(cv2.threshold(frame[:, :, 0], SimulatedTracker.THRESHOLD, 255, cv2.THRESH_BINARY)[1], binaryImage=True)
+        if moments['m00'] > 0 and self.__random.random() >= self.__dropout_rate:
+            keypoints[:] = (moments['m10'] / moments['m00'], moments['m01'] / moments['m00'], 1.0)
+
+        delay = start_time + self.__inference_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return keypoints
+
+    def terminate(self):
+        pass
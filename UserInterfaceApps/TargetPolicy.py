@@ -0,0 +1,73 @@
+import numpy as np
+
+
+# picks the point to centre from the keypoints of a frame (see LiveTracker.get_keypoints())
+# policies work on whole keypoint logs at once (select_all), so a logged run can be replayed with any policy offline
+class TargetPolicy:
+    # threshold: keypoints with an accuracy at or below this are not used
+    def __init__(self, threshold=0.7):
+        self.threshold = threshold
+
+    # keypoints: (frames, keypoints, 3) array of [x, y, accuracy]
+    # return: (frames, 3) array of the target [x, y, accuracy] per frame, NaN where no keypoint qualifies
+    def select_all(self, keypoints):
+        raise NotImplementedError('Use one of the TargetPolicy subclasses.')
+
+    # keypoints: (keypoints, 3) array of one frame
+    # return: target [x, y, accuracy], None if no keypoint qualifies
+    def select(self, keypoints):
+        target = self.select_all(np.asarray(keypoints, dtype=float)[np.newaxis])[0]
+        return None if np.isnan(target[0]) else target
+
+    def _mask(self, targets):
+        targets[~(targets[:, 2] > self.threshold)] = np.nan
+        return targets
+
+
+# one keypoint, e.g. MouseTrackingController.TARGETPAW_IDX
+class KeypointTarget(TargetPolicy):
+    def __init__(self, index, threshold=0.7):
+        super().__init__(threshold)
+        self.index = index
+
+    def select_all(self, keypoints):
+        return self._mask(keypoints[:, self.index].copy())
+
+    def __str__(self):
+        return 'Keypoint({0}, threshold={1})'.format(self.index, self.threshold)
+
+
+# the most confident of some keypoints, e.g. whichever hind paw the tracker sees best
+class MostConfidentTarget(TargetPolicy):
+    def __init__(self, indices, threshold=0.7):
+        super().__init__(threshold)
+        self.indices = list(indices)
+
+    def select_all(self, keypoints):
+        candidates = keypoints[:, self.indices]
+        best = np.argmax(candidates[:, :, 2], axis=1)
+        return self._mask(candidates[np.arange(len(candidates)), best].copy())
+
+    def __str__(self):
+        return 'MostConfident({0}, threshold={1})'.format(self.indices, self.threshold)
+
+
+# weighted mean position of some keypoints, keypoints below the threshold are left out and the weights renormalized
+# weights: {keypoint index: weight}
+class WeightedTarget(TargetPolicy):
+    def __init__(self, weights, threshold=0.7):
+        super().__init__(threshold)
+        self.weights = dict(weights)
+
+    def select_all(self, keypoints):
+        candidates = keypoints[:, list(self.weights.keys())]
+        weights = np.array(list(self.weights.values()), dtype=float) * (candidates[:, :, 2] > self.threshold)
+        total = weights.sum(axis=1)
+
+        targets = np.full((len(candidates), 3), np.nan)
+        valid = total > 0
+        targets[valid] = (candidates[valid] * weights[valid, :, np.newaxis]).sum(axis=1) / total[valid, np.newaxis]
+        return targets
+
+    def __str__(self):
+        return 'Weighted({0}, threshold={1})'.format(self.weights, self.threshold)
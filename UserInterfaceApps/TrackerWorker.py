@@ -0,0 +1,197 @@
+'''
+Tracker inference in its own process
+
+The worker always runs the tracker on the newest frame in the camera's
+SharedFrameBuffer, skipping frames captured while the previous inference was
+running, and publishes timestamped keypoints to a KeypointMailbox in shared
+memory. Consumers read the latest estimate, so a slow model lowers the
+keypoint rate but never builds up a backlog between the camera and the motors.
+'''
+
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from UserInterfaceApps.LiveTracker import LiveTracker
+from UserInterfaceApps.SharedFrameBuffer import SharedFrameBuffer
+
+
+# latest keypoint estimate in shared memory, written by one process and read by others
+# seqlock: the writer makes the version odd while writing, readers retry when it was odd or changed
+class KeypointMailbox:
+    NO_KEYPOINTS = -1
+
+    # keypoints per estimate the mailbox has room for
+    MAX_KEYPOINTS = 32
+
+    # header (int64): [version, estimate sequence number, frame sequence number, number of keypoints]
+    # followed by (float64): [capture time, inference start time, publish time, keypoints (MAX_KEYPOINTS x 3)]
+    HEADER_SIZE = 4
+    TIMES_SIZE = 3
+
+    def __init__(self, max_keypoints=MAX_KEYPOINTS, name=None):
+        self.__max_keypoints = max_keypoints
+
+        # only the process that created the block may unlink it (a forked worker inherits this object as is)
+        self.__owner = name is None
+        self.__owner_pid = os.getpid()
+        if self.__owner:
+            size = 8 * KeypointMailbox.HEADER_SIZE + 8 * (KeypointMailbox.TIMES_SIZE + max_keypoints * 3)
+            self.__shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.__shm = shared_memory.SharedMemory(name=name)
+
+        self.__header = np.ndarray((KeypointMailbox.HEADER_SIZE,), dtype=np.int64, buffer=self.__shm.buf)
+        self.__data = np.ndarray((KeypointMailbox.TIMES_SIZE + max_keypoints * 3,), dtype=np.float64, buffer=self.__shm.buf, offset=8 * KeypointMailbox.HEADER_SIZE)
+
+        if self.__owner:
+            self.__header[:] = [0, KeypointMailbox.NO_KEYPOINTS, SharedFrameBuffer.NO_FRAME, 0]
+            self.__data[:] = 0
+
+    # reattach to the same block when passed to another process
+    def __getstate__(self):
+        return {'name': self.__shm.name, 'max_keypoints': self.__max_keypoints}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_keypoints'], name=state['name'])
+
+    # publish an estimate (one writer only)
+    # keypoints: [[x, y, accuracy], ...] as returned by LiveTracker.get_keypoints()
+    # start_time: when the tracker started on the frame, perf_counter() like capture_time
+    def publish(self, frame_seq, capture_time, keypoints, start_time=None):
+        keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, 3)[:self.__max_keypoints]
+
+        self.__header[0] += 1
+        self.__header[1] += 1
+        self.__header[2] = frame_seq
+        self.__header[3] = len(keypoints)
+        self.__data[0] = capture_time
+        self.__data[2] = time.perf_counter()
+        self.__data[1] = start_time if start_time is not None else self.__data[2]
+        self.__data[3:3 + keypoints.size] = keypoints.ravel()
+        self.__header[0] += 1
+
+    # return: (estimate sequence number, frame sequence number, capture time, inference start time, publish time, keypoints copy)
+    # estimate sequence number is NO_KEYPOINTS if nothing was published yet
+    def read(self):
+        while True:
+            version = int(self.__header[0])
+            if version % 2:
+                continue
+            seq, frame_seq, count = int(self.__header[1]), int(self.__header[2]), int(self.__header[3])
+            capture_time, start_time, publish_time = float(self.__data[0]), float(self.__data[1]), float(self.__data[2])
+            keypoints = self.__data[3:3 + count * 3].reshape(count, 3).copy()
+            if int(self.__header[0]) == version:
+                return seq, frame_seq, capture_time, start_time, publish_time, keypoints
+
+    def get_latest_seq(self):
+        return int(self.__header[1])
+
+    # block until an estimate newer than last_seq is published
+    # return: same as read(), estimate sequence number is NO_KEYPOINTS on timeout
+    def wait(self, last_seq=NO_KEYPOINTS, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.get_latest_seq() <= last_seq:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return KeypointMailbox.NO_KEYPOINTS, SharedFrameBuffer.NO_FRAME, None, None, None, None
+            time.sleep(SharedFrameBuffer.POLL_INTERVAL)
+        return self.read()
+
+    def close(self):
+        self.__header = None
+        self.__data = None
+        self.__shm.close()
+        if self.__owner and self.__owner_pid == os.getpid():
+            self.__shm.unlink()
+            self.__owner = False
+
+
+class TrackerWorker:
+    # how long the worker may take to load the tracker and initialize it on a first frame
+    INIT_TIMEOUT = 30.0
+
+    # how long the worker waits for a new frame before checking for stop
+    FRAME_TIMEOUT = 0.5
+
+    # run tracker_class(**tracker_kwargs) on the frames of frame_buffer in a new process
+    # tracker_class: LiveTracker implementation, must be importable from the worker process
+    # exceptions: the tracker failed to load or to initialize
+    def __init__(self, frame_buffer, tracker_class=LiveTracker, tracker_kwargs=None, max_keypoints=KeypointMailbox.MAX_KEYPOINTS):
+        self.mailbox = KeypointMailbox(max_keypoints)
+        self.__stop_event = mp.Event()
+        status_queue = mp.Queue()
+
+        self.proc = mp.Process(target=TrackerWorker.run, daemon=True, kwargs={
+            'frame_buffer': frame_buffer,
+            'mailbox': self.mailbox,
+            'tracker_class': tracker_class,
+            'tracker_kwargs': tracker_kwargs or {},
+            'stop_event': self.__stop_event,
+            'status_queue': status_queue})
+        self.proc.start()
+
+        # None once the tracker is initialized, the error message otherwise
+        try:
+            error = status_queue.get(timeout=TrackerWorker.INIT_TIMEOUT)
+        except queue.Empty:
+            error = 'Tracker did not initialize within ' + str(TrackerWorker.INIT_TIMEOUT) + ' s.'
+        if error is not None:
+            self.terminate()
+            raise Exception(error)
+
+    @staticmethod
+    def run(frame_buffer=None, mailbox=None, tracker_class=LiveTracker, tracker_kwargs={}, stop_event=None, status_queue=None):
+        try:
+            tracker = tracker_class(**tracker_kwargs)
+            seq, capture_time, frame = frame_buffer.wait_for_frame(timeout=TrackerWorker.INIT_TIMEOUT)
+            if seq < 0:
+                raise Exception('Unable to grab frame to initialize.')
+            seq, capture_time, frame = frame_buffer.copy_latest()
+            tracker.initialize(frame)
+        except Exception as err:
+            status_queue.put(str(err))
+            return
+        status_queue.put(None)
+
+        last_seq = SharedFrameBuffer.NO_FRAME
+        while not stop_event.is_set():
+            # newest frame only, frames captured during the last inference are skipped
+            seq, capture_time, frame = frame_buffer.wait_for_frame(last_seq, timeout=TrackerWorker.FRAME_TIMEOUT)
+            if seq < 0:
+                continue
+
+            # copy out of shared memory: inference may outlast the ring
+            # a frame overwritten while it was copied is torn, skip it
+            seq, capture_time, frame = frame_buffer.copy(seq)
+            if seq < 0:
+                continue
+            last_seq = seq
+
+            start_time = time.perf_counter()
+            mailbox.publish(seq, capture_time, tracker.get_keypoints(frame), start_time)
+
+        tracker.terminate()
+        mailbox.close()
+
+    # see KeypointMailbox.read()
+    def get_keypoints(self):
+        return self.mailbox.read()
+
+    # see KeypointMailbox.wait()
+    def wait_for_keypoints(self, last_seq=KeypointMailbox.NO_KEYPOINTS, timeout=None):
+        return self.mailbox.wait(last_seq, timeout)
+
+    def terminate(self, timeout=1.0):
+        self.__stop_event.set()
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.kill()
+        # the worker no longer writes to the mailbox, free its shared memory now rather than on garbage collection
+        self.mailbox.close()
+
+    def __del__(self):
+        self.mailbox.close()
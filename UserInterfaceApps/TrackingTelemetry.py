@@ -0,0 +1,141 @@
+import threading
+from threading import Lock
+
+import numpy as np
+
+from .RunFileWriter import RunFileWriter
+from DebugLog.DebugLog import *
+
+
+# tracking data of one autodetect run (see MouseTrackingController.motor_follow())
+# samples go into a preallocated structured buffer, a flush thread appends it to the trial's HDF5 tracking dataset
+# every FLUSH_INTERVAL (see RunFileWriter.create_tracking_dataset()), so memory stays bounded and a crash loses
+# at most FLUSH_INTERVAL of telemetry
+# without a file the buffer grows and keeps everything in memory
+class TrackingTelemetry:
+    # columns of RunFileWriter.TRACKING_COLUMNS
+    DTYPE = np.dtype([('time', '<f8'), ('x_error', '<f8'), ('x_velocity', '<f8'), ('y_error', '<f8'), ('y_velocity', '<f8'),
+        ('queue_latency', '<f8'), ('inference_latency', '<f8'), ('handoff_latency', '<f8'), ('control_latency', '<f8'), ('command_latency', '<f8')])
+    LATENCIES = 5
+
+    # samples (rows), also the HDF5 chunk size
+    BUFFER_SIZE = 1024
+    # seconds between flushes to the file
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, buffer_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.__buffer_size = buffer_size
+        self.__flush_interval = flush_interval
+        self.__buffer = np.empty(buffer_size, dtype=TrackingTelemetry.DTYPE)
+        self.__count = 0
+        self.__buffer_lock = Lock()
+        # serializes file writes of the flush thread and stop()
+        self.__file_lock = Lock()
+
+        # (selected_folder, filename, mouse_id, trial_id), None: memory only
+        self.__file = None
+        self.__flush_thread = None
+        self.__flush_event = threading.Event()
+        self.__stop = False
+
+    # stream to the tracking dataset of a trial, None to keep the data in memory
+    # the dataset is created empty, overwrite if exists
+    def set_file(self, selected_folder=None, filename=None, mouse_id=None, trial_id=None):
+        with self.__file_lock:
+            self.__file = (selected_folder, filename, mouse_id, trial_id) if selected_folder else None
+            if self.__file:
+                RunFileWriter.create_tracking_dataset(*self.__file, self.__buffer_size)
+        self.__clear_buffer()
+
+    # drop all samples, the tracking dataset is emptied
+    def clear(self):
+        with self.__file_lock:
+            if self.__file:
+                RunFileWriter.create_tracking_dataset(*self.__file, self.__buffer_size)
+        self.__clear_buffer()
+
+    # start flushing to the file
+    def start(self):
+        if self.__file and not self.__flush_thread:
+            self.__stop = False
+            self.__flush_thread = threading.Thread(target=self.__flush_loop, daemon=True)
+            self.__flush_thread.start()
+
+    # stop flushing, everything buffered is written
+    def stop(self):
+        if self.__flush_thread:
+            self.__stop = True
+            self.__flush_event.set()
+            self.__flush_thread.join()
+            self.__flush_thread = None
+        self.flush()
+
+    # called from the control loop, O(1) unless the buffer has to grow
+    # latencies: queue, inference, handoff, control and command latency (s), see LatencyStats, NaN if None
+    def append(self, t, x_error, x_velocity, y_error, y_velocity, latencies=None):
+        if latencies is None:
+            latencies = (np.nan,) * TrackingTelemetry.LATENCIES
+        with self.__buffer_lock:
+            if self.__count == len(self.__buffer):
+                # memory only, or the flush thread fell behind
+                self.__buffer = np.resize(self.__buffer, 2 * len(self.__buffer))
+            self.__buffer[self.__count] = (t, x_error, x_velocity, y_error, y_velocity, *latencies)
+            self.__count += 1
+            full = self.__count == len(self.__buffer)
+
+        if full and self.__file:
+            self.__flush_event.set()
+
+    # append the buffered samples to the file
+    def flush(self):
+        with self.__file_lock:
+            if not self.__file:
+                return
+
+            with self.__buffer_lock:
+                rows = TrackingTelemetry.to_array(self.__buffer[:self.__count])
+                self.__count = 0
+
+            if len(rows):
+                try:
+                    RunFileWriter.append_tracking_data(*self.__file, rows)
+                except Exception as err:
+                    DebugLog.debugprint(self, 'Failed to write tracking data: ' + str(err))
+
+    # save metadata with the tracking dataset, nothing without a file
+    def set_attributes(self, attributes):
+        with self.__file_lock:
+            if self.__file:
+                try:
+                    RunFileWriter.set_tracking_attributes(*self.__file, attributes)
+                except Exception as err:
+                    DebugLog.debugprint(self, 'Failed to write tracking data attributes: ' + str(err))
+
+    # return: all samples so far as an (N, len(RunFileWriter.TRACKING_COLUMNS)) array
+    def get_data(self):
+        with self.__file_lock:
+            with self.__buffer_lock:
+                rows = TrackingTelemetry.to_array(self.__buffer[:self.__count])
+
+            if self.__file:
+                written = RunFileWriter.load_tracking_data(*self.__file)
+                if written is not None:
+                    rows = np.concatenate((written, rows))
+        return rows
+
+    # structured samples to an (N, columns) float array
+    @staticmethod
+    def to_array(samples):
+        return samples.view(np.float64).reshape(len(samples), len(TrackingTelemetry.DTYPE.names)).copy()
+
+    def __clear_buffer(self):
+        with self.__buffer_lock:
+            if len(self.__buffer) != self.__buffer_size:
+                self.__buffer = np.empty(self.__buffer_size, dtype=TrackingTelemetry.DTYPE)
+            self.__count = 0
+
+    def __flush_loop(self):
+        while not self.__stop:
+            self.__flush_event.wait(self.__flush_interval)
+            self.__flush_event.clear()
+            self.flush()
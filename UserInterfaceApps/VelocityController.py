@@ -0,0 +1,83 @@
+import math
+
+
+# maps the pixel error of one axis to a signed motor velocity
+# positive velocity: rotate_ccw, negative: rotate_cw, 0: stop (see MouseTrackingController.motor_follow)
+# this base class is the original bang-bang control: full velocity outside the deadband
+class VelocityController:
+    # velocity: velocity outside the deadband
+    # deadband: errors smaller than this (px) stop the motor
+    def __init__(self, velocity=50000, deadband=10):
+        self.max_velocity = velocity
+        self.deadband = deadband
+
+    # forget the state, e.g. when the paw was lost
+    def reset(self):
+        pass
+
+    # error: pixel error, t: capture time of the frame the error was measured in (s)
+    # return: velocity
+    def update(self, error, t):
+        if abs(error) < self.deadband:
+            return 0
+        return math.copysign(self.max_velocity, error)
+
+    def __str__(self):
+        return 'BangBang(v={0})'.format(self.max_velocity)
+
+
+# PID control with velocity limits
+# anti-windup: the integral only accumulates while the output is not saturated (or when the error unwinds it)
+class PIDController(VelocityController):
+    # kp: velocity per px, ki: velocity per px*s, kd: velocity per px/s
+    # max_velocity: output limit
+    # min_velocity: smallest velocity commanded outside the deadband, overcomes stiction of the stage
+    def __init__(self, kp, ki=0.0, kd=0.0, max_velocity=50000, deadband=10, min_velocity=0):
+        super().__init__(max_velocity, deadband)
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.min_velocity = min_velocity
+        self.reset()
+
+    def reset(self):
+        self.__integral = 0.0
+        self.__last_error = None
+        self.__last_time = None
+
+    def update(self, error, t):
+        dt = t - self.__last_time if self.__last_time is not None else 0.0
+        derivative = (error - self.__last_error) / dt if dt > 0 else 0.0
+        self.__last_error = error
+        self.__last_time = t
+
+        # inside the deadband the motor stops, so there is nothing to integrate
+        if abs(error) < self.deadband:
+            self.__integral = 0.0
+            return 0
+
+        integral = self.__integral + error * dt
+        velocity = self.kp * error + self.ki * integral + self.kd * derivative
+        # while saturated only integrate an error that unwinds the integral (anti-windup)
+        if abs(velocity) <= self.max_velocity or error * self.__integral < 0:
+            self.__integral = integral
+        else:
+            velocity = self.kp * error + self.ki * self.__integral + self.kd * derivative
+
+        velocity = max(-self.max_velocity, min(self.max_velocity, velocity))
+        if abs(velocity) < self.min_velocity:
+            velocity = math.copysign(self.min_velocity, velocity)
+        return velocity
+
+    def __str__(self):
+        return 'PID(kp={0}, ki={1}, kd={2}, vmax={3})'.format(self.kp, self.ki, self.kd, self.max_velocity)
+
+
+class PController(PIDController):
+    def __init__(self, kp, max_velocity=50000, deadband=10, min_velocity=0):
+        super().__init__(kp, 0.0, 0.0, max_velocity, deadband, min_velocity)
+
+
+class PIController(PIDController):
+    def __init__(self, kp, ki, max_velocity=50000, deadband=10, min_velocity=0):
+        super().__init__(kp, ki, 0.0, max_velocity, deadband, min_velocity)
@@ -1,12 +1,19 @@
 import cv2
 import time
+import collections
 from datetime import datetime
 import multiprocessing as mp
-import queue
 import os
 from UserInterfaceApps.RunFileWriter import RunFileWriter
+from UserInterfaceApps.SharedFrameBuffer import SharedFrameBuffer
+from UserInterfaceApps.VideoRecorder import VideoRecorder
+from UserInterfaceApps.VideoEncoders import VideoEncoders
+from DebugLog.DebugLog import *
 
 class FrameManipulator:
+    # BGR
+    CROSSHAIR_COLOR = (45, 227, 0)
+
     @staticmethod
     def convert_BGR2RGB(frame):
         return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -16,10 +23,10 @@ class FrameManipulator:
     def draw_timestamp(frame, timestamp):
         return cv2.putText(frame, str(timestamp), (10, 20), cv2.FONT_HERSHEY_PLAIN, 1, (0, 0, 0), 1, cv2.LINE_AA)
 
-    # draw blue crosshair on frame
+    # draw green crosshair on frame
     @staticmethod
-    def draw_crosshair(frame, position):
-        return cv2.circle(frame, position, 10, (45, 227, 0), 2)
+    def draw_crosshair(frame, position, color=CROSSHAIR_COLOR):
+        return cv2.circle(frame, position, 10, color, 2)
 
 
 class VideoCameraController:
@@ -27,9 +34,28 @@ class VideoCameraController:
     FPS = 30
     TARGET = (0.5, 0.5)
 
+    # save_queue messages that end a recording (see start_video_recording for the one that starts it)
+    STOP_RECORDING = False
+    DISCARD_RECORDING = None
+
+    # seconds of video kept from before start_video_recording, included at the start of each video file
+    PREROLL_TIME = 1.0
+
+    # write a per-frame timestamp sidecar next to each video (see RunFileWriter.save_frametimes)
+    WRITE_FRAMETIMES = True
+
     # exceptions: on connection error
-    def __init__(self, video_source=0):
+    # encoder: name in VideoEncoders.REGISTRY used for trial videos
+    # camera: name of the camera, used in video file names (see RunFileWriter.format_datafilename)
+    # tracking_roi: FrameROI of a second, smaller stream for mouse tracking (see wait_for_tracking_frame)
+    # recording_roi: FrameROI to record instead of the whole frame
+    def __init__(self, video_source=0, preroll_time=PREROLL_TIME, encoder=VideoEncoders.DEFAULT, camera=RunFileWriter.SUBSTAGE_CAMERA, tracking_roi=None, recording_roi=None):
         self.__video_source = video_source
+        self.__camera = camera
+        self.__tracking_roi = tracking_roi
+        self.__recording_roi = recording_roi
+        self.__preroll_time = preroll_time
+        self.__encoder = encoder
         __videocapture = cv2.VideoCapture(video_source, cv2.CAP_DSHOW)
         ret, frame = VideoCameraController.get_frame(__videocapture)
         self.__width = int(__videocapture.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -39,11 +65,21 @@ class VideoCameraController:
         if not ret:
             raise Exception("Failed to open camera")
         __videocapture.release()
-        #frame_array = mp.Array('i',frame)
-        #super().__init__()
-        self.frame_queue = mp.Queue(maxsize=1)
+        # frames are passed to the GUI and mouse tracking through shared memory
+        self.frame_buffer = SharedFrameBuffer(frame.shape, dtype=frame.dtype)
+        self.roi_buffer = None
+        if tracking_roi:
+            tracking_roi.set_frame_shape(frame.shape)
+            self.roi_buffer = SharedFrameBuffer(tracking_roi.get_shape(frame.shape), dtype=frame.dtype)
+        if recording_roi:
+            recording_roi.set_frame_shape(frame.shape)
         self.save_queue = mp.Queue(maxsize=1)
-        self.frame_times_queue = mp.Queue(maxsize=1)
+        # (recording number, frame info) of every written recording. Unbounded, so the recorder never waits
+        # on a GUI that didn't fetch the frame info of an earlier recording (see get_frame_info)
+        self.frame_times_queue = mp.Queue()
+        self.__video_filepath = None
+        self.__recording_number = 0
+        self.__last_frame_info = None
         self.__save_frame_queue = mp.Queue(maxsize=1)
         self.__save_frame_queue.put(False)
         self.run_process()
@@ -51,44 +87,117 @@ class VideoCameraController:
     def terminate(self):
         self.open = False
 
+    def get_camera(self):
+        return self.__camera
+
+    # get the newest frame for display
+    # note: the frame is a view into shared memory, do not draw on it
     def get_last_frame(self):
-        if self.frame_queue.empty():
-            return self.last_frame
-        else:
-            self.last_frame = self.frame_queue.get()
+        seq, timestamp, frame = self.frame_buffer.read_latest()
+        if frame is None:
             return self.last_frame
+        return frame
+
+    # get the newest frame
+    # return: (sequence number, frame), sequence number is negative if no frame was captured yet
+    def get_latest_frame(self):
+        seq, timestamp, frame = self.frame_buffer.read_latest()
+        return seq, frame
+
+    # block until a frame newer than last_seq is captured
+    # return: (sequence number, frame), sequence number is negative on timeout
+    def wait_for_frame(self, last_seq=SharedFrameBuffer.NO_FRAME, timeout=None):
+        seq, timestamp, frame = self.frame_buffer.wait_for_frame(last_seq, timeout)
+        return seq, frame
+
+    # same as wait_for_frame(), but from the tracking ROI stream if there is one
+    # map keypoints found in these frames back with get_tracking_roi().to_frame()
+    def wait_for_tracking_frame(self, last_seq=SharedFrameBuffer.NO_FRAME, timeout=None):
+        if not self.roi_buffer:
+            return self.wait_for_frame(last_seq, timeout)
+        seq, timestamp, frame = self.roi_buffer.wait_for_frame(last_seq, timeout)
+        return seq, frame
+
+    # get the SharedFrameBuffer of the tracking stream (the ROI stream if there is one)
+    def get_tracking_buffer(self):
+        return self.roi_buffer if self.roi_buffer else self.frame_buffer
+
+    # return: FrameROI of the tracking stream, None if tracking uses whole frames
+    def get_tracking_roi(self):
+        return self.__tracking_roi
+
+    def get_recording_roi(self):
+        return self.__recording_roi
+
+    # get the dimensions of the frames returned by wait_for_tracking_frame()
+    def get_tracking_frame_dims(self):
+        if self.__tracking_roi:
+            return self.__tracking_roi.get_dims()
+        return self.get_frame_dims()
 
     def run_process(self):
         self.proc = mp.Process(target=self.run,kwargs={
-            'frame_queue':self.frame_queue,
+            'frame_buffer':self.frame_buffer,
+            'roi_buffer':self.roi_buffer,
+            'tracking_roi':self.__tracking_roi,
+            'recording_roi':self.__recording_roi,
             'save_queue':self.save_queue,
             'times_queue':self.frame_times_queue,
-            'video_source':self.__video_source})
+            'video_source':self.__video_source,
+            'preroll_time':self.__preroll_time,
+            'encoder':self.__encoder})
         self.proc.start()
     
-    # start saving the acquired frames
-    def start_video_recording(self):
-        self.save_queue.put(True)
-
-    # stop saving frames and write to .avi file
-    def stop_video_recording(self, selected_folder, filename, mouse_id, trial_id, write_to_file=True):
+    # start encoding the acquired frames to [selected_folder]/[filename]_videos/[video file]
+    # the video begins with the pre-roll: up to preroll_time seconds of frames captured before this call
+    # start_time: time.perf_counter() the frame times are relative to, defaults to now.
+    # Pass the same start_time to several cameras to put their frame times on one clock (see CaptureManager)
+    # return: video file path relative to selected_folder
+    def start_video_recording(self, selected_folder, filename, mouse_id, trial_id, start_time=None):
+        if start_time is None:
+            start_time = time.perf_counter()
+        abs_video_path = selected_folder + '/' + filename + '_videos'
+        rel_video_path = './' + filename + '_videos'
+        if not os.path.exists(abs_video_path):
+            os.mkdir(abs_video_path)
+        filenames = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.AVI_EXTENSION, self.__camera)
+        video_filename = VideoEncoders.format_filename(filenames['video_file'], self.__encoder)
+        self.__video_filepath = rel_video_path + '/' + video_filename
+        self.__last_frame_info = None
+        self.__recording_number += 1
+        self.save_queue.put((abs_video_path + '/' + video_filename, start_time, self.__recording_number))
+        return self.__video_filepath
+
+    # stop saving frames and close the video file (deleted if write_to_file is False)
+    # return: video file path relative to selected_folder, None if discarded
+    def stop_video_recording(self, write_to_file=True):
         if write_to_file:
-            abs_video_path = selected_folder + '/' + filename + '_videos'
-            rel_video_path = './' + filename + '_videos'
-            if not os.path.exists(abs_video_path):
-                os.mkdir(abs_video_path)
-            filenames = RunFileWriter.format_datafilename(filename, mouse_id, trial_id, RunFileWriter.AVI_EXTENSION)
-            video_filename = filenames['video_file']
-            filepath = rel_video_path + '/' + video_filename
-            self.save_queue.put(abs_video_path + '/' + video_filename)
-            return filepath
+            self.save_queue.put(VideoCameraController.STOP_RECORDING)
+            return self.__video_filepath
         else:
+            self.save_queue.put(VideoCameraController.DISCARD_RECORDING)
             return None
     
+    # get the frame times of the last recording, relative to its start_time (pre-roll frames are negative)
+    # blocks until the recording has been written
     def get_frame_times(self):
-        return self.frame_times_queue.get()
-
-    def run(self, frame_queue = None, save_queue = None, times_queue = None, video_source=0,target=(0.5,0.5)):
+        return self.get_frame_info()['times']
+
+    # get the per-frame record of the last recording
+    # blocks until the recording has been written, do not call for a discarded recording
+    # 'times': monotonic capture times, relative to the start_time of start_video_recording
+    # 'indices': frame index in the capture schedule, gaps are dropped frames
+    # 'backend_times': timestamps reported by the capture backend
+    # 'dropped_frames': frames missed by capture or the encoder during the recording
+    def get_frame_info(self):
+        while self.__last_frame_info is None:
+            # skip the frame info of earlier recordings that was never fetched
+            recording_number, frame_info = self.frame_times_queue.get()
+            if recording_number == self.__recording_number:
+                self.__last_frame_info = frame_info
+        return self.__last_frame_info
+
+    def run(self, frame_buffer = None, save_queue = None, times_queue = None, video_source=0,target=(0.5,0.5), preroll_time=PREROLL_TIME, encoder=VideoEncoders.DEFAULT, roi_buffer=None, tracking_roi=None, recording_roi=None):
 
         # open video source
         __videocapture = cv2.VideoCapture(video_source, cv2.CAP_DSHOW)
@@ -99,74 +208,95 @@ class VideoCameraController:
         __width = int(__videocapture.get(cv2.CAP_PROP_FRAME_WIDTH))
         __height = int(__videocapture.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-        __prev_frame_time = time.perf_counter()
-
         __frame_delay = 1.0 / VideoCameraController.FPS
 
+        # recordings are cropped/decimated on the encoder thread
+        __record_width, __record_height = recording_roi.get_dims() if recording_roi else (__width, __height)
+
         # Target position
         # target: Fraction of frame x,y dimensions to draw the crosshair and for autodetect to use for center
         __target_position = (int(__width*target[0]), int(__height*target[1]))
-        save_fname = False
-        saved_frames = []
-        saved_frame_times = []
+        recorder = None
+        # (frame, capture time, frame index, backend time) of the last preroll_time seconds while not recording
+        preroll = collections.deque()
+
+        # frame schedule: frame k is due at __start_time + k * __frame_delay
+        # deadlines are absolute, so sleep/grab jitter does not accumulate into drift
+        __start_time = time.perf_counter()
+        __frame_index = -1
         while True:
-            # delay according to camera fps
-            if time.perf_counter() - __prev_frame_time >= __frame_delay:
-                ret, frame = VideoCameraController.get_frame(__videocapture)
-                if ret:
-
-                    __prev_frame_time = time.perf_counter()
-
-                    # draw on frame
-                    #timestamp_frame = FrameManipulator.draw_timestamp(frame, datetime.now())
-                    #target_frame = FrameManipulator.draw_crosshair(timestamp_frame, __target_position)
-
-                    # frame must be RGB to display
-                    #im_frame = FrameManipulator.convert_BGR2RGB(target_frame)
-
-                    # display image
-                    #self.__photo = PIL.ImageTk.PhotoImage(image=PIL.Image.fromarray(im_frame))
-                    
-                    #The update rate of the camera is faster than the GUI is reading frames fromt he queue, so it will happen that 
-                    #there is still a frame in the queue when the next frame is collected. In that case, check if the queue is full, (size =1)
-                    #then if it is, get the frame in there and discard it so that we can put in the latest frame. If we don't use block=False
-                    #then it does happen that we check that the queue is full and then in the time it takes to execute the next line, 
-                    #the frame gets read by UserInterface and then we are stuck waiting to take out a frame that isn't there anymore.
-                    #TODO use shared memory to pass frames rather than queue.
-                    # This way VideoCameraController can just update the frames and UserInterface/MouseTrackingController can read the frames as they update
-                    if frame_queue:
-                        if frame_queue.full():
-                            try:
-                                frame_queue.get(block=False)
-                            except queue.Empty:
-                                pass
-                            
-                        frame_queue.put(frame)
-
-                    #self.__camera_label.config(image=self.__photo)
-                    #self.__camera_label.image = self.__photo
-
-                    # save frame when recording
-                    if not(save_queue.empty()):
-                        save_fname = save_queue.get()
-                        t0 = time.perf_counter()
-                    if save_fname == True:
-                        saved_frames.append(frame)
-                        saved_frame_times.append(__prev_frame_time - t0)
-                    elif len(saved_frames) > 0:
-                        VideoCameraController.write_to_file(save_fname, saved_frames, saved_frame_times,__width,__height)
-                        saved_frames.clear()
-                        times_queue.put(saved_frame_times.copy())
-                        saved_frame_times.clear()
-
-                    
-        
+            # sleep until the next frame is due instead of spinning on the clock
+            delay = __start_time + (__frame_index + 1) * __frame_delay - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            # grab() blocks until the camera delivers a frame, stamp it as close to that as possible
+            ret, frame, __frame_time, __backend_time = VideoCameraController.grab_frame(__videocapture)
+            if not ret:
+                continue
+
+            # index by schedule slot, a slot without a frame is a dropped frame
+            # (the recorder counts the gaps in the indices of a recording, see get_frame_info)
+            __frame_index = max(__frame_index + 1, round((__frame_time - __start_time) / __frame_delay))
+
+            # publish the frame to shared memory. UserInterface/MouseTrackingController read the newest slot
+            # directly, so there is no queue to drain and no pickling of frames between processes
+            if frame_buffer:
+                frame_buffer.write(frame, __frame_time)
+            # the tracker subscribes to the smaller ROI stream
+            if roi_buffer:
+                roi_buffer.write(tracking_roi.apply(frame), __frame_time)
+
+            # start/stop recording: (video file path, start time, recording number) starts, STOP_RECORDING/DISCARD_RECORDING stops
+            if not(save_queue.empty()):
+                message = save_queue.get()
+                if recorder:
+                    # the writer thread finishes the file and reports the frame times
+                    recorder.stop(discard=(message == VideoCameraController.DISCARD_RECORDING))
+                    recorder = None
+
+                if message not in (VideoCameraController.STOP_RECORDING, VideoCameraController.DISCARD_RECORDING):
+                    # perf_counter() is system-wide, so the start time from the GUI process is on this process' clock
+                    video_filepath, t0, recording_number = message
+                    try:
+                        # leave room in the encoder queue for the pre-roll on top of the usual backlog
+                        recorder = VideoRecorder(video_filepath, __record_width, __record_height, VideoCameraController.FPS, on_finished=lambda frame_info, recording_number=recording_number: times_queue.put((recording_number, frame_info)),
+                            queue_size=VideoRecorder.QUEUE_SIZE + len(preroll), write_frametimes=VideoCameraController.WRITE_FRAMETIMES, encoder=encoder, roi=recording_roi)
+                        for preroll_frame, preroll_frame_time, preroll_frame_index, preroll_backend_time in preroll:
+                            recorder.write(preroll_frame, preroll_frame_time - t0, preroll_frame_index, preroll_backend_time)
+                        preroll.clear()
+                    except Exception as err:
+                        DebugLog.debugprint(self, 'Failed to start recording: ' + str(err))
+
+            # hand the frame to the encoder thread, never waits on encoding
+            if recorder:
+                recorder.write(frame, __frame_time - t0, __frame_index, __backend_time)
+
+            # keep the pre-roll for the next recording
+            # frames returned by retrieve() are not reused by OpenCV, so no copy is needed
+            elif preroll_time > 0:
+                preroll.append((frame, __frame_time, __frame_index, __backend_time))
+                while __frame_time - preroll[0][1] > preroll_time:
+                    preroll.popleft()
+
         self.finished=True
 
     # get the camera dimensions
     def get_frame_dims(self):
         return self.__width, self.__height
 
+    # grab one frame from the camera and stamp it
+    # return: (ret, frame, monotonic capture time in s, capture backend timestamp in s)
+    @staticmethod
+    def grab_frame(videocapture):
+        if videocapture.isOpened() and videocapture.grab():
+            frame_time = time.perf_counter()
+            backend_time = videocapture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            ret, frame = videocapture.retrieve()
+            if ret:
+                return ret, frame, frame_time, backend_time
+        return False, None, None, None
+
     # read one frame from the camera
     @staticmethod
     def get_frame(videocapture):
@@ -193,37 +323,14 @@ class VideoCameraController:
         self.__savedframes.append(frame)
         self.__frame_times.append(time)
 
-    # create a new video file (.avi or .mp4)
-    @staticmethod
-    def write_to_file(filename,__savedframes,__frame_times,__width,__height):
-        if filename and __savedframes:
-
-
-            # frame times start at 0
-            __frame_times = [x - __frame_times[0] for x in __frame_times]
-
-            # use fps calculated from saved frames
-            arr = [j-i for i, j in zip(__frame_times[:-1], __frame_times[1:])]
-            fps_avg = 1.0 / (sum(arr) / len(arr))
-            print('Avg FPS: ',fps_avg)
-
-            if '.avi' in filename:
-                __out = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'DIVX'), fps_avg, (__width, __height))
-            elif '.mp4' in filename:
-                __out = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'mp4v'), fps_avg, (__width, __height))
-
-            # output all saved frames to the created video file
-            for frame in __savedframes:
-                __out.write(frame)
-
-            # close the video file, save a local record of the frames
-            __out.release()
-
     def get_target(self):
         return self.__target_position
 
     def __del__(self):
         self.terminate()
+        self.frame_buffer.close()
+        if self.roi_buffer:
+            self.roi_buffer.close()
 
         # if self.__videocapture.isOpened():
         #     self.__videocapture.release()
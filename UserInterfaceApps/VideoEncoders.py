@@ -0,0 +1,74 @@
+'''
+Registry of video encoders available to VideoRecorder
+
+Each encoder is a FOURCC code, the container it is written to and the
+cv2.VideoWriter backend that provides it. Encoders can be added at runtime
+with VideoEncoders.register(). Use EncoderBenchmark.py to compare them on
+recorded trials.
+'''
+
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+
+class VideoEncoders:
+    DEFAULT = 'DIVX'
+
+    # name: (fourcc, file extension, VideoWriter backend, description)
+    REGISTRY = {
+        'DIVX': ('DIVX', '.avi', cv2.CAP_ANY, 'MPEG-4 Part 2 (legacy default)'),
+        'MP4V': ('mp4v', '.mp4', cv2.CAP_ANY, 'MPEG-4 Part 2 in MP4'),
+        'MJPG': ('MJPG', '.avi', cv2.CAP_ANY, 'Motion JPEG, intra-only, cheap to encode and seek'),
+        'FFV1': ('FFV1', '.mkv', cv2.CAP_FFMPEG, 'FFV1 lossless'),
+        'H264': ('avc1', '.mp4', cv2.CAP_FFMPEG, 'H.264 through the ffmpeg backend'),
+    }
+
+    @staticmethod
+    def register(name, fourcc, extension, backend=cv2.CAP_ANY, description=''):
+        VideoEncoders.REGISTRY[name] = (fourcc, extension, backend, description)
+
+    @staticmethod
+    def names():
+        return list(VideoEncoders.REGISTRY.keys())
+
+    # exceptions: unknown encoder
+    @staticmethod
+    def get(name):
+        if name not in VideoEncoders.REGISTRY:
+            raise Exception('Unknown video encoder: ' + str(name))
+        return VideoEncoders.REGISTRY[name]
+
+    @staticmethod
+    def get_extension(name):
+        return VideoEncoders.get(name)[1]
+
+    # replace the extension of filename with the one the encoder writes
+    @staticmethod
+    def format_filename(filename, name):
+        return os.path.splitext(filename)[0] + VideoEncoders.get_extension(name)
+
+    # open a cv2.VideoWriter for the encoder
+    # exceptions: unknown encoder, failed to open the video file
+    @staticmethod
+    def open_writer(name, filename, fps, frame_size):
+        fourcc, extension, backend, description = VideoEncoders.get(name)
+        writer = cv2.VideoWriter(filename, backend, cv2.VideoWriter_fourcc(*fourcc), fps, frame_size)
+        if not writer.isOpened():
+            raise Exception('Failed to open video file: ' + filename + ' (encoder ' + name + ')')
+        return writer
+
+    # check that this OpenCV build can write the encoder
+    @staticmethod
+    def is_available(name, frame_size=(64, 48)):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'probe' + VideoEncoders.get_extension(name))
+            try:
+                writer = VideoEncoders.open_writer(name, filename, 30, frame_size)
+            except Exception:
+                return False
+            writer.write(np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8))
+            writer.release()
+            return os.path.isfile(filename) and os.path.getsize(filename) > 0
@@ -1,19 +1,54 @@
 import PIL.Image, PIL.ImageTk
 import cv2
 import threading
+import time
+from collections import OrderedDict
 
+from UserInterfaceApps.RunFileWriter import RunFileWriter
 
+
+# plays a trial video in a Tk label
+# frames are decoded on demand into a small LRU cache, and a prefetch thread decodes ahead of the playhead,
+# so opening a long trial only costs the first frame. Only the Tk thread touches Tk (playback uses after())
 class VideoPlayer:
-    def __init__(self, camera_label):
+    # decoded frames kept in memory (~0.9 MB each at 640x480)
+    CACHE_SIZE = 32
+    # frames decoded ahead of the playhead
+    PREFETCH = 16
+    # used when neither the sidecar nor the container give a frame rate
+    DEFAULT_FPS = 30
+    # how often the prefetch thread checks for work while idle
+    POLL_INTERVAL = 0.05
+
+    # on_position: called with (frame index, time in s) whenever a new frame is shown
+    def __init__(self, camera_label, on_position=None):
         self.__camera_label = camera_label
-        # TODO: get fps from some metadata (currently based on UserInterface.__delay)
-        self.__delay = 15
-        self.__photos = []
+        self.__on_position = on_position
         self.__video_capture = None
         self.__photo = None
-        self.__paused = False
+        # per-frame capture times from the video's sidecar, None if the video has none
+        self.__frame_times = None
+        self.__fps = VideoPlayer.DEFAULT_FPS
+        self.__frame_count = 0
+
+        # index -> decoded RGB frame, least recently used first
+        self.__cache = OrderedDict()
+        self.__cache_lock = threading.Lock()
+        # the VideoCapture is shared by the Tk thread (cache misses) and the prefetch thread
+        self.__capture_lock = threading.Lock()
+        # index of the frame the next read() returns, reading sequentially avoids a seek
+        self.__capture_position = 0
+
+        self.__position = 0
+        self.__playing = False
+        # playback clock: video time self.__play_origin was shown at perf_counter() self.__play_clock
+        self.__play_origin = 0
+        self.__play_clock = 0
+        self.__after_id = None
 
-        self.__playback_thread = None
+        self.__prefetch_event = threading.Event()
+        self.__stop_event = threading.Event()
+        self.__prefetch_thread = None
 
     # exceptions: invalid video file, failed to open file
     def load(self, video_file_path):
@@ -25,46 +60,171 @@ class VideoPlayer:
         if not self.__video_capture.isOpened():
             raise Exception("Failed to open video file.")
 
+        self.__frame_times = RunFileWriter.load_frametimes(video_file_path)
+        self.__fps = self.__video_capture.get(cv2.CAP_PROP_FPS) or VideoPlayer.DEFAULT_FPS
+        if self.__frame_times is not None:
+            self.__frame_count = len(self.__frame_times)
+        else:
+            self.__frame_count = int(self.__video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
         # show first frame
-        ret, frame = self.get_frame()
-        if ret:
-            self.__photo = PIL.ImageTk.PhotoImage(image=PIL.Image.fromarray(frame))
-            self.__camera_label.config(image=self.__photo)
+        self.show_frame(0)
+
+        self.__prefetch_thread = threading.Thread(target=self.__prefetch, daemon=True)
+        self.__prefetch_thread.start()
+
+    # decoded RGB frame at the given index, None if it cannot be decoded
+    def get_frame(self, index):
+        with self.__cache_lock:
+            if index in self.__cache:
+                self.__cache.move_to_end(index)
+                return self.__cache[index]
+        return self.__decode(index)
+
+    def __decode(self, index):
+        with self.__capture_lock:
+            # the other thread may have decoded it while we waited
+            with self.__cache_lock:
+                if index in self.__cache:
+                    return self.__cache[index]
 
-    def get_frame(self):
-        if self.__video_capture.isOpened():
+            if index != self.__capture_position:
+                self.__video_capture.set(cv2.CAP_PROP_POS_FRAMES, index)
             ret, frame = self.__video_capture.read()
-            if ret:
-                return ret, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            return ret, None
-        return None, None
-
-    def loop_video(self):
-        if self.__video_capture and not self.__photos:
-            while self.__video_capture.isOpened():
-                ret, frame = self.get_frame()
-                if ret:
-                    self.__photos.append(PIL.ImageTk.PhotoImage(image=PIL.Image.fromarray(frame)))
-                else:
-                    break
-
-        for photo in self.__photos:
-            self.__camera_label.after(self.__delay, self.show_frame(photo))
-
-    def show_frame(self, photo):
-        self.__camera_label.config(image=photo)
+            if not ret:
+                self.__capture_position = -1
+                return None
+            self.__capture_position = index + 1
+
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+        with self.__cache_lock:
+            self.__cache[index] = frame
+            while len(self.__cache) > VideoPlayer.CACHE_SIZE:
+                self.__cache.popitem(last=False)
+        return frame
+
+    def __prefetch(self):
+        while not self.__stop_event.is_set():
+            index = self.__next_missing()
+            if index is None:
+                self.__prefetch_event.wait(VideoPlayer.POLL_INTERVAL)
+                self.__prefetch_event.clear()
+                continue
+            self.__decode(index)
+
+    # first frame ahead of the playhead that is not cached yet
+    def __next_missing(self):
+        end = min(self.__position + VideoPlayer.PREFETCH, self.__frame_count)
+        with self.__cache_lock:
+            for index in range(self.__position, end):
+                if index not in self.__cache:
+                    return index
+        return None
+
+    # time of the frame at index (s, same clock as the sidecar's frame times)
+    def get_time(self, index):
+        if self.__frame_times is not None:
+            return float(self.__frame_times['time'][index])
+        return index / self.__fps
+
+    # index of the frame showing time t (s, same clock as get_time)
+    def get_index(self, t):
+        if self.__frame_times is not None:
+            return RunFileWriter.frame_at_time(self.__frame_times, t)
+        return min(max(int(t * self.__fps), 0), self.__frame_count - 1)
+
+    # show the frame captured at time t (s, relative to the start of the recording)
+    def seek_time(self, t):
+        self.seek_frame(self.get_index(t))
+
+    # show the frame at the given index in the video file
+    def seek_frame(self, index):
+        if not self.__frame_count:
+            return
+        index = min(max(int(index), 0), self.__frame_count - 1)
+        self.show_frame(index)
+        if self.__playing:
+            self.__play_origin = self.get_time(self.__position)
+            self.__play_clock = time.perf_counter()
 
+    def show_frame(self, index):
+        frame = self.get_frame(index)
+        if frame is None:
+            return
+
+        self.__position = index
+        self.__prefetch_event.set()
+
+        self.__photo = PIL.ImageTk.PhotoImage(image=PIL.Image.fromarray(frame))
+        self.__camera_label.config(image=self.__photo)
+
+        if self.__on_position:
+            self.__on_position(index, self.get_time(index))
+
+    def get_frame_times(self):
+        return self.__frame_times
+
+    def get_frame_count(self):
+        return self.__frame_count
+
+    def get_position(self):
+        return self.__position
+
+    def is_playing(self):
+        return self.__playing
+
+    # play back at the recorded capture times when known
     def play(self):
-        if self.__playback_thread is not None:
-            self.__playback_thread.join()
-        self.__playback_thread = threading.Thread(target=self.loop_video, daemon=True)
-        self.__playback_thread.start()
+        if not self.__video_capture or self.__playing:
+            return
+
+        # start over when at the end
+        if self.__position >= self.__frame_count - 1:
+            self.show_frame(0)
+
+        self.__playing = True
+        self.__play_origin = self.get_time(self.__position)
+        self.__play_clock = time.perf_counter()
+        self.__tick()
 
-    # TODO: implement
     def pause(self):
-        pass
+        self.__playing = False
+        if self.__after_id is not None:
+            self.__camera_label.after_cancel(self.__after_id)
+            self.__after_id = None
+
+    def __tick(self):
+        self.__after_id = None
+        if not self.__playing:
+            return
+
+        # frames that are not decoded in time are skipped, playback keeps to the clock
+        t = self.__play_origin + (time.perf_counter() - self.__play_clock)
+        index = self.get_index(t)
+        if index != self.__position:
+            self.show_frame(index)
+
+        if index >= self.__frame_count - 1:
+            self.pause()
+            return
+
+        delay = self.get_time(index + 1) - (self.__play_origin + (time.perf_counter() - self.__play_clock))
+        self.__after_id = self.__camera_label.after(max(1, int(delay * 1000)), self.__tick)
+
+    def close(self):
+        self.pause()
+        self.__stop_event.set()
+        self.__prefetch_event.set()
+        if self.__prefetch_thread is not None:
+            self.__prefetch_thread.join()
+            self.__prefetch_thread = None
+        with self.__capture_lock:
+            if self.__video_capture and self.__video_capture.isOpened():
+                self.__video_capture.release()
+        with self.__cache_lock:
+            self.__cache.clear()
 
     def __del__(self):
-        if self.__video_capture.isOpened():
+        if self.__video_capture and self.__video_capture.isOpened():
             self.__video_capture.release()
-            cv2.destroyAllWindows()
\ No newline at end of file
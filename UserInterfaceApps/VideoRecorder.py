@@ -0,0 +1,127 @@
+'''
+Streaming video recorder
+
+Frames are handed to a writer thread through a bounded queue and encoded while
+the trial is running, so memory use stays flat regardless of trial length and
+the capture loop never waits on the encoder.
+'''
+
+import os
+import queue
+import threading
+
+import cv2
+
+from DebugLog.DebugLog import *
+from UserInterfaceApps.RunFileWriter import RunFileWriter
+from UserInterfaceApps.VideoEncoders import VideoEncoders
+
+
+class VideoRecorder:
+    # frames waiting to be encoded (about 2 s at 30 FPS, ~60 MB at 640x480)
+    # if the encoder falls this far behind, new frames are dropped instead of stalling capture
+    QUEUE_SIZE = 64
+
+    # how often the writer thread checks for a stop request while idle
+    POLL_INTERVAL = 0.05
+
+    # write_frametimes: also save the per-frame timestamps next to the video (RunFileWriter.save_frametimes),
+    # the container frame rate is nominal and cannot represent capture jitter
+    # encoder: name in VideoEncoders.REGISTRY, filename should have the encoder's extension
+    # roi: FrameROI applied to each frame on the writer thread, width/height are then the ROI's dims
+    # exceptions: unknown encoder, failed to open the video file
+    def __init__(self, filename, width, height, fps, on_finished=None, queue_size=QUEUE_SIZE, write_frametimes=True, encoder=VideoEncoders.DEFAULT, roi=None):
+        self.__filename = filename
+        self.__roi = roi
+        self.__on_finished = on_finished
+        self.__write_frametimes = write_frametimes
+
+        self.__writer = VideoEncoders.open_writer(encoder, filename, fps, (width, height))
+
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__stop_event = threading.Event()
+        self.__discard = False
+
+        self.__frame_times = []
+        self.__frame_indices = []
+        self.__backend_times = []
+        self.__dropped_frames = 0
+
+        self.__thread = threading.Thread(target=self.__encode, daemon=True)
+        self.__thread.start()
+
+    def get_filename(self):
+        return self.__filename
+
+    # queue one frame for encoding, never blocks
+    # frame_index: index in the capture schedule, used to count frames dropped before they got here
+    # return: False if the frame was dropped because the encoder is behind
+    def write(self, frame, frame_time, frame_index=None, backend_time=None):
+        if self.__stop_event.is_set():
+            return False
+
+        try:
+            self.__queue.put_nowait(frame)
+        except queue.Full:
+            self.__dropped_frames += 1
+            return False
+
+        self.__frame_times.append(frame_time)
+        self.__frame_indices.append(frame_index if frame_index is not None else len(self.__frame_indices) + self.__dropped_frames)
+        self.__backend_times.append(backend_time if backend_time is not None else frame_time)
+        return True
+
+    def get_dropped_frames(self):
+        return self.__dropped_frames
+
+    # record of the written frames, see VideoCameraController.get_frame_info()
+    def get_frame_info(self):
+        # every gap in the schedule indices is a frame that is not in the file
+        dropped_frames = 0
+        if self.__frame_indices:
+            dropped_frames = self.__frame_indices[-1] - self.__frame_indices[0] + 1 - len(self.__frame_indices)
+
+        return {
+            'times': self.__frame_times,
+            'indices': self.__frame_indices,
+            'backend_times': self.__backend_times,
+            'dropped_frames': dropped_frames
+        }
+
+    # stop accepting frames. The writer thread encodes what is queued, closes the file
+    # and then calls on_finished(frame_info), so this never blocks the caller
+    def stop(self, discard=False):
+        self.__discard = discard
+        self.__stop_event.set()
+
+    # block until the writer thread has closed the file
+    def join(self, timeout=None):
+        self.__thread.join(timeout)
+
+    def __encode(self):
+        while True:
+            try:
+                frame = self.__queue.get(timeout=VideoRecorder.POLL_INTERVAL)
+            except queue.Empty:
+                if self.__stop_event.is_set():
+                    break
+                continue
+
+            if self.__roi:
+                frame = self.__roi.apply(frame)
+            self.__writer.write(frame)
+
+        self.__writer.release()
+
+        if self.__dropped_frames:
+            DebugLog.debugprint(self, 'Dropped ' + str(self.__dropped_frames) + ' frame(s) while encoding ' + self.__filename)
+
+        if self.__discard:
+            os.remove(self.__filename)
+            return
+
+        if self.__write_frametimes:
+            RunFileWriter.save_frametimes(self.__filename, self.get_frame_info())
+
+        if self.__on_finished:
+            self.__on_finished(self.get_frame_info())
@@ -0,0 +1,36 @@
+import h5py
+import numpy as np
+
+import TuneController
+
+
+def write_tracking_file(path, data):
+    with h5py.File(path, 'w') as hdf5:
+        hdf5.create_group('mouse1').create_group('trial1').create_dataset('trial1_tracking', data=data)
+
+
+def test_negative_velocities_are_sign_extended(tmp_path):
+    gain = 0.002
+    times = np.arange(200) * 0.01
+    velocities = np.where(times < 1.0, -1000.0, 500.0)
+    errors = 100 + np.concatenate(([0], np.cumsum(gain * velocities[:-1] * np.diff(times))))
+
+    # the telemetry records the raw 24 bit VACTUAL field
+    raw = np.where(velocities < 0, velocities + (1 << 24), velocities)
+    data = np.column_stack((times, errors, raw, errors, raw))
+    path = tmp_path / 'session.hdf5'
+    write_tracking_file(path, data)
+
+    (name, loaded), = TuneController.load_tracking_data([path])
+    assert name == 'mouse1/trial1'
+    np.testing.assert_array_equal(loaded[:, 2], velocities)
+    np.testing.assert_array_equal(loaded[:, 4], velocities)
+
+    fitted_gain, disturbance = TuneController.fit_axis(loaded[:, 0], loaded[:, 1], loaded[:, 2])
+    assert np.isclose(fitted_gain, gain)
+    np.testing.assert_allclose(disturbance, 0, atol=1e-9)
+
+
+def test_signed_velocities_are_kept():
+    velocities = np.array([-(1 << 23), -1.0, 0.0, 1.0, (1 << 23) - 1])
+    np.testing.assert_array_equal(TuneController.to_signed_velocity(velocities), velocities)
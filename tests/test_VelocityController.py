@@ -0,0 +1,26 @@
+import pytest
+
+from UserInterfaceApps.VelocityController import PIDController
+
+
+def test_no_windup_while_saturated_with_negative_error():
+    controller = PIDController(kp=5, ki=10, max_velocity=100, deadband=10)
+
+    # kp * error alone saturates the output
+    t = 0.0
+    for _ in range(100):
+        assert controller.update(-50, t) == -100
+        t += 0.1
+
+    # the integral did not grow while saturated, only the new error is integrated
+    assert controller.update(-11, t) == pytest.approx(5 * -11 + 10 * -11 * 0.1)
+
+
+def test_integral_unwinds_while_saturated():
+    controller = PIDController(kp=5, ki=1, max_velocity=100, deadband=10)
+    controller.update(15, 0.0)
+    controller.update(15, 1.0)
+
+    # saturated by the opposite error, which still unwinds the integral
+    assert controller.update(-50, 2.0) == -100
+    assert controller.update(-11, 2.1) == pytest.approx(5 * -11 + (15 - 50 - 1.1))